@@ -0,0 +1,228 @@
+"""
+Artifact store: one directory per job instead of fixed names in OUTPUT_DIR.
+
+A job writes into ``ARTIFACT_DIR/.partial/<id>/`` and the directory is
+renamed to ``ARTIFACT_DIR/<id>/`` when the job completes, so readers only
+ever see finished outputs and concurrent jobs never share a path. "Live"
+jobs (HLS playlists that are played while they are written) write into
+their final directory directly.
+
+Intermediates go to a scratch directory per job, which can live on tmpfs
+(``ARTIFACT_SCRATCH=tmpfs``), and are removed when the job ends.
+
+Finished jobs older than ARTIFACT_MAX_AGE, or beyond ARTIFACT_MAX_BYTES in
+total (oldest first), are evicted by a background thread, so no request
+waits on cleanup.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from config import (
+    ARTIFACT_DIR,
+    ARTIFACT_EVICT_INTERVAL,
+    ARTIFACT_MAX_AGE,
+    ARTIFACT_MAX_BYTES,
+    ARTIFACT_SCRATCH,
+)
+
+PARTIAL = ".partial"
+SCRATCH = ".scratch"
+# Shared-memory filesystem used for ARTIFACT_SCRATCH=tmpfs
+TMPFS_DIR = "/dev/shm"
+
+
+def scratch_root(setting=ARTIFACT_SCRATCH, root=ARTIFACT_DIR):
+    """Directory for intermediates: under the store, on tmpfs, or a given path."""
+    if setting == "tmpfs":
+        base = TMPFS_DIR if os.path.isdir(TMPFS_DIR) else tempfile.gettempdir()
+        return os.path.join(base, "tts-playground")
+    return setting or os.path.join(root, SCRATCH)
+
+
+def scratch_file(suffix="", setting=ARTIFACT_SCRATCH):
+    """Create an empty intermediate file that belongs to no job; the caller removes it."""
+    directory = scratch_root(setting)
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+    os.close(fd)
+    return path
+
+
+def _du(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class Artifact:
+    """Directory of one job; use as a context manager to commit or discard it."""
+
+    def __init__(self, store, job_id, live=False):
+        self.store = store
+        self.id = job_id
+        self.live = live
+        self.committed = False
+        self.final_dir = os.path.join(store.root, job_id)
+        self.work_dir = self.final_dir if live else os.path.join(store.root, PARTIAL, job_id)
+        self.scratch_dir = os.path.join(store.scratch, job_id)
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    @property
+    def directory(self):
+        """Where the job's outputs are right now (final once committed)."""
+        return self.final_dir if self.committed else self.work_dir
+
+    def path(self, name):
+        return os.path.abspath(os.path.join(self.directory, name))
+
+    def scratch(self, name):
+        """Path for an intermediate file, removed when the job is committed or discarded."""
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        return os.path.abspath(os.path.join(self.scratch_dir, name))
+
+    def commit(self):
+        """Publish the outputs with one atomic rename; returns the final directory."""
+        if not self.committed:
+            if not self.live:
+                os.replace(self.work_dir, self.final_dir)
+            self.committed = True
+            self._finish()
+        return self.final_dir
+
+    def discard(self):
+        if not self.committed:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        self._finish()
+
+    def _finish(self):
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        self.store._done(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+class ArtifactStore:
+    """Per-job output directories with background size- and age-based eviction.
+
+    :param max_bytes: Total size of finished jobs to keep (0 = unlimited)
+    :param max_age: Seconds a finished job is kept (0 = forever)
+    :param scratch: ``ARTIFACT_SCRATCH`` setting for intermediates
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, max_bytes=ARTIFACT_MAX_BYTES, max_age=ARTIFACT_MAX_AGE,
+                 scratch=ARTIFACT_SCRATCH, interval=ARTIFACT_EVICT_INTERVAL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.scratch = scratch_root(scratch, root)
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def create(self, kind="job", job_id=None, live=False):
+        """Start a job directory; ``kind`` prefixes the generated ID."""
+        job_id = job_id or f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.start()
+        with self._lock:
+            self._active.add(job_id)
+        return Artifact(self, job_id, live)
+
+    def directory(self, job_id):
+        return os.path.abspath(os.path.join(self.root, job_id))
+
+    def _done(self, artifact):
+        with self._lock:
+            self._active.discard(artifact.id)
+        # Size limits are enforced soon, but never on the caller's thread
+        self._wake.set()
+
+    # --- Retention ---
+
+    def jobs(self):
+        """Finished job directories as (mtime, size, path), oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        with self._lock:
+            active = set(self._active)
+        found = []
+        for entry in os.scandir(self.root):
+            if entry.name.startswith(".") or entry.name in active or not entry.is_dir():
+                continue
+            try:
+                found.append((entry.stat().st_mtime, _du(entry.path), entry.path))
+            except OSError:
+                pass
+        return sorted(found)
+
+    def evict(self, now=None):
+        """Remove expired jobs, then the oldest ones until under ``max_bytes``; returns their paths."""
+        now = now or time.time()
+        removed = []
+        jobs = self.jobs()
+        total = sum(size for _, size, _ in jobs)
+        for mtime, size, path in jobs:
+            expired = self.max_age and now - mtime > self.max_age
+            if not expired and (not self.max_bytes or total <= self.max_bytes):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed.append(path)
+
+        # Leftovers of jobs that died before committing
+        with self._lock:
+            active = set(self._active)
+        for parent in (os.path.join(self.root, PARTIAL), self.scratch):
+            if not self.max_age or not os.path.isdir(parent):
+                continue
+            for entry in os.scandir(parent):
+                try:
+                    stale = entry.name not in active and now - entry.stat().st_mtime > self.max_age
+                except OSError:
+                    continue
+                if stale:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+                    removed.append(entry.path)
+        return removed
+
+    def start(self):
+        """Start the background eviction thread (once per process)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="artifact-eviction", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.evict()
+            except OSError as e:
+                print(f"Warning: artifact eviction failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+# Shared per-process store
+store = ArtifactStore()
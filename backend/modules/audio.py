@@ -0,0 +1,240 @@
+"""
+In-memory audio passed between TTS and lipsync without intermediate WAV files.
+"""
+
+import io
+import os
+import tempfile
+import threading
+import wave
+
+import numpy as np
+
+
+class AudioBuffer:
+    """Mono audio samples plus their sample rate.
+
+    Samples are stored as given (int16 or float32 in [-1, 1]); conversions
+    and resampled versions are computed on demand and kept, so each consumer
+    rate is only resampled once per buffer.
+    """
+
+    def __init__(self, samples, sample_rate):
+        samples = np.asarray(samples)
+        if samples.ndim != 1:
+            raise ValueError("AudioBuffer expects mono samples")
+        if samples.dtype not in (np.int16, np.float32):
+            samples = samples.astype(np.float32)
+        self.samples = samples
+        self.sample_rate = int(sample_rate)
+        self._resampled = {}
+
+    @classmethod
+    def from_pcm(cls, pcm, sample_rate):
+        """Build from raw 16-bit little-endian mono PCM bytes."""
+        return cls(np.frombuffer(pcm, dtype='<i2').astype(np.int16), sample_rate)
+
+    @classmethod
+    def from_wav_bytes(cls, data):
+        return cls._from_wave(wave.open(io.BytesIO(data), 'rb'))
+
+    @classmethod
+    def from_file(cls, path):
+        return cls._from_wave(wave.open(path, 'rb'))
+
+    @classmethod
+    def _from_wave(cls, wav_file):
+        with wav_file:
+            if wav_file.getsampwidth() != 2:
+                raise ValueError("Only 16-bit PCM WAV is supported")
+            channels = wav_file.getnchannels()
+            rate = wav_file.getframerate()
+            samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        return cls(samples.astype(np.int16), rate)
+
+    @property
+    def duration(self):
+        return len(self.samples) / float(self.sample_rate)
+
+    def as_float32(self):
+        if self.samples.dtype == np.float32:
+            return self.samples
+        return self.samples.astype(np.float32) / 32768.0
+
+    def as_int16(self):
+        if self.samples.dtype == np.int16:
+            return self.samples
+        return (np.clip(self.samples, -1.0, 1.0) * 32767.0).astype(np.int16)
+
+    def pcm_bytes(self):
+        return self.as_int16().astype('<i2').tobytes()
+
+    def resample(self, target_rate):
+        """Return this audio at ``target_rate``; the result is cached on the buffer."""
+        target_rate = int(target_rate)
+        if target_rate == self.sample_rate:
+            return self
+        buffer = self._resampled.get(target_rate)
+        if buffer is None:
+            buffer = AudioBuffer(resample(self.as_float32(), self.sample_rate, target_rate), target_rate)
+            self._resampled[target_rate] = buffer
+        return buffer
+
+    def to_wav_bytes(self):
+        out = io.BytesIO()
+        with wave.open(out, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(self.pcm_bytes())
+        return out.getvalue()
+
+    def write(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_wav_bytes())
+        return path
+
+    def ffmpeg_input(self):
+        """ffmpeg arguments that read this audio as raw PCM from stdin."""
+        return ['-f', 's16le', '-ar', str(self.sample_rate), '-ac', '1', '-i', 'pipe:0']
+
+
+def _lowpass_kernel(cutoff, taps=63):
+    """Windowed-sinc low-pass FIR; ``cutoff`` is a fraction of the sample rate."""
+    n = np.arange(taps) - (taps - 1) / 2.0
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def resample(samples, source_rate, target_rate):
+    """Resample float samples with linear interpolation.
+
+    When downsampling, a windowed-sinc low-pass at 90% of the new Nyquist
+    frequency is applied first to avoid aliasing.
+    """
+    if source_rate == target_rate or len(samples) == 0:
+        return samples.astype(np.float32)
+
+    if target_rate < source_rate:
+        cutoff = 0.45 * target_rate / source_rate
+        samples = np.convolve(samples, _lowpass_kernel(cutoff), mode='same')
+
+    n_out = int(round(len(samples) * target_rate / float(source_rate)))
+    positions = np.arange(n_out) * (source_rate / float(target_rate))
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def trim_silence(samples, sample_rate, threshold_db=-50.0, keep_ms=20):
+    """Strip leading and trailing samples quieter than ``threshold_db`` dBFS.
+
+    ``keep_ms`` of the quiet edge is kept on each side so word onsets and
+    decays are not clipped. Float samples in [-1, 1].
+    """
+    loud = np.flatnonzero(np.abs(samples) > 10 ** (threshold_db / 20.0))
+    if not len(loud):
+        return samples[:0]
+    keep = int(sample_rate * keep_ms / 1000)
+    return samples[max(0, loud[0] - keep):loud[-1] + 1 + keep]
+
+
+def concatenate(pieces, sample_rate, pause_ms=0, crossfade_ms=10):
+    """Join float sample arrays in order, ``pause_ms`` of silence apart.
+
+    Every join is faded with raised-cosine ramps of ``crossfade_ms``: into
+    and out of the pause, or, without a pause, as an overlapping crossfade
+    whose gains sum to one. Returns one float32 array.
+    """
+    pieces = [np.asarray(piece, dtype=np.float32) for piece in pieces if len(piece)]
+    if not pieces:
+        return np.zeros(0, dtype=np.float32)
+
+    gap = int(sample_rate * pause_ms / 1000)
+    fade = int(sample_rate * crossfade_ms / 1000)
+    # Fades never take more than half of the shortest piece
+    fade = min([fade] + [len(piece) // 2 for piece in pieces])
+    overlap = fade if gap == 0 else 0
+    ramp = (0.5 - 0.5 * np.cos(np.pi * (np.arange(fade) + 0.5) / fade)).astype(np.float32) if fade else None
+
+    lengths = np.array([len(piece) for piece in pieces])
+    offsets = np.concatenate(([0], np.cumsum(lengths[:-1] + gap - overlap)))
+    out = np.zeros(offsets[-1] + lengths[-1], dtype=np.float32)
+    last = len(pieces) - 1
+    for i, (piece, offset) in enumerate(zip(pieces, offsets)):
+        if fade and last:
+            piece = piece.copy()
+            if i > 0:
+                piece[:fade] *= ramp
+            if i < last:
+                piece[-fade:] *= ramp[::-1]
+        out[offset:offset + len(piece)] += piece
+    return out
+
+
+def load(audio):
+    """Return ``audio`` as an AudioBuffer, reading it from disk if it is a path."""
+    if isinstance(audio, AudioBuffer):
+        return audio
+    return AudioBuffer.from_file(os.fspath(audio))
+
+
+def ffmpeg_input(audio):
+    """Return (ffmpeg input args, stdin bytes) for a path or an AudioBuffer."""
+    if isinstance(audio, AudioBuffer):
+        return audio.ffmpeg_input(), audio.pcm_bytes()
+    return ['-i', os.fspath(audio)], None
+
+
+def ffmpeg_side_input(audio):
+    """Return (ffmpeg input args, pass_fds, on_started, on_finished) for the audio.
+
+    For commands whose stdin already carries something else (raw video
+    frames). In-memory audio is written to an extra pipe on POSIX systems,
+    and to a temporary WAV file elsewhere. Pass ``pass_fds`` to Popen, call
+    ``on_started`` right after starting ffmpeg and ``on_finished`` once it
+    has exited.
+    """
+    if not isinstance(audio, AudioBuffer):
+        return ['-i', os.fspath(audio)], (), _noop, _noop
+
+    if os.name != 'posix':
+        fd, path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        audio.write(path)
+        return ['-i', path], (), _noop, lambda: os.remove(path)
+
+    read_fd, write_fd = os.pipe()
+    pcm = audio.pcm_bytes()
+
+    def feed():
+        with os.fdopen(write_fd, 'wb') as pipe:
+            try:
+                pipe.write(pcm)
+            except BrokenPipeError:
+                pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    args = ['-f', 's16le', '-ar', str(audio.sample_rate), '-ac', '1', '-i', f'pipe:{read_fd}']
+
+    def start():
+        os.close(read_fd)
+        writer.start()
+
+    return args, (read_fd,), start, _noop
+
+
+def _noop():
+    pass
+
+
+def exists(audio):
+    """True for an AudioBuffer or an existing audio file path."""
+    return isinstance(audio, AudioBuffer) or os.path.exists(audio)
+
+
+def describe(audio):
+    """Short label for log messages."""
+    if isinstance(audio, AudioBuffer):
+        return f"<{audio.duration:.2f}s audio @ {audio.sample_rate} Hz>"
+    return str(audio)
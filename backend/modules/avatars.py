@@ -0,0 +1,392 @@
+"""
+Avatar registry: faces preprocessed once and shared as memory-mapped arrays.
+
+Registering an image or a video decodes it, scales it to the render
+resolution (at most AVATAR_MAX_HEIGHT, even dimensions), detects the face
+in every frame and stores the results under ``AVATAR_DIR/<id>/``:
+
+    frames.npy      (N, H, W, 3) uint8 BGR video frames
+    boxes.npy       (N, 4) int32 padded face boxes (y1, y2, x1, x2)
+    face_input.npy  (N, 96, 96, 6) float32 Wav2Lip face input
+    frames_<h>.npy  the frames scaled to each smaller encode profile height
+    boxes_<h>.npy   the face boxes at that height
+    face.png        first frame, for engines that take an image path
+    meta.json       id, source hash, size, fps, frame count and stored heights
+
+Requests then pass the avatar ID wherever a face image path is accepted.
+The arrays are opened with ``mmap_mode='r'``, so every worker process
+reads the same pages from the OS page cache instead of decoding its own
+copy of the image, and a profile's smaller size is read from its own
+mapped array rather than scaled into memory per process.
+
+    python -m backend.modules.avatars register photo.jpg --id anna
+    python -m backend.modules.avatars list
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from config import AVATAR_DIR, AVATAR_MAX_FRAMES, AVATAR_MAX_HEIGHT
+
+# Bump when the stored layout or preprocessing changes
+AVATAR_VERSION = 2
+STILL = "face.png"
+META = "meta.json"
+ID_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+_open = {}
+_lock = threading.Lock()
+
+
+class Avatar:
+    """Frames, face boxes and Wav2Lip face inputs of one avatar.
+
+    Frame ``i`` of a render uses avatar frame ``i % n_frames``, so video
+    avatars loop; a still avatar has a single frame. ``sizes`` maps a
+    height to the (frames, boxes) stored for it at registration.
+    """
+
+    def __init__(self, avatar_id, frames, boxes=None, face_input=None, fps=None, still=None,
+                 sizes=None):
+        self.id = avatar_id
+        self.frames = frames
+        self.boxes = boxes
+        self.face_input = face_input
+        self.fps = fps
+        self.still = still
+        self.sizes = sizes or {}
+
+    @classmethod
+    def from_still(cls, image, asset, still=None):
+        """Single-frame avatar from a decoded image and its ``face_cache.FaceAsset``."""
+        import numpy as np
+
+        return cls(None, image[np.newaxis], np.asarray([asset.box]), asset.face_input[np.newaxis],
+                   still=still)
+
+    @property
+    def n_frames(self):
+        return len(self.frames)
+
+    @property
+    def height(self):
+        return self.frames.shape[1]
+
+    @property
+    def width(self):
+        return self.frames.shape[2]
+
+    @property
+    def has_faces(self):
+        return self.face_input is not None
+
+    def resized(self, max_height):
+        """This avatar scaled down to ``max_height`` (even dimensions), boxes scaled along.
+
+        Heights stored at registration are served from their mapped arrays
+        without a copy; any other height is scaled into memory. The face
+        inputs are kept, as they were cut from the full-size frames.
+        """
+        import numpy as np
+
+        if not max_height or self.height <= max_height:
+            return self
+        if max_height in self.sizes:
+            frames, boxes = self.sizes[max_height]
+        else:
+            frames = np.stack(scale(self.frames, max_height))
+            boxes = scale_boxes(self.boxes, max_height / self.height, frames.shape[1], frames.shape[2])
+        return Avatar(self.id, frames, boxes, self.face_input, self.fps, self.still)
+
+    def frame(self, index):
+        return self.frames[index % self.n_frames]
+
+    def box(self, index):
+        return tuple(int(v) for v in self.boxes[index % self.n_frames])
+
+    def face_batch(self, start, end):
+        """Face input for render frames ``start`` to ``end`` (exclusive).
+
+        A still avatar returns its single (96, 96, 6) input, which the model
+        broadcasts across the batch; otherwise only the frames of this batch
+        are gathered from the mapped array.
+        """
+        import numpy as np
+
+        if self.n_frames == 1:
+            return self.face_input[0]
+        return self.face_input[np.arange(start, end) % self.n_frames]
+
+
+def avatar_dir(avatar_id, root=AVATAR_DIR):
+    return os.path.join(root, avatar_id)
+
+
+def is_registered(face, root=AVATAR_DIR):
+    """True if ``face`` is the ID of a registered avatar (not an image path)."""
+    return (isinstance(face, str) and ID_PATTERN.match(face) is not None
+            and os.path.exists(os.path.join(avatar_dir(face, root), META)))
+
+
+def resolve(face, root=AVATAR_DIR):
+    """Image path for ``face``: the still of a registered avatar, or ``face`` itself."""
+    if is_registered(face, root):
+        return os.path.join(avatar_dir(face, root), STILL)
+    return face
+
+
+def render_heights(height):
+    """Heights below ``height`` that an encode profile scales to, stored at registration."""
+    from backend.modules import encode
+
+    return sorted({profile.max_height for profile in encode.PROFILES.values()
+                   if profile.max_height and profile.max_height < height})
+
+
+def scale_boxes(boxes, factor, height, width):
+    """Face boxes (y1, y2, x1, x2) scaled by ``factor`` and clipped to a ``width`` x ``height`` frame."""
+    import numpy as np
+
+    if boxes is None:
+        return None
+    boxes = np.rint(np.asarray(boxes) * factor).astype(np.int32)
+    boxes[:, :2] = np.clip(boxes[:, :2], 0, height)
+    boxes[:, 2:] = np.clip(boxes[:, 2:], 0, width)
+    return boxes
+
+
+def read_meta(avatar_id, root=AVATAR_DIR):
+    with open(os.path.join(avatar_dir(avatar_id, root), META), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def list_avatars(root=AVATAR_DIR):
+    """Metadata of every registered avatar, sorted by ID."""
+    if not os.path.isdir(root):
+        return []
+    return [read_meta(name, root) for name in sorted(os.listdir(root)) if is_registered(name, root)]
+
+
+def load(avatar_id, root=AVATAR_DIR):
+    """Open a registered avatar with its arrays memory-mapped (cached per process)."""
+    import numpy as np
+
+    path = avatar_dir(avatar_id, root)
+    meta_path = os.path.join(path, META)
+    if not is_registered(avatar_id, root):
+        raise KeyError(f"Unknown avatar: {avatar_id}")
+    # Re-registering replaces the directory, which changes the metadata mtime
+    key = (os.path.abspath(path), os.path.getmtime(meta_path))
+    with _lock:
+        avatar = _open.get(key)
+    if avatar is not None:
+        return avatar
+
+    meta = read_meta(avatar_id, root)
+    if meta.get("version") != AVATAR_VERSION:
+        raise ValueError(f"Avatar {avatar_id} was registered by another version, register it again")
+
+    def mapped(name):
+        file_path = os.path.join(path, name)
+        return np.load(file_path, mmap_mode='r') if os.path.exists(file_path) else None
+
+    sizes = {height: (mapped(f"frames_{height}.npy"), mapped(f"boxes_{height}.npy"))
+             for height in meta.get("heights", [])}
+    avatar = Avatar(avatar_id, mapped("frames.npy"), mapped("boxes.npy"), mapped("face_input.npy"),
+                    meta.get("fps"), os.path.join(path, STILL), sizes)
+    with _lock:
+        for old in [k for k in _open if k[0] == key[0]]:
+            del _open[old]
+        _open[key] = avatar
+    return avatar
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def decode(source, max_frames=AVATAR_MAX_FRAMES):
+    """Return (frames, fps) of an image (one frame, fps None) or a video."""
+    import cv2
+
+    image = cv2.imread(source)
+    if image is not None:
+        return [image], None
+
+    capture = cv2.VideoCapture(source)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or None
+        frames = []
+        while len(frames) < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+    finally:
+        capture.release()
+    if not frames:
+        raise ValueError(f"Could not read an image or video from {source}")
+    return frames, fps
+
+
+def scale(frames, max_height=AVATAR_MAX_HEIGHT):
+    """Scale frames down to at most ``max_height`` and crop to even dimensions."""
+    import cv2
+
+    height, width = frames[0].shape[:2]
+    if max_height and height > max_height:
+        width, height = int(round(width * max_height / height)), max_height
+        frames = [cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA) for frame in frames]
+    # libx264 with yuv420p needs even dimensions
+    return [frame[:height // 2 * 2, :width // 2 * 2] for frame in frames]
+
+
+def detect_faces(frames, detect):
+    """Face box per frame; frames without a detection reuse the nearest one found."""
+    boxes = []
+    for frame in frames:
+        try:
+            boxes.append(detect(frame))
+        except ValueError:
+            boxes.append(None)
+    found = [i for i, box in enumerate(boxes) if box is not None]
+    if not found:
+        raise ValueError("Face not detected! Ensure the image contains a face.")
+    if len(found) < len(boxes):
+        print(f"No face in {len(boxes) - len(found)} of {len(boxes)} frames, reusing neighbouring boxes")
+    return [box if box is not None else boxes[min(found, key=lambda j: abs(j - i))]
+            for i, box in enumerate(boxes)]
+
+
+def register(source, avatar_id=None, detect=None, max_height=AVATAR_MAX_HEIGHT,
+             max_frames=AVATAR_MAX_FRAMES, root=AVATAR_DIR):
+    """Preprocess an image or video and store it as avatar ``avatar_id``.
+
+    :param source: Image or video file
+    :param avatar_id: Defaults to the file name without extension
+    :param detect: Callable returning the (y1, y2, x1, x2) face box of a BGR
+                   image; without it only the frames are stored, and Wav2Lip
+                   detects the face on first use instead
+    :returns: The avatar metadata
+    """
+    import cv2
+    import numpy as np
+    from backend.modules import face_cache
+
+    avatar_id = avatar_id or os.path.splitext(os.path.basename(source))[0]
+    if not ID_PATTERN.match(avatar_id):
+        raise ValueError(f"Invalid avatar ID: {avatar_id!r} (letters, digits, '.', '_' and '-')")
+
+    frames, fps = decode(source, max_frames)
+    frames = scale(frames, max_height)
+    meta = {
+        "version": AVATAR_VERSION,
+        "id": avatar_id,
+        "source": os.path.basename(source),
+        "source_hash": _file_hash(source),
+        "frames": len(frames),
+        "width": frames[0].shape[1],
+        "height": frames[0].shape[0],
+        "fps": fps,
+        "heights": render_heights(frames[0].shape[0]),
+        "faces": detect is not None,
+        "created": time.time(),
+    }
+
+    os.makedirs(root, exist_ok=True)
+    # Built next to the final directory and renamed into place, so readers
+    # never see a half-written avatar
+    tmp_dir = tempfile.mkdtemp(dir=root, prefix=f".{avatar_id}.")
+    try:
+        np.save(os.path.join(tmp_dir, "frames.npy"), np.stack(frames))
+        if detect is not None:
+            boxes = detect_faces(frames, detect)
+            crops = [cv2.resize(frame[y1:y2, x1:x2], (face_cache.IMG_SIZE, face_cache.IMG_SIZE))
+                     for frame, (y1, y2, x1, x2) in zip(frames, boxes)]
+            np.save(os.path.join(tmp_dir, "boxes.npy"), np.asarray(boxes, dtype=np.int32))
+            np.save(os.path.join(tmp_dir, "face_input.npy"),
+                    np.stack([face_cache.prepare_input(crop) for crop in crops]))
+        for height in meta["heights"]:
+            # One copy per profile size, so renders map it instead of scaling
+            sized = np.stack(scale(frames, height))
+            np.save(os.path.join(tmp_dir, f"frames_{height}.npy"), sized)
+            if detect is not None:
+                np.save(os.path.join(tmp_dir, f"boxes_{height}.npy"),
+                        scale_boxes(boxes, height / meta["height"], sized.shape[1], sized.shape[2]))
+        if not cv2.imwrite(os.path.join(tmp_dir, STILL), frames[0]):
+            raise OSError(f"Could not write {STILL}")
+        with open(os.path.join(tmp_dir, META), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+        target = avatar_dir(avatar_id, root)
+        if os.path.exists(target):
+            # Mapped copies of the old arrays stay valid until their readers close them
+            old_dir = tempfile.mkdtemp(dir=root, prefix=f".{avatar_id}.old.")
+            os.replace(target, os.path.join(old_dir, avatar_id))
+            os.replace(tmp_dir, target)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        else:
+            os.replace(tmp_dir, target)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return meta
+
+
+def remove(avatar_id, root=AVATAR_DIR):
+    if not is_registered(avatar_id, root):
+        raise KeyError(f"Unknown avatar: {avatar_id}")
+    shutil.rmtree(avatar_dir(avatar_id, root))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage registered avatars")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    register_cmd = sub.add_parser("register", help="Preprocess an image or video as an avatar")
+    register_cmd.add_argument('source')
+    register_cmd.add_argument('--id', dest='avatar_id', help="Avatar ID (default: the file name)")
+    register_cmd.add_argument('--no-detect', action='store_true',
+                              help="Skip face detection (viseme/basic engines only need the frames)")
+    register_cmd.add_argument('--max-height', type=int, default=AVATAR_MAX_HEIGHT)
+    register_cmd.add_argument('--max-frames', type=int, default=AVATAR_MAX_FRAMES)
+    register_cmd.add_argument('--device', default='cpu', help="Device for the face detector")
+
+    sub.add_parser("list", help="List registered avatars")
+    remove_cmd = sub.add_parser("remove", help="Delete a registered avatar")
+    remove_cmd.add_argument('avatar_id')
+    args = parser.parse_args()
+
+    if args.command == "register":
+        detect = None
+        if not args.no_detect:
+            from backend.modules.wav2lip_worker import face_detector
+            detect = face_detector(args.device)
+        meta = register(args.source, args.avatar_id, detect, args.max_height, args.max_frames)
+        print(f"✅ Registered avatar '{meta['id']}': {meta['frames']} frame(s), "
+              f"{meta['width']}x{meta['height']}")
+    elif args.command == "list":
+        avatars = list_avatars()
+        if not avatars:
+            print("No avatars registered")
+        for meta in avatars:
+            print(f"{meta['id']:<24}{meta['frames']:>6} frame(s)  {meta['width']}x{meta['height']}"
+                  f"  faces: {'yes' if meta['faces'] else 'no'}  ({meta['source']})")
+    elif args.command == "remove":
+        remove(args.avatar_id)
+        print(f"✅ Removed avatar '{args.avatar_id}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Cross-request batching for the lipsync network.
+
+Concurrent renders in the Wav2Lip worker submit their (face, mel) frames to
+one :class:`BatchScheduler`, which runs the model on batches of
+``batch_size`` frames taken from all of them in submission order. A batch
+that is not full is sent anyway once its oldest frame has waited
+``max_wait`` seconds. Each submission gets a Future with its predictions
+in frame order, even when its frames were split over several batches.
+
+    scheduler = BatchScheduler(engine.predict, batch_size=128, max_wait=0.01)
+    stats = BatchStats()
+    preds = scheduler.submit(faces, mels, stats).result()
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+
+
+class BatchStats:
+    """Batching figures of one job, filled in by the scheduler.
+
+    ``queue_delay`` adds up, per submission, the time from submit until its
+    first frames went into a batch; ``batch_fill`` is the mean fill of the
+    batches that carried the job's frames.
+    """
+
+    def __init__(self):
+        self.batches = 0
+        self.frames = 0
+        self.queue_delay = 0.0
+        self._fill = 0.0
+
+    @property
+    def batch_fill(self):
+        return self._fill / self.batches if self.batches else None
+
+    def as_dict(self):
+        return {"batches": self.batches, "frames": self.frames,
+                "queue_delay": round(self.queue_delay, 6),
+                "batch_fill": round(self.batch_fill, 4) if self.batches else None}
+
+
+def _resolve(setter, value):
+    try:
+        setter(value)
+    except InvalidStateError:
+        # Cancelled by its job in the meantime
+        pass
+
+
+class _Submission:
+    def __init__(self, faces, mels, stats):
+        self.faces = faces
+        self.mels = mels
+        self.stats = stats
+        self.future = Future()
+        self.submitted = time.perf_counter()
+        self.taken = 0
+        self.parts = []
+
+    def __len__(self):
+        return len(self.mels)
+
+    def face_slice(self, start, end):
+        if self.faces.ndim == 3:
+            # One still face for every frame
+            import numpy as np
+            return np.broadcast_to(self.faces, (end - start,) + self.faces.shape)
+        return self.faces[start:end]
+
+
+class BatchScheduler:
+    """Shares one ``predict(faces, mels)`` between threads in fixed-size batches.
+
+    :param predict: Called on the scheduler thread only, so the model is never
+        used from two threads at once
+    :param batch_size: Frames per model call
+    :param max_wait: Seconds a partial batch waits for more frames
+    """
+
+    def __init__(self, predict, batch_size, max_wait=0.01):
+        self.predict = predict
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._pending = deque()
+        self._queued = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        # Totals over all batches, for stats()
+        self._batches = 0
+        self._frames = 0
+        self._submissions = 0
+        self._queue_delay = 0.0
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, faces, mels, stats=None):
+        """Queue ``mels`` (N, 80, 16, 1) with ``faces`` (N, 96, 96, 6), or one (96, 96, 6) face.
+
+        Returns a Future with the (N, 96, 96, 3) predictions. Cancelling the
+        Future drops the frames that have not been batched yet; if the model
+        raises, every submission in that batch gets the exception.
+        """
+        submission = _Submission(faces, mels, stats)
+        if not len(submission):
+            submission.future.set_result(mels[:0])
+            return submission.future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("batch scheduler is closed")
+            self._pending.append(submission)
+            self._queued += len(submission)
+            self._cond.notify()
+        return submission.future
+
+    def close(self):
+        """Finish the queued frames and stop the scheduler thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "batches": self._batches,
+                "frames": self._frames,
+                "batch_fill": self._frames / (self._batches * self.batch_size) if self._batches else None,
+                "mean_queue_delay": self._queue_delay / self._submissions if self._submissions else None,
+                "queued_frames": self._queued,
+            }
+
+    def _next_batch(self):
+        """Wait for a full batch or the deadline of the oldest frame; None once closed and empty."""
+        with self._cond:
+            while True:
+                while self._pending and self._pending[0].future.done():
+                    dropped = self._pending.popleft()
+                    self._queued -= len(dropped) - dropped.taken
+                if self._pending:
+                    if self._queued >= self.batch_size or self._closed:
+                        break
+                    remaining = self._pending[0].submitted + self.max_wait - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+            batch, size = [], 0
+            for submission in self._pending:
+                if size == self.batch_size:
+                    break
+                if submission.future.done():
+                    continue
+                start = submission.taken
+                end = min(len(submission), start + self.batch_size - size)
+                batch.append((submission, start, end))
+                submission.taken = end
+                size += end - start
+            self._queued -= size
+            while self._pending and (self._pending[0].taken == len(self._pending[0])
+                                     or self._pending[0].future.done()):
+                dropped = self._pending.popleft()
+                self._queued -= len(dropped) - dropped.taken
+            return batch, size
+
+    def _run(self):
+        import numpy as np
+
+        while True:
+            job = self._next_batch()
+            if job is None:
+                return
+            batch, size = job
+            if not batch:
+                continue
+
+            now = time.perf_counter()
+            started = [s for s, start, _ in batch if start == 0]
+            for submission in started:
+                if submission.stats is not None:
+                    submission.stats.queue_delay += now - submission.submitted
+
+            first = batch[0][0].faces
+            if first.ndim == 3 and all(s.faces is first for s, _, _ in batch):
+                # Every frame shows the same still face: keep it broadcast
+                faces = first
+            else:
+                faces = np.concatenate([s.face_slice(start, end) for s, start, end in batch])
+            mels = np.concatenate([s.mels[start:end] for s, start, end in batch])
+
+            try:
+                preds = self.predict(faces, mels)
+            except Exception as e:
+                for submission, _, _ in batch:
+                    _resolve(submission.future.set_exception, e)
+                continue
+
+            with self._cond:
+                self._batches += 1
+                self._frames += size
+                self._submissions += len(started)
+                self._queue_delay += sum(now - s.submitted for s in started)
+
+            offset = 0
+            for submission, start, end in batch:
+                part = preds[offset:offset + end - start]
+                offset += end - start
+                if submission.stats is not None:
+                    submission.stats.batches += 1
+                    submission.stats.frames += end - start
+                    submission.stats._fill += size / self.batch_size
+                submission.parts.append(part)
+                if end == len(submission):
+                    parts = submission.parts
+                    _resolve(submission.future.set_result,
+                             parts[0] if len(parts) == 1 else np.concatenate(parts))
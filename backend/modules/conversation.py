@@ -0,0 +1,345 @@
+"""
+Continuous conversation mode for kiosk deployments.
+
+Three stages run in their own threads, connected by bounded queues:
+
+    capture (stt) -> synthesis (tts) -> render (lipsync segments)
+
+The microphone and recognizer stay open between turns, so the next
+utterance is captured while the previous reply is still being synthesized
+or rendered. Replies are rendered as HLS segments (see ``segments``), one
+playlist per turn, so playback can start on the first segment.
+
+With barge-in enabled, speech from the user while a reply is in flight
+cancels it: queued work is dropped, synthesis stops after the current
+sentence and the render is aborted before its next segment.
+"""
+
+import os
+import queue
+import threading
+import time
+
+from config import AVATAR_FACE
+from backend.modules import artifacts, lipsync, metrics, stt, tts
+
+_STOP = object()
+
+
+class Turn:
+    """One user utterance and the reply rendered for it.
+
+    ``timings`` holds seconds since the end of the utterance for each
+    milestone: ``synthesized``, ``first_segment`` (reply playable) and
+    ``rendered``.
+    """
+
+    def __init__(self, number, text):
+        self.number = number
+        self.text = text
+        self.heard_at = time.perf_counter()
+        self.cancelled = threading.Event()
+        self.status = "queued"
+        self.playlist = None
+        self.error = None
+        self.timings = {}
+
+    def mark(self, milestone):
+        self.timings[milestone] = time.perf_counter() - self.heard_at
+
+    @property
+    def latency(self):
+        """End of utterance until the reply could start playing, if it did."""
+        return self.timings.get("first_segment")
+
+
+class Conversation:
+    """Pipelined STT -> TTS -> lipsync loop.
+
+    :param voice_model: Piper model used for replies
+    :param profile: Encode profile of the replies (default ENCODE_PROFILE)
+    :param reply: Maps the recognized text to the text to speak (default: echo)
+    :param barge_in: Cancel in-flight replies when the user starts speaking
+    :param on_ready: Called with the Turn once its playlist has a segment
+    :param on_turn: Called with the Turn once it is done, cancelled or failed
+    """
+
+    def __init__(self, voice_model=None, face_file=AVATAR_FACE, engine=None,
+                 output_dir=None, reply=None, barge_in=True, on_ready=None, on_turn=None,
+                 queue_size=2, profile=None):
+        self.voice_model = voice_model
+        self.face_file = face_file
+        self.engine = engine
+        self.profile = profile
+        # One live job directory per conversation unless given (turns are played while rendering)
+        self.artifact = None if output_dir else artifacts.store.create("conversation", live=True)
+        self.output_dir = output_dir or self.artifact.directory
+        self.reply = reply or (lambda text: text)
+        self.barge_in = barge_in
+        self.on_ready = on_ready
+        self.on_turn = on_turn
+        self.turns = []
+        self._texts = queue.Queue(maxsize=queue_size)
+        self._audio = queue.Queue(maxsize=queue_size)
+        self._active = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    # --- Control ---
+
+    def start(self, source=None):
+        """Warm the models and start the stages; ``source`` is passed to stt."""
+        print("Warming up models...")
+        for name, warm in (("stt", stt.warmup),
+                           ("tts", lambda: tts.warmup([self.voice_model] if self.voice_model else None)),
+                           ("lipsync", lambda: lipsync.warmup(self.engine, self.face_file))):
+            try:
+                warm()
+            except Exception as e:
+                print(f"{name} warmup failed ({e}), it will load on first use")
+
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._capture, args=(source,), name="capture", daemon=True),
+            threading.Thread(target=self._synthesize, name="synthesis", daemon=True),
+            threading.Thread(target=self._render, name="render", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def wait(self, timeout=None):
+        """Block until the source is exhausted and every turn is finished."""
+        self._threads[-1].join(timeout)
+
+    def stop(self):
+        """Cancel everything in flight and stop the stages."""
+        self._stopping.set()
+        with self._lock:
+            active = list(self._active)
+        for turn in active:
+            turn.cancelled.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        # Turns still sitting in a queue when the stages exited
+        for turn in active:
+            if turn.status in ("queued", "synthesizing", "rendering"):
+                self._finish(turn, "cancelled")
+        if self.artifact:
+            self.artifact.commit()
+
+    def run(self, source=None):
+        """Run until CTRL+C (or the end of ``source``), then print a summary."""
+        self.start(source)
+        print("Listening... speak any time (CTRL+C to stop)")
+        try:
+            while any(thread.is_alive() for thread in self._threads):
+                self.wait(timeout=0.5)
+        except KeyboardInterrupt:
+            print("\nStopping...")
+        finally:
+            self.stop()
+        self.print_summary()
+
+    def interrupt(self):
+        """Cancel every turn that is still queued, synthesizing or rendering."""
+        with self._lock:
+            active = [turn for turn in self._active if not turn.cancelled.is_set()]
+        for turn in active:
+            print(f"Barge-in: cancelling turn {turn.number}")
+            turn.cancelled.set()
+
+    # --- Stages ---
+
+    def _put(self, target, item):
+        """Blocking put that gives up once the loop is stopping."""
+        while True:
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if self._stopping.is_set():
+                    return False
+
+    def _get(self, source):
+        """Blocking get that returns _STOP once the loop is stopping."""
+        while True:
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return _STOP
+
+    def _blocks(self, source):
+        # Checked per block, so stopping does not wait for the next recognition result
+        blocks = stt.audio_blocks(source)
+        try:
+            for data in blocks:
+                if self._stopping.is_set():
+                    return
+                yield data
+        finally:
+            if hasattr(blocks, 'close'):
+                blocks.close()
+
+    def _capture(self, source):
+        try:
+            # One long-lived stream: the microphone and recognizer stay warm between turns
+            for result in stt.stream_recognize(self._blocks(source)):
+                if not result["text"]:
+                    continue
+                if result["type"] == "partial":
+                    if self.barge_in:
+                        self.interrupt()
+                    continue
+
+                if self.barge_in:
+                    self.interrupt()
+                turn = Turn(len(self.turns) + 1, result["text"])
+                self.turns.append(turn)
+                with self._lock:
+                    self._active.append(turn)
+                print(f"[{turn.number}] You said: {turn.text}")
+                if not self._put(self._texts, turn):
+                    self._finish(turn, "cancelled")
+                    break
+        except Exception as e:
+            print(f"❌ Capture stopped: {e}")
+        finally:
+            self._put(self._texts, _STOP)
+
+    def _synthesize(self):
+        from backend.modules.audio import AudioBuffer
+
+        while True:
+            turn = self._get(self._texts)
+            if turn is _STOP:
+                self._put(self._audio, _STOP)
+                return
+            if turn.cancelled.is_set():
+                self._finish(turn, "cancelled")
+                continue
+
+            turn.status = "synthesizing"
+            stats = tts.StreamStats()
+            pcm = []
+            try:
+                with metrics.stage("conversation.synthesis"):
+                    for chunk in tts.speak_stream(self.reply(turn.text), self.voice_model, stats):
+                        pcm.append(chunk)
+                        if turn.cancelled.is_set():
+                            break
+            except Exception as e:
+                turn.error = f"{type(e).__name__}: {e}"
+                self._finish(turn, "failed")
+                continue
+            if turn.cancelled.is_set():
+                self._finish(turn, "cancelled")
+                continue
+            if not pcm:
+                turn.error = "nothing was synthesized"
+                self._finish(turn, "failed")
+                continue
+
+            turn.mark("synthesized")
+            if not self._put(self._audio, (turn, AudioBuffer.from_pcm(b"".join(pcm), stats.sample_rate))):
+                self._finish(turn, "cancelled")
+
+    def _render(self):
+        while True:
+            item = self._get(self._audio)
+            if item is _STOP:
+                return
+            turn, audio = item
+            if turn.cancelled.is_set():
+                self._finish(turn, "cancelled")
+                continue
+
+            turn.status = "rendering"
+            output_dir = os.path.join(self.output_dir, f"turn-{turn.number:04d}")
+            rendered = threading.Event()
+            threading.Thread(target=self._watch_playlist, args=(turn, output_dir, rendered),
+                             daemon=True).start()
+            try:
+                turn.playlist = lipsync.generate_segments(audio, self.face_file, output_dir,
+                                                          self.engine, cancel=turn.cancelled,
+                                                          profile=self.profile)
+            except Exception as e:
+                turn.error = f"{type(e).__name__}: {e}"
+            finally:
+                rendered.set()
+
+            if turn.cancelled.is_set():
+                self._finish(turn, "cancelled")
+            elif turn.playlist:
+                turn.mark("rendered")
+                if "first_segment" not in turn.timings:
+                    self._ready(turn)
+                self._finish(turn, "done")
+            else:
+                turn.error = turn.error or "lipsync produced no segments"
+                self._finish(turn, "failed")
+
+    def _watch_playlist(self, turn, output_dir, rendered):
+        from backend.modules import segments
+
+        playlist = os.path.join(output_dir, segments.PLAYLIST)
+        while not rendered.is_set() and not turn.cancelled.is_set():
+            if os.path.exists(playlist):
+                self._ready(turn)
+                return
+            time.sleep(0.02)
+
+    def _ready(self, turn):
+        with self._lock:
+            if "first_segment" in turn.timings:
+                return
+            turn.mark("first_segment")
+        metrics.observe("conversation.first_segment", turn.latency)
+        print(f"[{turn.number}] Reply playable after {turn.latency:.2f}s")
+        if self.on_ready:
+            self.on_ready(turn)
+
+    def _finish(self, turn, status):
+        turn.status = status
+        with self._lock:
+            if turn in self._active:
+                self._active.remove(turn)
+        if status == "done":
+            metrics.observe("conversation.turn", turn.timings["rendered"])
+            print(f"[{turn.number}] Done: synthesized {turn.timings['synthesized']:.2f}s, "
+                  f"playable {turn.latency:.2f}s, rendered {turn.timings['rendered']:.2f}s "
+                  f"after end of speech")
+        elif status == "failed":
+            print(f"[{turn.number}] ❌ Failed: {turn.error}")
+        if self.on_turn:
+            self.on_turn(turn)
+
+    # --- Reporting ---
+
+    def summary(self):
+        """Per-turn latencies plus p50/p95 of the time until a reply was playable."""
+        latencies = sorted(turn.latency for turn in self.turns
+                           if turn.status == "done" and turn.latency is not None)
+
+        def quantile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+
+        counts = {}
+        for turn in self.turns:
+            counts[turn.status] = counts.get(turn.status, 0) + 1
+        return {
+            "turns": [{"number": turn.number, "text": turn.text, "status": turn.status,
+                       "timings": turn.timings, "error": turn.error} for turn in self.turns],
+            "counts": counts,
+            "latency_p50": quantile(0.5),
+            "latency_p95": quantile(0.95),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Turns: {len(self.turns)} "
+              + ", ".join(f"{count} {status}" for status, count in sorted(summary["counts"].items())))
+        if summary["latency_p50"] is not None:
+            print(f"Time to playable reply: p50 {summary['latency_p50']:.2f}s, "
+                  f"p95 {summary['latency_p95']:.2f}s")
@@ -0,0 +1,275 @@
+"""
+Video encode profiles for lipsync output, picked by name or by latency budget.
+
+    preview   at most 360p, 15 fps, x264 ultrafast CRF 28, AAC 64k
+    balanced  at most 720p, engine frame rate, x264 veryfast CRF 23, AAC 128k
+    archival  source size and frame rate, x264 slow CRF 18, AAC 192k
+
+The size and frame rate of a profile are applied where the frames are made,
+with the face scaled once up front instead of every frame by ffmpeg. To
+pick a profile from a latency budget, the encode speed of each profile on
+this host is measured once with a short synthetic clip (by setup.py and at
+warmup, never on the request path), updated after every real encode and
+kept in ENCODE_SPEED_FILE. The Wav2Lip worker records its inference speed
+in the same file, so the budget covers inference plus encoding.
+
+    python -m backend.modules.encode calibrate
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from config import ENCODE_PROFILE, ENCODE_SPEED_FILE
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class EncodeProfile:
+    """x264/AAC settings plus the output size and frame rate they are meant for.
+
+    :param max_height: Frames are scaled down to this height (None = source size)
+    :param fps: Output frame rate (None = the engine's own)
+    """
+
+    def __init__(self, name, preset, crf, max_height=None, fps=None, audio_bitrate="128k", tune=None):
+        self.name = name
+        self.preset = preset
+        self.crf = crf
+        self.max_height = max_height
+        self.fps = fps
+        self.audio_bitrate = audio_bitrate
+        self.tune = tune
+
+    def video_args(self, tune=None):
+        """libx264 arguments; ``tune`` overrides the profile's (e.g. "stillimage")."""
+        tune = tune or self.tune
+        return (['-c:v', 'libx264', '-preset', self.preset, '-crf', str(self.crf)]
+                + (['-tune', tune] if tune else []) + ['-pix_fmt', 'yuv420p'])
+
+    def audio_args(self):
+        return ['-c:a', 'aac', '-b:a', self.audio_bitrate]
+
+    def size(self, width, height):
+        """Output (width, height) for a source of this size, with even dimensions."""
+        if self.max_height and height > self.max_height:
+            width, height = int(round(width * self.max_height / height)), self.max_height
+        return width // 2 * 2, height // 2 * 2
+
+    def frame_rate(self, default):
+        return self.fps or default
+
+
+PROFILES = {
+    "preview": EncodeProfile("preview", "ultrafast", 28, max_height=360, fps=15,
+                             audio_bitrate="64k", tune="zerolatency"),
+    "balanced": EncodeProfile("balanced", "veryfast", 23, max_height=720),
+    "archival": EncodeProfile("archival", "slow", 18, audio_bitrate="192k"),
+}
+# Best quality first; a latency budget gets the first profile that fits
+QUALITY_ORDER = ("archival", "balanced", "preview")
+# Assumed source when the face size is unknown
+DEFAULT_SIZE = (1280, 720)
+DEFAULT_FPS = 25
+
+
+def get(profile=None):
+    """The EncodeProfile named ``profile`` (default ENCODE_PROFILE)."""
+    if isinstance(profile, EncodeProfile):
+        return profile
+    name = profile or ENCODE_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encode profile: {name} (choose from {', '.join(PROFILES)})")
+    return PROFILES[name]
+
+
+def host_key():
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}"
+
+
+class EncodeSpeed:
+    """Encode throughput per profile on this host, in output pixels per second.
+
+    ``inference.<backend>`` entries hold the Wav2Lip worker's frames per
+    second instead. Rates are smoothed over encodes and shared through
+    ``path`` with the other processes (the Wav2Lip worker encodes in its
+    own); each update re-reads the file under a lock and changes only its
+    own entry. A file written on another host is ignored.
+    """
+
+    def __init__(self, path=ENCODE_SPEED_FILE, smoothing=0.3):
+        self.path = path
+        self.smoothing = smoothing
+        self._rates = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _reload(self, force=False):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime and not force:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("host") == host_key():
+            self._rates.update(data.get("rates", {}))
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold an exclusive lock on ``path`` across processes (a no-op without fcntl)."""
+        if fcntl is None:
+            yield
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            f = open(self.path + '.lock', 'a')
+        except OSError:
+            yield
+            return
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"host": host_key(), "rates": self._rates}, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            print(f"Warning: could not write encode speeds: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def rate(self, name):
+        """Measured rate of ``name`` (a profile or ``inference.<backend>``), or None if never measured."""
+        with self._lock:
+            self._reload()
+            return self._rates.get(name)
+
+    def observe(self, name, pixels, seconds):
+        """Fold one encode of ``pixels`` output pixels (or frames) that took ``seconds`` into the rate."""
+        if pixels <= 0 or seconds <= 0:
+            return
+        measured = pixels / seconds
+        with self._lock:
+            with self._file_lock():
+                # Another process may have written since our last read
+                self._reload(force=True)
+                previous = self._rates.get(name)
+                self._rates[name] = measured if previous is None else \
+                    previous + self.smoothing * (measured - previous)
+                self._save()
+
+    def calibrate(self, profile, seconds=2.0):
+        """Encode ``seconds`` of a synthetic clip with ``profile`` and record its speed."""
+        profile = get(profile)
+        width, height = profile.size(*DEFAULT_SIZE)
+        fps = profile.frame_rate(DEFAULT_FPS)
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi',
+               '-i', f'testsrc2=size={width}x{height}:rate={fps}', '-t', str(seconds)] + \
+            profile.video_args() + ['-f', 'null', '-']
+        start = time.perf_counter()
+        subprocess.run(cmd, capture_output=True, check=True)
+        self.observe(profile.name, width * height * fps * seconds, time.perf_counter() - start)
+        return self.rate(profile.name)
+
+    def calibrate_missing(self, seconds=2.0):
+        """Calibrate the profiles never measured on this host; False if ffmpeg failed."""
+        for name in PROFILES:
+            if self.rate(name) is None:
+                try:
+                    self.calibrate(name, seconds)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    print(f"Could not measure encode speed ({e})")
+                    return False
+        return True
+
+    def estimate(self, profile, duration, width=None, height=None, fps=DEFAULT_FPS):
+        """Seconds to encode ``duration`` seconds of video from a ``width`` x ``height`` face.
+
+        None while the profile has not been measured on this host.
+        """
+        profile = get(profile)
+        rate = self.rate(profile.name)
+        if not rate:
+            return None
+        out_width, out_height = profile.size(width or DEFAULT_SIZE[0], height or DEFAULT_SIZE[1])
+        return out_width * out_height * profile.frame_rate(fps) * duration / rate
+
+    def inference(self, backend, frames):
+        """Seconds the Wav2Lip ``backend`` needs for ``frames`` frames, or None if never measured."""
+        rate = self.rate(f"inference.{backend}")
+        return frames / rate if rate else None
+
+
+speeds = EncodeSpeed()
+
+
+def choose(profile=None, latency_budget=None, duration=None, width=None, height=None, fps=DEFAULT_FPS,
+           inference=None):
+    """Profile for one request.
+
+    An explicit ``profile`` wins. Otherwise, with a ``latency_budget`` (seconds
+    the render may take) and the audio ``duration``, the best profile whose
+    estimated encode time plus ``inference(profile)`` (seconds spent before
+    encoding, or None if unknown) fits is used, and "preview" if none does.
+    Without either, or while a speed is unmeasured, ENCODE_PROFILE.
+    """
+    if profile or latency_budget is None or not duration:
+        return get(profile)
+    for name in QUALITY_ORDER:
+        estimate = speeds.estimate(name, duration, width, height, fps)
+        before = inference(PROFILES[name]) if inference else 0.0
+        if estimate is None:
+            print(f"Encode speed of {name} not measured yet "
+                  f"(python -m backend.modules.encode calibrate), using {ENCODE_PROFILE}")
+            return get()
+        if before is None:
+            print(f"Inference speed not measured yet (recorded by the first render), using {ENCODE_PROFILE}")
+            return get()
+        if before + estimate <= latency_budget:
+            return PROFILES[name]
+    return PROFILES["preview"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode profiles")
+    sub = parser.add_subparsers(dest='command', required=True)
+    calibrate = sub.add_parser('calibrate', help="Measure the encode speed of every profile")
+    calibrate.add_argument('--seconds', type=float, default=2.0)
+    sub.add_parser('list', help="Show the profiles and their measured speed")
+    args = parser.parse_args()
+
+    for name, profile in PROFILES.items():
+        rate = speeds.calibrate(profile, args.seconds) if args.command == 'calibrate' else speeds.rate(name)
+        width, height = profile.size(*DEFAULT_SIZE)
+        speed = f"{rate / (width * height * profile.frame_rate(DEFAULT_FPS)):.1f}x real time" if rate \
+            else "not measured"
+        print(f"{name:<10} {width}x{height}@{profile.frame_rate(DEFAULT_FPS)}  "
+              f"{profile.preset:<10} crf {profile.crf:<3} {speed}")
+
+
+if __name__ == "__main__":
+    main()
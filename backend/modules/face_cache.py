@@ -0,0 +1,119 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from config import FACE_CACHE_DIR
+
+IMG_SIZE = 96
+# Bump when the cached layout or preprocessing changes
+CACHE_VERSION = 1
+
+
+class FaceAsset:
+    """Preprocessed still face: detection box, 96x96 crop and model input.
+
+    ``face_input`` is the (96, 96, 6) float32 array Wav2Lip expects: the crop
+    with its lower half masked, concatenated with the full crop, in [0, 1].
+    """
+
+    def __init__(self, box, crop, face_input, content_hash):
+        self.box = tuple(int(v) for v in box)
+        self.crop = crop
+        self.face_input = face_input
+        self.content_hash = content_hash
+
+    def batch(self, n):
+        """Return ``n`` copies of the model input as a zero-copy broadcast view."""
+        return np.broadcast_to(self.face_input, (n,) + self.face_input.shape)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def prepare_input(crop):
+    """Build the masked + reference model input from a 96x96 BGR crop."""
+    masked = crop.copy()
+    masked[IMG_SIZE // 2:] = 0
+    return np.concatenate((masked, crop), axis=2).astype(np.float32) / 255.
+
+
+def build(image, detect, content_hash):
+    """Detect the face in a decoded ``image`` and preprocess the crop."""
+    import cv2
+
+    y1, y2, x1, x2 = detect(image)
+    crop = cv2.resize(image[y1:y2, x1:x2], (IMG_SIZE, IMG_SIZE))
+    return FaceAsset((y1, y2, x1, x2), crop, prepare_input(crop), content_hash)
+
+
+class FaceCache:
+    """Face detection results cached per image content hash.
+
+    Assets are kept in memory for the life of the process and persisted as
+    ``.npz`` files so other workers and later runs skip detection entirely.
+    """
+
+    def __init__(self, root=FACE_CACHE_DIR):
+        self.root = root
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.npz")
+
+    def _read(self, key):
+        try:
+            with np.load(self._path(key)) as data:
+                if int(data['version']) != CACHE_VERSION:
+                    return None
+                return FaceAsset(data['box'], data['crop'], data['face_input'], key)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _write(self, key, asset):
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, version=CACHE_VERSION, box=np.asarray(asset.box, dtype=np.int32),
+                         crop=asset.crop, face_input=asset.face_input)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Warning: could not write face cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, face_file, image, detect):
+        """Return the FaceAsset for ``face_file``, detecting only on a cache miss.
+
+        :param face_file: Path of the still image (hashed for the cache key)
+        :param image: The decoded image, used when detection is needed
+        :param detect: Callable returning the (y1, y2, x1, x2) face box
+        """
+        key = file_hash(face_file)
+        with self._lock:
+            asset = self._assets.get(key)
+        if asset is not None:
+            return asset
+
+        asset = self._read(key)
+        if asset is None:
+            print(f"Detecting face in {face_file} (cached for later runs)")
+            asset = build(image, detect, key)
+            self._write(key, asset)
+
+        with self._lock:
+            self._assets[key] = asset
+        return asset
+
+
+# Shared per-process cache
+cache = FaceCache()
@@ -0,0 +1,110 @@
+"""
+Pre-encoded still-image video tracks for the basic lipsync fallback.
+
+Encoding the same still image with libx264 on every request is wasted work,
+so the video track is encoded once per (face image, resolution, fps,
+encode profile) and requests only stream-copy it next to freshly encoded
+audio. The image is scaled to the profile's size in that one encode.
+"""
+
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+import wave
+
+from config import IDLE_LOOP_DIR, IDLE_LOOP_SECONDS, IDLE_LOOP_FPS
+from backend.modules import encode, metrics
+
+_lock = threading.Lock()
+
+
+def _image_size(face_file):
+    """Return (width, height) of the image, rounded down to even numbers."""
+    import cv2
+
+    image = cv2.imread(face_file)
+    if image is None:
+        raise ValueError(f"Could not read face image: {face_file}")
+    height, width = image.shape[:2]
+    return width // 2 * 2, height // 2 * 2
+
+
+def loop_key(face_file, width, height, fps, profile):
+    digest = hashlib.sha256()
+    with open(face_file, 'rb') as f:
+        digest.update(f.read())
+    digest.update(f"{width}x{height}@{fps}:{profile}:{IDLE_LOOP_SECONDS}".encode())
+    return digest.hexdigest()
+
+
+def get_loop(face_file, fps=None, profile=None):
+    """Return the path of the cached idle video for ``face_file``, encoding it if needed.
+
+    :param profile: Encode profile name (default ENCODE_PROFILE); sets the
+                    size, the frame rate unless ``fps`` is given, and x264 settings
+    """
+    profile = encode.get(profile)
+    fps = fps or profile.frame_rate(IDLE_LOOP_FPS)
+    width, height = profile.size(*_image_size(face_file))
+    key = loop_key(face_file, width, height, fps, profile.name)
+    path = os.path.join(IDLE_LOOP_DIR, f"{key}.mp4")
+    if os.path.exists(path):
+        return path
+
+    with _lock:
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(IDLE_LOOP_DIR, exist_ok=True)
+        print(f"Encoding {IDLE_LOOP_SECONDS}s idle loop for {face_file} (cached for later runs)")
+        fd, tmp_path = tempfile.mkstemp(dir=IDLE_LOOP_DIR, suffix='.mp4')
+        os.close(fd)
+        cmd = [
+            'ffmpeg', '-y', '-loop', '1', '-framerate', str(fps), '-i', face_file,
+            '-t', str(IDLE_LOOP_SECONDS), '-vf', f'scale={width}:{height}',
+            # One keyframe per second keeps stream-copy trims close to the audio length
+            '-g', str(int(fps)),
+        ] + profile.video_args(tune='stillimage') + ['-movflags', '+faststart', tmp_path]
+        try:
+            with metrics.stage("lipsync.idle_loop_encode"):
+                subprocess.run(cmd, capture_output=True, text=True, check=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return path
+
+
+def audio_duration(audio_input):
+    """Duration in seconds of an AudioBuffer or WAV file, or None if unknown."""
+    from backend.modules import audio
+
+    if isinstance(audio_input, audio.AudioBuffer):
+        return audio_input.duration
+    try:
+        with wave.open(audio_input, 'rb') as wav_file:
+            return wav_file.getnframes() / float(wav_file.getframerate())
+    except (wave.Error, EOFError, OSError):
+        return None
+
+
+def mux_command(loop_path, audio_input, output_path, profile=None):
+    """ffmpeg command that copies the idle video and encodes only the audio.
+
+    Returns ``(cmd, stdin_bytes)``; in-memory audio is fed through stdin.
+    """
+    from backend.modules import audio
+
+    profile = encode.get(profile)
+    duration = audio_duration(audio_input)
+    audio_args, stdin = audio.ffmpeg_input(audio_input)
+    cmd = ['ffmpeg', '-y']
+    if duration is None or duration > IDLE_LOOP_SECONDS:
+        cmd += ['-stream_loop', '-1']
+    cmd += ['-i', loop_path] + audio_args + [
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c:v', 'copy'] + profile.audio_args() + ['-shortest', output_path
+    ]
+    return cmd, stdin
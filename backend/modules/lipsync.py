@@ -1,36 +1,84 @@
 import os
 import sys
 import subprocess
-import cv2
-import numpy as np
-from config import AVATAR_FACE, OUTPUT_DIR
+from config import (AVATAR_FACE, OUTPUT_DIR, WAV2LIP_WORKER_ENABLED, WAV2LIP_BACKEND,
+                    WAV2LIP_RANDOM_INIT, WAV2LIP_FPS, LIPSYNC_ENGINE, IDLE_LOOP_FPS)
+from backend.modules import artifacts, avatars, encode, wav2lip_worker, idle_loop, metrics
 
 # Add Wav2Lip to path
 WAV2LIP_PATH = os.path.join(os.path.dirname(__file__), '..', 'extras', 'Wav2Lip')
 sys.path.append(WAV2LIP_PATH)
 
-def generate_lipsync_wav2lip(audio_file, face_file=AVATAR_FACE, filename="output.mp4"):
+def has_checkpoint(checkpoint_path):
+    """True if the worker can load a network: the checkpoint exists or WAV2LIP_RANDOM_INIT is set."""
+    return WAV2LIP_RANDOM_INIT or os.path.exists(checkpoint_path)
+
+def wav2lip_backend(backend=None):
+    """
+    Worker backend for Wav2Lip (default WAV2LIP_BACKEND); "onnx" falls back
+    to "torch" while the ONNX model has not been exported.
+    """
+    backend = backend or WAV2LIP_BACKEND
+    if backend == "onnx":
+        from backend.modules import wav2lip_onnx
+        onnx_path = wav2lip_onnx.model_path()
+        if not os.path.exists(onnx_path):
+            print(f"ONNX model not found at {onnx_path}, using PyTorch")
+            print("Export it with: python -m backend.modules.wav2lip_onnx export --quantize")
+            return "torch"
+    return backend
+
+def generate_lipsync_wav2lip(audio_file, face_file=AVATAR_FACE, filename="output.mp4", backend=None,
+                             profile=None):
     """
     Generate lip-synced video using Wav2Lip
+
+    ``audio_file`` may be a WAV path or an in-memory AudioBuffer.
+    ``backend`` picks the worker's network runtime: "torch" or "onnx".
+    The worker reads registered avatars from their mapped arrays; the
+    fallbacks use the avatar's still image. ``profile`` is the encode
+    profile name (default ENCODE_PROFILE).
     """
+    from backend.modules import audio
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     output_path = os.path.join(OUTPUT_DIR, filename)
+    avatar, face_file = face_file, avatars.resolve(face_file)
     
-    if not os.path.exists(face_file) or not os.path.exists(audio_file):
-        print(f"❌ Missing files: {face_file} or {audio_file}")
+    if not os.path.exists(face_file) or not audio.exists(audio_file):
+        print(f"❌ Missing files: {face_file} or {audio.describe(audio_file)}")
         return None
     
     checkpoint_path = os.path.join(WAV2LIP_PATH, 'checkpoints', 'wav2lip_gan.pth')
     
-    if not os.path.exists(checkpoint_path):
+    if not has_checkpoint(checkpoint_path):
         print(f"Wav2Lip checkpoint not found at {checkpoint_path}")
         print("Please download it manually from:")
         print("https://iiitaphyd-my.sharepoint.com/personal/radrabha_m_research_iiit_ac_in/_layouts/15/download.aspx?share=Eb3LEzbfuKlJiR600lQWRxgBIY27JZdq8B7fuee9ew2Dug")
         print("Falling back to basic video generation...")
-        return generate_lipsync_basic(audio_file, face_file, filename)
+        return generate_lipsync_basic(audio_file, face_file, filename, profile)
     
-    print(f"Creating Wav2Lip video: {audio_file} + {face_file} → {output_path}")
+    print(f"Creating Wav2Lip video: {audio.describe(audio_file)} + {face_file} → {output_path}")
     
+    if WAV2LIP_WORKER_ENABLED:
+        try:
+            wav2lip_worker.get_worker(wav2lip_backend(backend)).render(
+                audio_file, avatar, output_path, profile=encode.get(profile).name)
+            if os.path.exists(output_path):
+                print(f"✅ Wav2Lip video created: {output_path}")
+                return output_path
+            print("Wav2Lip worker did not produce a video")
+        except Exception as e:
+            print(f"Wav2Lip worker error: {e}")
+        print("Falling back to basic video generation...")
+        return generate_lipsync_basic(audio_file, face_file, filename, profile)
+
+    scratch_wav = None
+    if isinstance(audio_file, audio.AudioBuffer):
+        # inference.py only reads files
+        scratch_wav = audio_file.resample(16000).write(artifacts.scratch_file(".wav"))
+        audio_file = scratch_wav
+
     try:
         # Convert to absolute paths for Wav2Lip
         face_abs = os.path.abspath(face_file)
@@ -46,7 +94,8 @@ def generate_lipsync_wav2lip(audio_file, face_file=AVATAR_FACE, filename="output
             '--outfile', output_abs
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=WAV2LIP_PATH)
+        with metrics.stage("lipsync.wav2lip.inference_subprocess"):
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd=WAV2LIP_PATH)
         
         if result.returncode == 0 and os.path.exists(output_path):
             print(f"✅ Wav2Lip video created: {output_path}")
@@ -54,42 +103,272 @@ def generate_lipsync_wav2lip(audio_file, face_file=AVATAR_FACE, filename="output
         else:
             print(f"Wav2Lip failed: {result.stderr}")
             print("Falling back to basic video generation...")
-            return generate_lipsync_basic(audio_file, face_file, filename)
+            return generate_lipsync_basic(audio_file, face_file, filename, profile)
             
     except Exception as e:
         print(f"Wav2Lip error: {e}")
         print("Falling back to basic video generation...")
-        return generate_lipsync_basic(audio_file, face_file, filename)
+        return generate_lipsync_basic(audio_file, face_file, filename, profile)
+    finally:
+        if scratch_wav and os.path.exists(scratch_wav):
+            os.remove(scratch_wav)
 
-def generate_lipsync_basic(audio_file, face_file=AVATAR_FACE, filename="output.mp4"):
+def generate_lipsync_wav2lip_onnx(audio_file, face_file=AVATAR_FACE, filename="output.mp4", profile=None):
+    """
+    Wav2Lip with the network running in ONNX Runtime (CPU-only hosts)
+    """
+    return generate_lipsync_wav2lip(audio_file, face_file, filename, backend="onnx", profile=profile)
+
+def generate_lipsync_basic(audio_file, face_file=AVATAR_FACE, filename="output.mp4", profile=None):
     """
     Fallback: Generate basic video with static image and audio
     """
+    from backend.modules import audio
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     output_path = os.path.join(OUTPUT_DIR, filename)
+    face_file = avatars.resolve(face_file)
+    profile = encode.get(profile)
     
-    print(f"Creating basic video: {audio_file} + {face_file} → {output_path}")
+    print(f"Creating basic video: {audio.describe(audio_file)} + {face_file} → {output_path}")
     
-    cmd = [
-        'ffmpeg', '-y', '-loop', '1', '-i', face_file, '-i', audio_file,
-        '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
-        '-c:v', 'libx264', '-tune', 'stillimage', '-c:a', 'aac', '-b:a', '128k',
-        '-pix_fmt', 'yuv420p', '-shortest', output_path
-    ]
+    try:
+        # Reuse the pre-encoded idle video; only the audio is encoded per request
+        loop_path = idle_loop.get_loop(face_file, profile=profile.name)
+        cmd, stdin = idle_loop.mux_command(loop_path, audio_file, output_path, profile.name)
+    except FileNotFoundError:
+        print("❌ FFmpeg not found. Please install ffmpeg and ensure it is in your PATH.")
+        return None
+    except (ValueError, subprocess.CalledProcessError) as e:
+        print(f"Idle loop unavailable ({e}), encoding the image directly...")
+        audio_args, stdin = audio.ffmpeg_input(audio_file)
+        scale = f"scale=-2:'trunc(min(ih,{profile.max_height})/2)*2'" if profile.max_height \
+            else 'scale=trunc(iw/2)*2:trunc(ih/2)*2'
+        cmd = [
+            'ffmpeg', '-y', '-loop', '1', '-framerate', str(profile.frame_rate(IDLE_LOOP_FPS)),
+            '-i', face_file] + audio_args + ['-vf', scale] + \
+            profile.video_args(tune='stillimage') + profile.audio_args() + ['-shortest', output_path]
 
     try:
-        subprocess.run(cmd, capture_output=True, text=True, check=True)
+        with metrics.stage("lipsync.ffmpeg_mux"):
+            subprocess.run(cmd, input=stdin, capture_output=True, check=True)
         print(f"✅ Basic video created: {output_path}")
         return output_path
     except FileNotFoundError:
         print("❌ FFmpeg not found. Please install ffmpeg and ensure it is in your PATH.")
         return None
     except subprocess.CalledProcessError as e:
-        print(f"❌ FFmpeg failed: {e.stderr}")
+        print(f"❌ FFmpeg failed: {e.stderr.decode(errors='replace')}")
         return None
 
-def generate_lipsync(audio_file, face_file=AVATAR_FACE, filename="output.mp4"):
+def generate_lipsync_viseme(audio_file, face_file=AVATAR_FACE, filename="output.mp4", profile=None):
     """
-    Main function: Try Wav2Lip first, fallback to basic if needed
+    Generate a CPU-only video whose mouth opens with the audio energy
     """
-    return generate_lipsync_wav2lip(audio_file, face_file, filename)
\ No newline at end of file
+    from backend.modules import audio, viseme
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_path = os.path.join(OUTPUT_DIR, filename)
+    face_file = avatars.resolve(face_file)
+
+    print(f"Creating viseme video: {audio.describe(audio_file)} + {face_file} → {output_path}")
+
+    try:
+        viseme.render(audio_file, face_file, output_path, profile=profile)
+        print(f"✅ Viseme video created: {output_path}")
+        return output_path
+    except FileNotFoundError:
+        print("❌ FFmpeg not found. Please install ffmpeg and ensure it is in your PATH.")
+        return None
+    except Exception as e:
+        print(f"Viseme lipsync error: {e}")
+        print("Falling back to basic video generation...")
+        return generate_lipsync_basic(audio_file, face_file, filename, profile)
+
+def warmup(engine=None, face_file=AVATAR_FACE):
+    """
+    Preload what the engine needs so the first request does not pay for it:
+    the Wav2Lip worker process, the viseme mouth levels or the idle loop.
+    Encode profiles never measured on this host are calibrated here, so a
+    latency budget does not wait for it.
+    """
+    engine = engine or LIPSYNC_ENGINE
+    encode.speeds.calibrate_missing()
+    if engine in WAV2LIP_BACKENDS:
+        checkpoint_path = os.path.join(WAV2LIP_PATH, 'checkpoints', 'wav2lip_gan.pth')
+        if WAV2LIP_WORKER_ENABLED and has_checkpoint(checkpoint_path):
+            worker = wav2lip_worker.get_worker(wav2lip_backend(WAV2LIP_BACKENDS[engine]))
+            worker.ensure_running()
+            if not worker.ping():
+                print("Wav2Lip worker did not answer the warmup health check")
+            return
+        # Without the worker, requests fall back to the basic engine
+        engine = "basic"
+    if engine == "viseme":
+        from backend.modules import viseme
+        viseme.load_face(avatars.resolve(face_file), max_height=encode.get().max_height)
+    elif engine == "basic":
+        idle_loop.get_loop(avatars.resolve(face_file))
+
+ENGINES = {
+    "wav2lip": generate_lipsync_wav2lip,
+    "wav2lip_onnx": generate_lipsync_wav2lip_onnx,
+    "viseme": generate_lipsync_viseme,
+    "basic": generate_lipsync_basic,
+}
+
+# Wav2Lip engines and the worker backend each one asks for (None = WAV2LIP_BACKEND)
+WAV2LIP_BACKENDS = {"wav2lip": None, "wav2lip_onnx": "onnx"}
+
+def face_size(face_file):
+    """(width, height) of a face image or registered avatar, or (None, None) if unreadable."""
+    if avatars.is_registered(face_file):
+        meta = avatars.read_meta(face_file)
+        return meta.get("width"), meta.get("height")
+    import cv2
+
+    image = cv2.imread(face_file)
+    return (image.shape[1], image.shape[0]) if image is not None else (None, None)
+
+def choose_profile(audio_file, face_file=AVATAR_FACE, profile=None, latency_budget=None, engine=None):
+    """
+    Encode profile for a request: ``profile`` if given, else the best one
+    whose measured Wav2Lip inference (for the Wav2Lip engines) and encode
+    speed fit ``latency_budget`` seconds for this audio and face, else
+    ENCODE_PROFILE (see ``encode.choose``).
+    """
+    if profile or latency_budget is None:
+        return encode.get(profile)
+    width, height = face_size(face_file)
+    duration = idle_loop.audio_duration(audio_file)
+    inference = None
+    engine = engine or LIPSYNC_ENGINE
+    if engine in WAV2LIP_BACKENDS:
+        backend = wav2lip_backend(WAV2LIP_BACKENDS[engine])
+        # Still faces are rendered at the profile's frame rate, videos at their own
+        still = not avatars.is_registered(face_file) or avatars.read_meta(face_file).get("frames", 1) == 1
+        inference = lambda p: encode.speeds.inference(
+            backend, duration * (p.frame_rate(WAV2LIP_FPS) if still else WAV2LIP_FPS))
+    return encode.choose(None, latency_budget, duration, width, height, inference=inference)
+
+def generate_lipsync(audio_file, face_file=AVATAR_FACE, filename=None, engine=None, profile=None,
+                     latency_budget=None):
+    """
+    Main function: render with the selected engine (default LIPSYNC_ENGINE).
+
+    ``audio_file`` may be a WAV path or an AudioBuffer returned by
+    ``tts.speak(..., as_buffer=True)``. ``face_file`` is an image path or
+    the ID of an avatar registered with ``backend.modules.avatars``.
+
+    Without a ``filename`` the video is written to a new job directory of
+    the artifact store and published there only once it is complete.
+
+    Engines: "wav2lip" (neural, falls back to basic if needed),
+    "wav2lip_onnx" (the same through ONNX Runtime), "viseme" (fast CPU
+    mouth animation) and "basic" (static image).
+
+    ``profile`` is an encode profile ("preview", "balanced", "archival");
+    without one, ``latency_budget`` (seconds the render may take) picks
+    the best profile this host can render in time.
+    """
+    engine = engine or LIPSYNC_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown lipsync engine: {engine} (choose from {', '.join(ENGINES)})")
+    profile = choose_profile(audio_file, face_file, profile, latency_budget, engine).name
+    if filename is not None:
+        with metrics.stage(f"lipsync.{engine}"):
+            return ENGINES[engine](audio_file, face_file, filename, profile=profile)
+
+    artifact = artifacts.store.create("lipsync")
+    try:
+        with metrics.stage(f"lipsync.{engine}"):
+            video = ENGINES[engine](audio_file, face_file, artifact.path("output.mp4"), profile=profile)
+    except BaseException:
+        artifact.discard()
+        raise
+    if not video:
+        artifact.discard()
+        return None
+    artifact.commit()
+    return artifact.path(os.path.basename(video))
+
+def generate_segments(audio_file, face_file=AVATAR_FACE, output_dir=None, engine=None, cancel=None,
+                      profile=None):
+    """
+    Render into HLS segments plus a playlist that is updated as each segment
+    is finished, so playback can start before the whole video is rendered.
+
+    Returns the playlist path (``index.m3u8`` in ``output_dir``) or None if
+    rendering failed. Without ``output_dir`` the segments go to a new live
+    job directory of the artifact store, which is removed again if
+    rendering fails or is cancelled. Setting the ``cancel`` event (a
+    threading.Event) aborts the render between segments and also returns
+    None. ``profile`` is the encode profile (default ENCODE_PROFILE).
+    """
+    engine = engine or LIPSYNC_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown lipsync engine: {engine} (choose from {', '.join(ENGINES)})")
+    profile = encode.get(profile).name
+    if output_dir is not None:
+        return _generate_segments(audio_file, face_file, output_dir, engine, cancel, profile)
+
+    # Live: the playlist is played from its final directory while it grows
+    artifact = artifacts.store.create("segments", live=True)
+    try:
+        playlist = _generate_segments(audio_file, face_file, artifact.directory, engine, cancel,
+                                      profile)
+    except BaseException:
+        artifact.discard()
+        raise
+    if not playlist:
+        artifact.discard()
+        return None
+    artifact.commit()
+    return playlist
+
+def _generate_segments(audio_file, face_file, output_dir, engine, cancel, profile):
+    from backend.modules import audio, segments
+
+    avatar, face_file = face_file, avatars.resolve(face_file)
+
+    if not os.path.exists(face_file) or not audio.exists(audio_file):
+        print(f"❌ Missing files: {face_file} or {audio.describe(audio_file)}")
+        return None
+
+    print(f"Creating {engine} segments: {audio.describe(audio_file)} + {face_file} → {output_dir}")
+
+    if engine in WAV2LIP_BACKENDS:
+        checkpoint_path = os.path.join(WAV2LIP_PATH, 'checkpoints', 'wav2lip_gan.pth')
+        if WAV2LIP_WORKER_ENABLED and has_checkpoint(checkpoint_path):
+            try:
+                with metrics.stage(f"lipsync.segments.{engine}"):
+                    worker = wav2lip_worker.get_worker(wav2lip_backend(WAV2LIP_BACKENDS[engine]))
+                    playlist = worker.render_segments(
+                        audio_file, avatar, output_dir, cancel=cancel, profile=profile)
+                print(f"✅ Wav2Lip segments ready: {playlist}")
+                return playlist
+            except segments.RenderCancelled:
+                print("Render cancelled")
+                return None
+            except Exception as e:
+                print(f"Wav2Lip worker error: {e}")
+        else:
+            print("Segmented Wav2Lip output needs the worker and its checkpoint")
+        print("Falling back to basic video generation...")
+        engine = "basic"
+
+    render = segments.render_viseme if engine == "viseme" else segments.render_still
+    try:
+        with metrics.stage(f"lipsync.segments.{engine}"):
+            playlist = render(audio_file, face_file, output_dir, cancel=cancel, profile=profile)
+        print(f"✅ Segments ready: {playlist}")
+        return playlist
+    except segments.RenderCancelled:
+        print("Render cancelled")
+        return None
+    except FileNotFoundError:
+        print("❌ FFmpeg not found. Please install ffmpeg and ensure it is in your PATH.")
+        return None
+    except Exception as e:
+        print(f"❌ Segment rendering failed: {e}")
+        return None
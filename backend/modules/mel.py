@@ -0,0 +1,215 @@
+"""
+Wav2Lip audio features in plain NumPy.
+
+Produces the same normalized log-mel spectrogram as Wav2Lip's ``audio.py``
+(pre-emphasis, 800-point STFT with a 200-sample hop, 80 Slaney mel bands,
+symmetric [-4, 4] normalization), without its per-request overhead:
+
+- the mel filterbank is built once per (sample rate, n_fft, n_mels),
+- the STFT is a single rFFT over a strided view of every frame,
+- the 16-column window of each video frame is a view of the spectrogram,
+  copied only when a batch is gathered for the model,
+- features are cached by audio content hash, so rendering the same audio
+  onto another face reuses them.
+"""
+
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import MEL_CACHE_SIZE
+
+# Wav2Lip hparams (hparams.py) the checkpoint was trained with
+SAMPLE_RATE = 16000
+N_FFT = 800
+HOP_SIZE = 200
+N_MELS = 80
+FMIN = 55
+FMAX = 7600
+PREEMPHASIS = 0.97
+REF_LEVEL_DB = 20
+MIN_LEVEL_DB = -100
+MAX_ABS_VALUE = 4.
+# Mel columns the model sees per video frame
+STEP_SIZE = 16
+
+
+# Slaney mel scale (librosa's default, htk=False): linear below 1 kHz, logarithmic above
+_F_SP = 200.0 / 3
+_MIN_LOG_HZ = 1000.0
+_MIN_LOG_MEL = _MIN_LOG_HZ / _F_SP
+_LOGSTEP = np.log(6.4) / 27.0
+
+
+def _hz_to_mel(freqs):
+    freqs = np.asarray(freqs, dtype=np.float64)
+    log_mels = _MIN_LOG_MEL + np.log(np.maximum(freqs, _MIN_LOG_HZ) / _MIN_LOG_HZ) / _LOGSTEP
+    return np.where(freqs >= _MIN_LOG_HZ, log_mels, freqs / _F_SP)
+
+
+def _mel_to_hz(mels):
+    mels = np.asarray(mels, dtype=np.float64)
+    log_freqs = _MIN_LOG_HZ * np.exp(_LOGSTEP * (np.maximum(mels, _MIN_LOG_MEL) - _MIN_LOG_MEL))
+    return np.where(mels >= _MIN_LOG_MEL, log_freqs, _F_SP * mels)
+
+
+@functools.lru_cache(maxsize=8)
+def mel_basis(sample_rate=SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS, fmin=FMIN, fmax=FMAX):
+    """Slaney-normalized (n_mels, 1 + n_fft // 2) filterbank, built once per parameter set.
+
+    Matches ``librosa.filters.mel`` with its defaults; the returned array is
+    shared, so it is read-only.
+    """
+    fft_freqs = np.linspace(0, sample_rate / 2, 1 + n_fft // 2)
+    mel_freqs = _mel_to_hz(np.linspace(_hz_to_mel(fmin), _hz_to_mel(fmax), n_mels + 2))
+
+    fdiff = np.diff(mel_freqs)
+    ramps = mel_freqs[:, np.newaxis] - fft_freqs[np.newaxis, :]
+    lower = -ramps[:-2] / fdiff[:-1, np.newaxis]
+    upper = ramps[2:] / fdiff[1:, np.newaxis]
+    weights = np.maximum(0, np.minimum(lower, upper))
+    weights *= (2.0 / (mel_freqs[2:n_mels + 2] - mel_freqs[:n_mels]))[:, np.newaxis]
+
+    weights = weights.astype(np.float32)
+    weights.flags.writeable = False
+    return weights
+
+
+@functools.lru_cache(maxsize=8)
+def _hann(n_fft):
+    """Periodic Hann window, as used by librosa's STFT."""
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+def stft_magnitude(wav, n_fft=N_FFT, hop_size=HOP_SIZE):
+    """|STFT| of ``wav`` as (1 + n_fft // 2, frames), computed in one batched rFFT.
+
+    Frames are centred like librosa (zero padding of n_fft // 2 on both
+    sides), so column ``c`` is centred on sample ``c * hop_size``.
+    """
+    pad = n_fft // 2
+    padded = np.pad(np.asarray(wav, dtype=np.float32), pad)
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_size]
+    return np.abs(np.fft.rfft(frames * _hann(n_fft), axis=1)).T
+
+
+def melspectrogram(wav, sample_rate=SAMPLE_RATE):
+    """Normalized log-mel spectrogram (N_MELS, columns), as Wav2Lip's ``audio.melspectrogram``."""
+    wav = np.asarray(wav, dtype=np.float32)
+    if len(wav) == 0:
+        return np.empty((N_MELS, 0), dtype=np.float32)
+    emphasized = np.empty_like(wav)
+    emphasized[0] = wav[0]
+    emphasized[1:] = wav[1:] - PREEMPHASIS * wav[:-1]
+
+    mel = mel_basis(sample_rate, N_FFT, N_MELS, FMIN, FMAX) @ stft_magnitude(emphasized)
+    db = 20 * np.log10(np.maximum(1e-5, mel)) - REF_LEVEL_DB
+    normalized = (2 * MAX_ABS_VALUE) * ((db - MIN_LEVEL_DB) / -MIN_LEVEL_DB) - MAX_ABS_VALUE
+    return np.clip(normalized, -MAX_ABS_VALUE, MAX_ABS_VALUE).astype(np.float32)
+
+
+def frame_starts(n_columns, fps):
+    """First mel column of each video frame Wav2Lip renders for ``n_columns``.
+
+    Frame ``i`` starts at column ``int(i * 80 / fps)``. As in Wav2Lip's
+    inference loop, frames run while a full window fits, plus a final one
+    clamped to the end of the audio.
+    """
+    multiplier = 80. / fps
+    last_start = max(0, n_columns - STEP_SIZE)
+    fitting = int(np.ceil((last_start + 1) / multiplier)) if n_columns >= STEP_SIZE else 0
+    # Correct float rounding against the exact test the loop makes
+    while fitting and int((fitting - 1) * multiplier) > last_start:
+        fitting -= 1
+    while n_columns >= STEP_SIZE and int(fitting * multiplier) <= last_start:
+        fitting += 1
+    starts = (np.arange(fitting + 1) * multiplier).astype(np.int64)
+    return np.minimum(starts, last_start)
+
+
+class MelFeatures:
+    """Mel spectrogram of one utterance plus its per-video-frame windows.
+
+    ``columns`` is a strided view holding the 16-column window starting at
+    every mel column, so ``features[i]`` (the window of video frame ``i``)
+    is a view too. Only :meth:`batch` copies, when it gathers the windows
+    of a batch into the (N, 80, 16, 1) model input.
+    """
+
+    def __init__(self, mel, fps):
+        if mel.shape[1] < STEP_SIZE:
+            # Shorter than one window: pad with silence so the frame has full input
+            pad = np.full((mel.shape[0], STEP_SIZE - mel.shape[1]), -MAX_ABS_VALUE, dtype=mel.dtype)
+            mel = np.concatenate((mel, pad), axis=1)
+        mel.flags.writeable = False
+        self.mel = mel
+        self.fps = fps
+        self.starts = frame_starts(mel.shape[1], fps)
+        self.columns = np.lib.stride_tricks.sliding_window_view(mel, STEP_SIZE, axis=1).transpose(1, 0, 2)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, frame):
+        return self.columns[self.starts[frame]]
+
+    def batch(self, start, end):
+        """Model input for video frames ``start`` to ``end`` (exclusive)."""
+        return self.columns[self.starts[start:end]][..., np.newaxis]
+
+
+def audio_hash(wav, sample_rate):
+    digest = hashlib.sha256(np.ascontiguousarray(wav, dtype=np.float32).tobytes())
+    digest.update(str(sample_rate).encode())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """Most recently used mel spectrograms, keyed by audio content hash.
+
+    Re-rendering the same audio (another face, a retry, a different
+    segment layout) skips the front-end entirely. The spectrogram does not
+    depend on the frame rate, so one entry serves every fps.
+    """
+
+    def __init__(self, max_entries=MEL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, wav, sample_rate=SAMPLE_RATE):
+        key = audio_hash(wav, sample_rate)
+        with self._lock:
+            mel = self._entries.get(key)
+            if mel is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return mel
+            self.misses += 1
+
+        mel = melspectrogram(wav, sample_rate)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = mel
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return mel
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = FeatureCache()
+
+
+def features(wav, fps, sample_rate=SAMPLE_RATE):
+    """Per-video-frame mel windows of ``wav`` (float samples at ``sample_rate``)."""
+    return MelFeatures(cache.get(wav, sample_rate), fps)
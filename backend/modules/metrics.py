@@ -0,0 +1,278 @@
+"""
+Per-stage latency and resource instrumentation.
+
+Wrap work in ``with metrics.stage("tts.synthesis"):`` to record its wall
+time, CPU time, time spent in child processes (ffmpeg, piper CLI, ...) and
+the process peak RSS. Stages feed rolling histograms in a per-process
+registry that can be exported as JSON or Prometheus text; inside
+``with metrics.trace("request-id"):`` every stage is also appended to a
+per-request trace that can be dumped to disk. Measurements that are not
+durations (batch fill ratios, ...) go through ``metrics.observe_value``.
+
+CPU and subprocess times are process-wide, so concurrent stages in other
+threads are included in each other's numbers.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+from config import METRICS_TRACE_DIR
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Bucket upper bounds in seconds, Prometheus style
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Samples kept per stage for rolling quantiles
+WINDOW = 1024
+
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def _child_seconds():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Histogram:
+    """Cumulative bucket counts plus a rolling window for quantiles."""
+
+    def __init__(self, buckets=BUCKETS, window=WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantile(self, q):
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": max(self.recent) if self.recent else None,
+        }
+
+
+class StageStats:
+    def __init__(self):
+        self.wall = Histogram()
+        self.cpu = Histogram()
+        self.subprocess = Histogram()
+        self.errors = 0
+
+
+class Registry:
+    """Per-process collection of stage statistics."""
+
+    def __init__(self):
+        self._stages = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, wall, cpu=0.0, subprocess_time=0.0, error=False):
+        with self._lock:
+            stats = self._stages.setdefault(name, StageStats())
+            stats.wall.observe(wall)
+            stats.cpu.observe(cpu)
+            stats.subprocess.observe(subprocess_time)
+            if error:
+                stats.errors += 1
+
+    def record_value(self, name, value):
+        with self._lock:
+            self._values.setdefault(name, Histogram()).observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._values.clear()
+
+    def export_json(self):
+        with self._lock:
+            stages = {
+                name: {
+                    "wall_seconds": stats.wall.as_dict(),
+                    "cpu_seconds": stats.cpu.as_dict(),
+                    "subprocess_seconds": stats.subprocess.as_dict(),
+                    "errors": stats.errors,
+                }
+                for name, stats in sorted(self._stages.items())
+            }
+            values = {name: hist.as_dict() for name, hist in sorted(self._values.items())}
+        return {"stages": stages, "values": values, "peak_rss_bytes": peak_rss_bytes()}
+
+    def export_prometheus(self):
+        lines = [
+            "# HELP tts_stage_wall_seconds Wall time per pipeline stage",
+            "# TYPE tts_stage_wall_seconds histogram",
+        ]
+        with self._lock:
+            items = sorted(self._stages.items())
+            for name, stats in items:
+                cumulative = 0
+                for bound, count in zip(stats.wall.buckets + (float("inf"),), stats.wall.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'tts_stage_wall_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'tts_stage_wall_seconds_sum{{stage="{name}"}} {stats.wall.sum}')
+                lines.append(f'tts_stage_wall_seconds_count{{stage="{name}"}} {stats.wall.count}')
+
+            for metric, attr, help_text in (
+                ("tts_stage_cpu_seconds", "cpu", "Process CPU time per pipeline stage"),
+                ("tts_stage_subprocess_seconds", "subprocess", "Child process CPU time per pipeline stage"),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} summary")
+                for name, stats in items:
+                    hist = getattr(stats, attr)
+                    lines.append(f'{metric}_sum{{stage="{name}"}} {hist.sum}')
+                    lines.append(f'{metric}_count{{stage="{name}"}} {hist.count}')
+
+            lines.append("# HELP tts_stage_errors_total Failed executions per pipeline stage")
+            lines.append("# TYPE tts_stage_errors_total counter")
+            for name, stats in items:
+                lines.append(f'tts_stage_errors_total{{stage="{name}"}} {stats.errors}')
+
+            if self._values:
+                lines.append("# HELP tts_value Non-time measurements (e.g. batch fill ratios)")
+                lines.append("# TYPE tts_value summary")
+                for name, hist in sorted(self._values.items()):
+                    for q in (0.5, 0.95):
+                        lines.append(f'tts_value{{name="{name}",quantile="{q}"}} {hist.quantile(q)}')
+                    lines.append(f'tts_value_sum{{name="{name}"}} {hist.sum}')
+                    lines.append(f'tts_value_count{{name="{name}"}} {hist.count}')
+
+        rss = peak_rss_bytes()
+        if rss is not None:
+            lines.append("# HELP tts_process_peak_rss_bytes Peak resident set size")
+            lines.append("# TYPE tts_process_peak_rss_bytes gauge")
+            lines.append(f"tts_process_peak_rss_bytes {rss}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Trace:
+    """Stages recorded while handling one request."""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def as_dict(self):
+        with self._lock:
+            return {"request_id": self.request_id, "started": self.started, "spans": list(self.spans)}
+
+    def dump(self, directory=None):
+        directory = directory or METRICS_TRACE_DIR or "traces"
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"trace-{self.request_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, indent=2)
+        return path
+
+
+@contextlib.contextmanager
+def trace(request_id=None, dump=None):
+    """Collect all stages run in this context into a Trace.
+
+    The trace is written to METRICS_TRACE_DIR when ``dump`` is true, which
+    defaults to whether that directory is configured.
+    """
+    current = Trace(request_id)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        if dump is None:
+            dump = bool(METRICS_TRACE_DIR)
+        if dump:
+            current.dump()
+
+
+def observe(name, wall, cpu=0.0, subprocess_time=0.0, error=False, **extra):
+    """Record a stage measured elsewhere (e.g. reported by a worker process)."""
+    registry.record(name, wall, cpu, subprocess_time, error)
+    current = _current_trace.get()
+    if current is not None:
+        span = {"stage": name, "wall": round(wall, 6), "cpu": round(cpu, 6),
+                "subprocess": round(subprocess_time, 6), "error": error}
+        span.update(extra)
+        current.add(span)
+
+
+def observe_value(name, value):
+    """Record a measurement that is not a duration, such as a batch fill ratio."""
+    registry.record_value(name, value)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Measure the enclosed block as pipeline stage ``name``."""
+    wall0 = time.perf_counter()
+    cpu0 = time.process_time()
+    child0 = _child_seconds()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe(name, time.perf_counter() - wall0, time.process_time() - cpu0,
+                _child_seconds() - child0, error, peak_rss_bytes=peak_rss_bytes())
+
+
+def timed(name):
+    """Decorator form of :func:`stage`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,254 @@
+"""
+Segmented video output: an HLS playlist that grows while the video renders.
+
+Frames go to a single ffmpeg process as soon as they are produced. ffmpeg
+cuts them into fragmented-MP4 (or MPEG-TS) segments of SEGMENT_SECONDS and
+rewrites the playlist after each one, so a player can start on the first
+segment while the rest of the utterance is still being rendered. Keyframes
+are forced on segment boundaries so every segment can be decoded on its own.
+"""
+
+import math
+import os
+import subprocess
+import threading
+import time
+
+from config import IDLE_LOOP_FPS, SEGMENT_SECONDS, SEGMENT_TYPE, VISEME_FPS
+from backend.modules import audio, encode, metrics
+
+PLAYLIST = "index.m3u8"
+INIT_SEGMENT = "init.mp4"
+SEGMENT_EXTENSIONS = {"fmp4": "m4s", "mpegts": "ts"}
+
+
+class RenderCancelled(Exception):
+    """Raised when a render is aborted through its cancel event."""
+
+
+def check_cancel(cancel):
+    """Raise RenderCancelled if the ``cancel`` event (or callable) is set."""
+    if cancel is None:
+        return
+    if cancel() if callable(cancel) else cancel.is_set():
+        raise RenderCancelled("render cancelled")
+
+
+def segment_frames(fps, segment_seconds=SEGMENT_SECONDS):
+    """Number of video frames per segment."""
+    return max(1, int(round(segment_seconds * fps)))
+
+
+def plan_windows(n_frames, fps, segment_seconds=SEGMENT_SECONDS):
+    """Split ``n_frames`` into (start, end) render windows, one per segment.
+
+    ffmpeg only closes a segment once the first frame of the next one has
+    been encoded, so each window also takes that frame. The first segment
+    is then published as soon as the first window is rendered.
+    """
+    step = segment_frames(fps, segment_seconds)
+    bounds = [0] + [boundary + 1 for boundary in range(step, n_frames - 1, step)] + [n_frames]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def clear(output_dir):
+    """Remove the playlist and segments of a previous render in ``output_dir``."""
+    if not os.path.isdir(output_dir):
+        return
+    for name in os.listdir(output_dir):
+        if name in (PLAYLIST, INIT_SEGMENT) or name.startswith("segment_"):
+            os.remove(os.path.join(output_dir, name))
+
+
+class SegmentWriter:
+    """Encode raw BGR frames into HLS segments while they are being written.
+
+    Use as a context manager: ``write`` each frame, ``flush`` after each
+    render window, and the playlist is finalized on exit. ``profile`` gives
+    the x264 preset, CRF and audio bitrate (default ENCODE_PROFILE); frames
+    must already have its size and frame rate.
+    """
+
+    def __init__(self, output_dir, audio_input, width, height, fps,
+                 segment_seconds=SEGMENT_SECONDS, segment_type=SEGMENT_TYPE, profile=None):
+        if segment_type not in SEGMENT_EXTENSIONS:
+            raise ValueError(f"Unknown segment type: {segment_type} "
+                             f"(choose from {', '.join(SEGMENT_EXTENSIONS)})")
+        self.output_dir = output_dir
+        self.playlist = os.path.join(output_dir, PLAYLIST)
+        self.audio_input = audio_input
+        # libx264 with yuv420p needs even dimensions
+        self.width = width // 2 * 2
+        self.height = height // 2 * 2
+        self.fps = fps
+        self.segment_seconds = segment_seconds
+        self.segment_type = segment_type
+        self.profile = encode.get(profile)
+        self.frames = 0
+        self.started = None
+        # Seconds from start until the playlist listed its first segment
+        self.first_segment_seconds = None
+        self._proc = None
+        self._on_finished = None
+        self._closed = False
+
+    def command(self, audio_args):
+        step = segment_frames(self.fps, self.segment_seconds)
+        extension = SEGMENT_EXTENSIONS[self.segment_type]
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error', '-nostats',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{self.width}x{self.height}',
+            '-r', str(self.fps), '-i', '-'] + audio_args + [
+            '-map', '0:v:0', '-map', '1:a:0']
+        # zerolatency: no lookahead or B-frames, so each frame is muxed as soon as it arrives
+        cmd += self.profile.video_args(tune='zerolatency') + [
+            '-force_key_frames', f'expr:gte(n,n_forced*{step})'] + self.profile.audio_args() + [
+            '-shortest',
+            '-f', 'hls', '-hls_time', f'{step / self.fps:.6f}', '-hls_list_size', '0',
+            '-hls_playlist_type', 'event', '-hls_segment_type', self.segment_type,
+            '-hls_flags', 'independent_segments+temp_file',
+            '-hls_segment_filename', os.path.join(self.output_dir, f'segment_%05d.{extension}'),
+        ]
+        if self.segment_type == "fmp4":
+            cmd += ['-hls_fmp4_init_filename', INIT_SEGMENT]
+        return cmd + [self.playlist]
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        clear(self.output_dir)
+        audio_args, pass_fds, on_started, self._on_finished = audio.ffmpeg_side_input(self.audio_input)
+        self.started = time.perf_counter()
+        try:
+            self._proc = subprocess.Popen(self.command(audio_args), stdin=subprocess.PIPE,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                          pass_fds=pass_fds)
+        finally:
+            on_started()
+        threading.Thread(target=self._watch_playlist, daemon=True).start()
+        return self
+
+    def _watch_playlist(self):
+        # The old playlist was cleared, so its appearance means a segment is out
+        while self._proc.poll() is None:
+            if os.path.exists(self.playlist):
+                self.first_segment_seconds = time.perf_counter() - self.started
+                return
+            time.sleep(0.02)
+
+    def write(self, frame):
+        """Queue one frame: an (H, W, 3) uint8 BGR array or its raw bytes."""
+        if self._closed:
+            # ffmpeg stopped reading (-shortest reached the end of the audio)
+            return
+        if hasattr(frame, 'shape'):
+            frame = frame[:self.height, :self.width].tobytes()
+        try:
+            self._proc.stdin.write(frame)
+        except BrokenPipeError:
+            self._finish()
+        self.frames += 1
+
+    def flush(self):
+        if self._closed:
+            return
+        try:
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            self._finish()
+
+    def close(self):
+        """Finish encoding; returns the playlist path."""
+        self._finish()
+        if self.first_segment_seconds is None and os.path.exists(self.playlist):
+            self.first_segment_seconds = time.perf_counter() - self.started
+        if self.first_segment_seconds is not None:
+            metrics.observe("lipsync.segments.first_segment", self.first_segment_seconds)
+        return self.playlist
+
+    def _finish(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            stderr = self._proc.stderr.read().decode(errors='replace')
+            if self._proc.wait() != 0:
+                raise RuntimeError(f"FFmpeg failed: {stderr}")
+        finally:
+            self._on_finished()
+            self._on_finished = _noop
+
+    def abort(self):
+        self._closed = True
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        self._on_finished()
+        self._on_finished = _noop
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _noop():
+    pass
+
+
+def render_viseme(audio_input, face_file, output_dir, fps=None, cancel=None, profile=None, **options):
+    """Viseme lip sync written as HLS segments; returns the playlist path.
+
+    ``cancel`` is checked between windows; once set, ffmpeg is stopped and
+    RenderCancelled is raised. ``profile`` is the encode profile (default
+    ENCODE_PROFILE), whose size and frame rate the frames are made at.
+    """
+    import numpy as np
+    from backend.modules import viseme
+
+    profile = encode.get(profile)
+    fps = fps or profile.frame_rate(VISEME_FPS)
+    frames, width, height = viseme.load_face(face_file, max_height=profile.max_height)
+    buffer = audio.load(audio_input)
+    openness = viseme.mouth_openness(buffer.as_float32(), buffer.sample_rate, fps)
+    indices = np.rint(openness * (len(frames) - 1)).astype(np.int64)
+
+    with SegmentWriter(output_dir, audio_input, width, height, fps, profile=profile, **options) as writer:
+        for start, end in plan_windows(len(indices), fps, writer.segment_seconds):
+            check_cancel(cancel)
+            for index in indices[start:end]:
+                writer.write(frames[index])
+            writer.flush()
+    return writer.playlist
+
+
+def render_still(audio_input, face_file, output_dir, fps=None, cancel=None, profile=None, **options):
+    """The static face over the audio, written as HLS segments."""
+    import cv2
+
+    profile = encode.get(profile)
+    fps = fps or profile.frame_rate(IDLE_LOOP_FPS)
+    image = cv2.imread(face_file)
+    if image is None:
+        raise ValueError(f"Could not read face image: {face_file}")
+    size = profile.size(image.shape[1], image.shape[0])
+    if size != (image.shape[1], image.shape[0]):
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    n_frames = max(1, int(math.ceil(audio.load(audio_input).duration * fps)))
+
+    with SegmentWriter(output_dir, audio_input, image.shape[1], image.shape[0], fps, profile=profile,
+                       **options) as writer:
+        frame = image[:writer.height, :writer.width].tobytes()
+        for start, end in plan_windows(n_frames, fps, writer.segment_seconds):
+            check_cancel(cancel)
+            for _ in range(start, end):
+                writer.write(frame)
+            writer.flush()
+    return writer.playlist
@@ -1,23 +1,257 @@
+import asyncio
 import json
 import queue
-import sounddevice as sd
-import vosk
-from config import VOSK_MODEL_PATH
+import threading
+import wave
 
-q = queue.Queue()
-model = vosk.Model(VOSK_MODEL_PATH)
+from config import VOSK_MODEL_PATH, STT_ENDPOINT_SILENCE_MS, STT_VAD_THRESHOLD_DB
+from backend.modules import metrics
 
-def transcribe():
-    rec = vosk.KaldiRecognizer(model, 16000)
-    with sd.RawInputStream(samplerate=16000, blocksize=8000, dtype='int16',
-                           channels=1, callback=lambda indata, f, t, s: q.put(bytes(indata))):
-        print("Speak now (CTRL+C to stop)...")
+SAMPLE_RATE = 16000
+BLOCK_SIZE = 8000
+
+# Loaded on first use and shared by every recognizer in the process
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """Return the process-wide Vosk model, loading it on first call."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                import vosk
+
+                with metrics.stage("stt.model_load"):
+                    _model = vosk.Model(VOSK_MODEL_PATH)
+    return _model
+
+
+def warmup():
+    """Load the Vosk model ahead of the first request."""
+    import vosk
+
+    vosk.KaldiRecognizer(get_model(), SAMPLE_RATE)
+
+
+class Endpointer:
+    """Energy-based end-of-utterance detector.
+
+    Each audio block is split into short frames whose energy is computed in
+    one vectorized pass. A frame counts as speech when it is louder than
+    ``threshold_db`` dBFS and at least ``margin_db`` above the running noise
+    floor. Once speech has been heard, ``silence_ms`` of consecutive
+    non-speech frames mark the endpoint.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, silence_ms=STT_ENDPOINT_SILENCE_MS,
+                 threshold_db=STT_VAD_THRESHOLD_DB, margin_db=6.0, frame_ms=20):
+        self.sample_rate = sample_rate
+        self.frame_len = max(1, int(sample_rate * frame_ms / 1000))
+        self.frame_ms = self.frame_len * 1000.0 / sample_rate
+        self.silence_ms = silence_ms
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.reset()
+
+    def reset(self):
+        self.noise_db = None
+        self.speech_seen = False
+        self.trailing_silence_ms = 0.0
+
+    def frame_levels(self, pcm):
+        """Return the dBFS level of each full frame in a 16-bit PCM block."""
+        import numpy as np
+
+        samples = np.frombuffer(pcm, dtype='<i2')
+        n_frames = len(samples) // self.frame_len
+        if not n_frames:
+            return np.empty(0)
+        frames = samples[:n_frames * self.frame_len].reshape(n_frames, self.frame_len)
+        rms = np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1)) / 32768.0
+        return 20.0 * np.log10(rms + 1e-10)
+
+    def process(self, pcm):
+        """Feed one block; return True when the utterance has ended."""
+        import numpy as np
+
+        levels = self.frame_levels(pcm)
+        if not len(levels):
+            return False
+
+        # Slowly tracked noise floor from the quietest frames
+        quiet = float(np.percentile(levels, 10))
+        self.noise_db = quiet if self.noise_db is None else min(quiet, 0.9 * self.noise_db + 0.1 * quiet)
+        is_speech = (levels > self.threshold_db) & (levels > self.noise_db + self.margin_db)
+
+        speech_idx = np.flatnonzero(is_speech)
+        if len(speech_idx):
+            self.speech_seen = True
+            self.trailing_silence_ms = (len(levels) - 1 - speech_idx[-1]) * self.frame_ms
+        elif self.speech_seen:
+            self.trailing_silence_ms += len(levels) * self.frame_ms
+
+        return self.speech_seen and self.trailing_silence_ms >= self.silence_ms
+
+
+# --- Audio sources: each yields 16-bit mono PCM blocks at SAMPLE_RATE ---
+
+def microphone_blocks(blocksize=BLOCK_SIZE):
+    """Yield blocks from the default microphone until the generator is closed."""
+    import sounddevice as sd
+
+    blocks = queue.Queue()
+    with sd.RawInputStream(samplerate=SAMPLE_RATE, blocksize=blocksize, dtype='int16',
+                           channels=1, callback=lambda indata, f, t, s: blocks.put(bytes(indata))):
         while True:
-            data = q.get()
+            yield blocks.get()
+
+
+def wav_blocks(path, blocksize=BLOCK_SIZE):
+    """Yield blocks from a WAV file, resampled to 16 kHz mono if needed."""
+    with wave.open(path, 'rb') as wav_file:
+        ready = (wav_file.getframerate() == SAMPLE_RATE and wav_file.getnchannels() == 1
+                 and wav_file.getsampwidth() == 2)
+        if ready:
+            while True:
+                data = wav_file.readframes(blocksize)
+                if not data:
+                    return
+                yield data
+
+    from backend.modules.audio import AudioBuffer
+    pcm = AudioBuffer.from_file(path).resample(SAMPLE_RATE).pcm_bytes()
+    yield from pcm_blocks(pcm, blocksize)
+
+
+def pcm_blocks(source, blocksize=BLOCK_SIZE):
+    """Yield blocks from raw 16 kHz PCM given as bytes or a binary file object."""
+    step = blocksize * 2
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        for start in range(0, len(source), step):
+            yield bytes(source[start:start + step])
+        return
+    while True:
+        data = source.read(step)
+        if not data:
+            return
+        yield data
+
+
+def audio_blocks(source=None):
+    """Open ``source`` (see :func:`stream_recognize`) as an iterator of PCM blocks."""
+    if source is None:
+        return microphone_blocks()
+    if isinstance(source, str):
+        return wav_blocks(source)
+    if isinstance(source, (bytes, bytearray, memoryview)) or hasattr(source, 'read'):
+        return pcm_blocks(source)
+    # Any other iterable of PCM blocks
+    return iter(source)
+
+
+def stream_recognize(source=None, endpointing=True, silence_ms=STT_ENDPOINT_SILENCE_MS,
+                     single_utterance=False):
+    """Recognize speech incrementally.
+
+    Yields ``{"type": "partial", "text": ...}`` whenever the hypothesis
+    changes and ``{"type": "final", "text": ..., "endpoint": ...}`` at the
+    end of each utterance. With ``endpointing`` the utterance is finalized as
+    soon as the energy endpointer sees ``silence_ms`` of trailing silence,
+    instead of waiting for Vosk's own timeout.
+
+    :param source: None for the microphone, a WAV path, raw 16 kHz PCM
+                   (bytes or binary file) or an iterable of PCM blocks
+    :param single_utterance: Stop after the first non-empty final result
+    """
+    import vosk
+
+    rec = vosk.KaldiRecognizer(get_model(), SAMPLE_RATE)
+    endpointer = Endpointer(silence_ms=silence_ms) if endpointing else None
+    last_partial = ""
+    blocks = audio_blocks(source)
+
+    def final(result_json, reason):
+        nonlocal last_partial
+        last_partial = ""
+        if endpointer:
+            endpointer.reset()
+        return {"type": "final", "text": json.loads(result_json).get("text", ""), "endpoint": reason}
+
+    try:
+        for data in blocks:
             if rec.AcceptWaveform(data):
-                result = json.loads(rec.Result())
-                text = result.get("text", "")
-                if text:
-                    return text
-                else:
-                    print("Didn't catch that, try again...")
+                result = final(rec.Result(), "recognizer")
+            elif endpointer and endpointer.process(data):
+                result = final(rec.FinalResult(), "silence")
+                rec.Reset()
+            else:
+                partial = json.loads(rec.PartialResult()).get("partial", "")
+                if partial and partial != last_partial:
+                    last_partial = partial
+                    yield {"type": "partial", "text": partial}
+                continue
+
+            yield result
+            if single_utterance and result["text"]:
+                return
+
+        result = final(rec.FinalResult(), "end_of_stream")
+        if result["text"]:
+            yield result
+    finally:
+        if hasattr(blocks, 'close'):
+            blocks.close()
+
+
+async def astream_recognize(source=None, **kwargs):
+    """Async version of :func:`stream_recognize`; recognition runs in a thread."""
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def guarded_blocks():
+        # Checked per block so closing the async generator also releases the source
+        inner = audio_blocks(source)
+        try:
+            for data in inner:
+                if stop.is_set():
+                    return
+                yield data
+        finally:
+            if hasattr(inner, 'close'):
+                inner.close()
+
+    def produce():
+        try:
+            for result in stream_recognize(guarded_blocks(), **kwargs):
+                loop.call_soon_threadsafe(results.put_nowait, result)
+        except Exception as e:
+            loop.call_soon_threadsafe(results.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(results.put_nowait, end)
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await results.get()
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+@metrics.timed("stt.transcribe")
+def transcribe():
+    print("Speak now (CTRL+C to stop)...")
+    for result in stream_recognize(single_utterance=True):
+        if result["type"] != "final":
+            continue
+        if result["text"]:
+            return result["text"]
+        print("Didn't catch that, try again...")
@@ -0,0 +1,100 @@
+import re
+from typing import List
+
+# Common Portuguese (and a few Latin) abbreviations that end with a period
+# but do not end a sentence. Compared lowercase, without the trailing dot.
+ABBREVIATIONS = {
+    "sr", "sra", "srs", "sras", "srta", "dr", "dra", "drs", "dras",
+    "prof", "profa", "profs", "eng", "enga", "arq", "exmo", "exma", "exmos",
+    "exmas", "ex", "exa", "v", "sto", "sta", "pe", "d",
+    "av", "r", "rua", "lg", "pç", "lda", "cia", "sa",
+    "p", "pp", "pág", "págs", "pag", "n", "nº", "n.º", "núm", "num",
+    "art", "arts", "cap", "caps", "vol", "vols", "fig", "figs", "ed",
+    "séc", "sec", "tel", "telef", "fax", "obs", "cf", "cfr", "etc",
+    "aprox", "máx", "mín", "min", "max", "ca", "i.e", "e.g", "vs",
+    "jan", "fev", "mar", "abr", "mai", "jun", "jul", "ago", "set", "out",
+    "nov", "dez", "seg", "qua", "qui", "sex", "sáb", "dom",
+}
+
+# Sentence-final punctuation, optionally followed by closing quotes/brackets
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'»”’)\]]*(?=\s)")
+_CLAUSE_END = re.compile(r"[,;:—–](?=\s)")
+_WORD_BEFORE = re.compile(r"([\w.º]+)[.]+$")
+
+
+def normalize(text: str) -> str:
+    """Collapse whitespace and strip the text."""
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def _is_abbreviation(prefix: str) -> bool:
+    match = _WORD_BEFORE.search(prefix)
+    if not match:
+        return False
+    word = match.group(1).lower()
+    if word in ABBREVIATIONS:
+        return True
+    # Initials such as "J. Silva" or "E.U.A."
+    return len(word.replace(".", "")) == 1 and word[-1].isalpha()
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences, ignoring abbreviations and initials."""
+    text = normalize(text)
+    sentences = []
+    start = 0
+
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        punct = match.group(0)
+        rest = text[end:].lstrip()
+
+        if punct.startswith(".") and punct.rstrip("\"'»”’)]") == ".":
+            if _is_abbreviation(text[start:match.start() + 1]):
+                continue
+            # A lowercase continuation means the period was not a full stop
+            if rest[:1].islower():
+                continue
+
+        sentence = text[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = end
+
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def split_clauses(sentence: str, max_chars: int = 200) -> List[str]:
+    """Split a long sentence at clause punctuation into pieces <= max_chars.
+
+    Pieces are only cut at commas, semicolons, colons or dashes, so a single
+    clause longer than ``max_chars`` is returned as is.
+    """
+    if len(sentence) <= max_chars:
+        return [sentence]
+
+    pieces = []
+    current = ""
+    bounds = [m.end() for m in _CLAUSE_END.finditer(sentence)] + [len(sentence)]
+    start = 0
+    for end in bounds:
+        clause = sentence[start:end]
+        start = end
+        if current and len(current) + len(clause) > max_chars:
+            pieces.append(current.strip())
+            current = ""
+        current += clause
+    if current.strip():
+        pieces.append(current.strip())
+    return pieces
+
+
+def segment(text: str, max_chars: int = 200) -> List[str]:
+    """Split text into sentence/clause segments suitable for synthesis."""
+    segments = []
+    for sentence in split_sentences(text):
+        segments.extend(split_clauses(sentence, max_chars))
+    return segments
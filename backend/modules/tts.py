@@ -1,29 +1,383 @@
+import atexit
+import multiprocessing
 import os
 import subprocess
-from typing import Optional
-from config import PIPER_VOICE, OUTPUT_DIR
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, Optional
+from config import (
+    PIPER_VOICE,
+    OUTPUT_DIR,
+    TTS_CACHE_ENABLED,
+    TTS_CROSSFADE_MS,
+    TTS_PARALLEL_MIN_CHARS,
+    TTS_PARALLEL_WORKERS,
+    TTS_SENTENCE_PAUSE_MS,
+)
+from backend.modules import voice_engine, metrics, text as text_utils
+from backend.modules.tts_cache import cache
 
 
-def speak(text, filename="output.wav", voice_model: Optional[str] = None):
+class StreamStats:
+    """Timing of a single :func:`speak_stream` call."""
+
+    def __init__(self):
+        self.sample_rate = None
+        self.segments = 0
+        self.audio_bytes = 0
+        self.time_to_first_chunk = None
+        self.synthesis_time = 0.0
+        self._start = time.perf_counter()
+
+    @property
+    def audio_seconds(self):
+        if not self.sample_rate:
+            return 0.0
+        return self.audio_bytes / 2 / self.sample_rate
+
+    @property
+    def real_time_factor(self):
+        """Synthesis time divided by audio duration (< 1 is faster than real time)."""
+        if not self.audio_seconds:
+            return None
+        return self.synthesis_time / self.audio_seconds
+
+    def as_dict(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "segments": self.segments,
+            "audio_seconds": round(self.audio_seconds, 3),
+            "time_to_first_chunk": self.time_to_first_chunk,
+            "synthesis_time": round(self.synthesis_time, 4),
+            "real_time_factor": self.real_time_factor,
+        }
+
+
+def warmup(voice_models=None):
+    """Load voices into the pool and run a tiny synthesis to warm ONNX Runtime.
+
+    :param voice_models: Model paths to preload (default: PIPER_VOICE)
+    """
+    for model_path in voice_models or [PIPER_VOICE]:
+        voice = voice_engine.pool.get(model_path)
+        for _ in voice_engine.synthesize_raw(voice, "Olá."):
+            pass
+
+
+def speak(text, filename=None, voice_model: Optional[str] = None,
+          use_cache: bool = TTS_CACHE_ENABLED, as_buffer: bool = False,
+          parallel: Optional[bool] = None):
     """Synthesize speech with Piper.
 
+    Uses the resident voice engine so the model is loaded only once per
+    process; the ``piper`` CLI is kept as a fallback. Repeated phrases are
+    served from the synthesis cache. If TTS_PARALLEL_MIN_CHARS is set, texts
+    of that length or more go through :func:`speak_long` unless ``parallel``
+    is False.
+
     :param text: Text to speak
-    :param filename: Output WAV filename under OUTPUT_DIR
+    :param filename: Output WAV filename under OUTPUT_DIR (default: a new
+                     job directory in the artifact store)
     :param voice_model: Optional override for the Piper model path
+    :param use_cache: Look up and store the audio in the synthesis cache
+    :param as_buffer: Return an in-memory AudioBuffer instead of writing
+                      the WAV file
+    :param parallel: Force (True) or disable (False) long-form synthesis
     """
+    if parallel is None:
+        parallel = bool(TTS_PARALLEL_MIN_CHARS) and len(text) >= TTS_PARALLEL_MIN_CHARS
+    if parallel:
+        return speak_long(text, filename, voice_model, use_cache=use_cache, as_buffer=as_buffer)
+    return _speak(text, filename, voice_model, use_cache, as_buffer)
 
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    output_file = os.path.join(OUTPUT_DIR, filename)
 
+@metrics.timed("tts.speak")
+def _speak(text, filename, voice_model, use_cache, as_buffer):
     model_path = voice_model or PIPER_VOICE
 
+    cache_key = cache.make_key(text, model_path, {"engine": "piper"}) if use_cache else None
+    wav_bytes = cache.get(cache_key) if cache_key else None
+
+    if wav_bytes is not None:
+        print("Audio served from synthesis cache")
+    else:
+        try:
+            voice = voice_engine.pool.get(model_path)
+            with metrics.stage("tts.synthesis"):
+                wav_bytes = voice_engine.synthesize_wav(voice, text)
+        except Exception as e:
+            print(f"Piper engine unavailable ({e}), falling back to piper CLI...")
+            wav_bytes = _synthesize_cli_wav(text, model_path)
+
+        if cache_key and wav_bytes:
+            try:
+                cache.put(cache_key, wav_bytes)
+            except OSError as e:
+                print(f"Warning: could not store audio in cache: {e}")
+
+    if as_buffer:
+        from backend.modules.audio import AudioBuffer
+
+        buffer = AudioBuffer.from_wav_bytes(wav_bytes)
+        if not len(buffer.samples):
+            raise RuntimeError("Empty audio generated")
+        print(f"Audio generated in memory: {buffer.duration:.2f}s @ {buffer.sample_rate} Hz")
+        return buffer
+    return _save(wav_bytes, filename)
+
+
+def _save(wav_bytes, filename):
+    if not wav_bytes:
+        raise RuntimeError("Empty audio file generated")
+
+    if filename is None:
+        from backend.modules.artifacts import store
+
+        with store.create("tts") as artifact:
+            with open(artifact.path("speech.wav"), "wb") as f:
+                f.write(wav_bytes)
+        output_file = artifact.path("speech.wav")
+    else:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        output_file = os.path.join(OUTPUT_DIR, filename)
+        # Written under a temporary name so an interrupted write never
+        # leaves a truncated WAV at output_file
+        partial = f"{output_file}.{os.getpid()}.partial"
+        try:
+            with open(partial, "wb") as f:
+                f.write(wav_bytes)
+            os.replace(partial, output_file)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    print(f"Audio generated at {output_file}, size: {len(wav_bytes)} bytes")
+    return output_file
+
+
+# --- Long-form synthesis: sentences spread over a pool of voice processes ---
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_init(model_path):
+    """Load the voice once in each pool process."""
+    try:
+        warmup([model_path])
+    except Exception as e:
+        print(f"Piper engine unavailable in synthesis worker ({e}), using the piper CLI")
+
+
+def _pool_ping():
+    return os.getpid()
+
+
+def _pool_synthesize(model_path, segment):
+    """Synthesize one segment in a pool process; returns (sample_rate, pcm)."""
+    try:
+        voice = voice_engine.pool.get(model_path)
+    except Exception:
+        stats = StreamStats()
+        pcm = _synthesize_cli_pcm(segment, model_path, stats)
+        return stats.sample_rate, pcm
+    return voice_engine.sample_rate(voice), b"".join(voice_engine.synthesize_raw(voice, segment))
+
+
+def _pool_size(workers):
+    return workers or os.cpu_count() or 1
+
+
+def synthesis_pool(voice_model: Optional[str] = None, workers: int = TTS_PARALLEL_WORKERS):
+    """Process pool whose workers keep ``voice_model`` loaded, one per voice and size."""
+    model_path = os.path.abspath(voice_model or PIPER_VOICE)
+    workers = _pool_size(workers)
+    key = (model_path, workers)
+    with _pools_lock:
+        executor = _pools.get(key)
+        if executor is None:
+            # Spawned, not forked: callers are often threaded (server, batch)
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_pool_init,
+                                           initargs=(model_path,),
+                                           mp_context=multiprocessing.get_context("spawn"))
+            _pools[key] = executor
+    return executor
+
+
+def warmup_parallel(voice_model: Optional[str] = None, workers: int = TTS_PARALLEL_WORKERS):
+    """Start every synthesis process and load its voice ahead of the first long text."""
+    executor = synthesis_pool(voice_model, workers)
+    futures = [executor.submit(_pool_ping) for _ in range(_pool_size(workers))]
+    for future in futures:
+        future.result()
+
+
+def shutdown_pools():
+    with _pools_lock:
+        executors = list(_pools.values())
+        _pools.clear()
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown_pools)
+
+
+def speak_long(text, filename=None, voice_model: Optional[str] = None,
+               workers: int = TTS_PARALLEL_WORKERS, pause_ms: int = TTS_SENTENCE_PAUSE_MS,
+               crossfade_ms: int = TTS_CROSSFADE_MS, use_cache: bool = TTS_CACHE_ENABLED,
+               as_buffer: bool = False, max_chars: int = 200):
+    """Synthesize a long text with its sentences spread over a process pool.
+
+    The text is normalized and segmented like :func:`speak_stream`; the
+    segments are synthesized in parallel by warm voice processes (see
+    :func:`synthesis_pool`) and joined in order. Each segment is trimmed of
+    Piper's own edge silence, so sentences are exactly ``pause_ms`` apart,
+    with click-free ``crossfade_ms`` fades at every join. Segments are
+    cached individually, so a paragraph that repeats known sentences only
+    synthesizes the new ones.
+
+    Returns the WAV path, or an AudioBuffer with ``as_buffer``, like :func:`speak`.
+    Timed as ``tts.speak_long``; a single segment is spoken (and timed) by
+    :func:`speak`.
+    """
+    segments = text_utils.segment(text, max_chars)
+    if len(segments) > 1:
+        result = _speak_long(text, segments, filename, voice_model or PIPER_VOICE, workers,
+                             pause_ms, crossfade_ms, use_cache, as_buffer)
+        if result is not None:
+            return result
+    return _speak(text, filename, voice_model, use_cache, as_buffer)
+
+
+@metrics.timed("tts.speak_long")
+def _speak_long(text, segments, filename, model_path, workers, pause_ms, crossfade_ms,
+                use_cache, as_buffer):
+    """:func:`speak_long` for two or more segments; None if the pool broke."""
+    from backend.modules import audio
+
+    keys = [cache.make_key(segment, model_path, {"engine": "piper"}) if use_cache else None
+            for segment in segments]
+    buffers = []
+    for key in keys:
+        wav_bytes = cache.get(key) if key else None
+        buffers.append(audio.AudioBuffer.from_wav_bytes(wav_bytes) if wav_bytes is not None else None)
+    missing = [i for i, buffer in enumerate(buffers) if buffer is None]
+
+    # Fully cached texts never start the pool
+    executor = synthesis_pool(model_path, workers) if missing else None
+    try:
+        with metrics.stage("tts.parallel_synthesis"):
+            futures = [(i, executor.submit(_pool_synthesize, model_path, segments[i])) for i in missing]
+            for i, future in futures:
+                sample_rate, pcm = future.result()
+                buffers[i] = audio.AudioBuffer.from_pcm(pcm, sample_rate)
+                if keys[i] and pcm:
+                    try:
+                        cache.put(keys[i], buffers[i].to_wav_bytes())
+                    except OSError as e:
+                        print(f"Warning: could not store audio in cache: {e}")
+    except BrokenProcessPool as e:
+        print(f"Synthesis pool failed ({e}), synthesizing serially...")
+        with _pools_lock:
+            for pool_key in [k for k, v in _pools.items() if v is executor]:
+                del _pools[pool_key]
+        return None
+
+    sample_rate = buffers[0].sample_rate
+    pieces = [audio.trim_silence(buffer.resample(sample_rate).as_float32(), sample_rate)
+              for buffer in buffers]
+    joined = audio.AudioBuffer(audio.concatenate(pieces, sample_rate, pause_ms, crossfade_ms),
+                               sample_rate)
+    if not len(joined.samples):
+        raise RuntimeError("Empty audio generated")
+    print(f"Synthesized {len(segments)} segments ({len(missing)} on {_pool_size(workers)} "
+          f"workers, {len(segments) - len(missing)} cached): {joined.duration:.2f}s of audio")
+
+    if as_buffer:
+        return joined
+    return _save(joined.to_wav_bytes(), filename)
+
+
+def _synthesize_cli_wav(text, model_path):
+    """Run the ``piper`` CLI into a temporary file and return the WAV bytes."""
+    fd, path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        _speak_cli(text, path, model_path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def _speak_cli(text, output_file, model_path):
+    """Synthesize by spawning the ``piper`` CLI (one process per utterance)."""
     cmd = ["piper", "-m", model_path, "-t", text, "-f", output_file]
-    result = subprocess.run(cmd, capture_output=True)
+    with metrics.stage("tts.piper_cli"):
+        result = subprocess.run(cmd, capture_output=True)
     
     if result.returncode != 0:
         raise RuntimeError(f"Piper failed: {result.stderr.decode()}")
-    if os.path.getsize(output_file) == 0:
-        raise RuntimeError("Empty audio file generated")
-    
-    print(f"Audio generated at {output_file}, size: {os.path.getsize(output_file)} bytes")
-    return output_file
+
+
+def speak_stream(text, voice_model: Optional[str] = None,
+                 stats: Optional[StreamStats] = None,
+                 max_chars: int = 200) -> Iterator[bytes]:
+    """Synthesize text sentence by sentence, yielding raw PCM as it is ready.
+
+    Each yielded chunk is 16-bit mono PCM for one sentence or clause; the
+    sample rate is available on ``stats.sample_rate`` before the first chunk
+    is yielded. Time spent by the consumer is not counted as synthesis time.
+
+    :param text: Text to speak
+    :param voice_model: Optional override for the Piper model path
+    :param stats: Optional StreamStats filled in while streaming
+    :param max_chars: Long sentences are split at clause punctuation above this
+    """
+    stats = stats if stats is not None else StreamStats()
+    model_path = voice_model or PIPER_VOICE
+
+    try:
+        voice = voice_engine.pool.get(model_path)
+        stats.sample_rate = voice_engine.sample_rate(voice)
+        synthesize = lambda segment: b"".join(voice_engine.synthesize_raw(voice, segment))
+    except Exception as e:
+        print(f"Piper engine unavailable ({e}), falling back to piper CLI...")
+        synthesize = lambda segment: _synthesize_cli_pcm(segment, model_path, stats)
+
+    for segment in text_utils.segment(text, max_chars):
+        t0 = time.perf_counter()
+        pcm = synthesize(segment)
+        stats.synthesis_time += time.perf_counter() - t0
+        if not pcm:
+            continue
+
+        stats.segments += 1
+        stats.audio_bytes += len(pcm)
+        if stats.time_to_first_chunk is None:
+            stats.time_to_first_chunk = time.perf_counter() - stats._start
+        yield pcm
+
+    rtf = stats.real_time_factor
+    if stats.time_to_first_chunk is not None and rtf is not None:
+        print(f"Streamed {stats.segments} segments, first audio after "
+              f"{stats.time_to_first_chunk:.2f}s, RTF {rtf:.2f}")
+
+
+def _synthesize_cli_pcm(text, model_path, stats):
+    """Run the ``piper`` CLI for one segment and return its PCM frames."""
+    fd, path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        _speak_cli(text, path, model_path)
+        with wave.open(path, "rb") as wav_file:
+            stats.sample_rate = wav_file.getframerate()
+            return wav_file.readframes(wav_file.getnframes())
+    finally:
+        os.remove(path)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+from config import TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES
+from backend.modules.text import normalize
+
+
+class SynthesisCache:
+    """Content-addressed on-disk cache of synthesized WAV files.
+
+    Entries are keyed by a hash of the normalized text, the voice model file
+    (path, size and mtime) and the synthesis parameters. Writes go through a
+    temporary file and ``os.replace`` so concurrent workers never see partial
+    entries. The file mtime doubles as the LRU timestamp: it is bumped on
+    every hit and the oldest entries are evicted once the byte budget is
+    exceeded.
+    """
+
+    def __init__(self, root: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str, model_path: str, params: Optional[dict] = None) -> str:
+        model_path = os.path.abspath(model_path)
+        try:
+            st = os.stat(model_path)
+            model_id = [model_path, st.st_size, st.st_mtime_ns]
+        except OSError:
+            model_id = [model_path, None, None]
+
+        payload = json.dumps(
+            {"text": normalize(text), "model": model_id, "params": params or {}},
+            sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.wav")
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            over_budget = self._size > self.max_bytes
+
+        if over_budget:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".wav"):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, target_bytes: Optional[int] = None):
+        """Remove least recently used entries until under ``target_bytes``.
+
+        Defaults to 90% of the budget so eviction is not triggered on every put.
+        """
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * 0.9)
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already evicted by another worker
+                pass
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._size = total
+            self.evictions += removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Shared per-process cache
+cache = SynthesisCache()
@@ -0,0 +1,194 @@
+"""
+Lightweight CPU lip sync: mouth openness from the audio envelope.
+
+Per-frame openness is computed from RMS energy (optionally weighted by the
+share of energy in the speech band) in a single vectorized NumPy pass. The
+mouth region of the still face is warped with OpenCV into a small set of
+pre-rendered openness levels, and each video frame is just one of those
+levels piped as raw BGR into ffmpeg.
+"""
+
+import os
+import subprocess
+import time
+
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from config import VISEME_FPS, VISEME_LEVELS
+from backend.modules import audio, encode, metrics
+
+# Colour of the inner mouth (BGR)
+MOUTH_COLOR = np.array([35, 25, 60], dtype=np.float32)
+SPEECH_BAND = (300.0, 3400.0)
+
+_face_levels = {}
+
+
+def mouth_openness(samples, sample_rate, fps=VISEME_FPS, band=SPEECH_BAND):
+    """Return one openness value in [0, 1] per video frame.
+
+    :param samples: Mono float samples
+    :param sample_rate: Sample rate of ``samples``
+    :param fps: Video frame rate
+    :param band: Optional (low, high) Hz range; energy outside it opens the
+                 mouth less, which keeps breaths and hiss from flapping it
+    """
+    hop = sample_rate / fps
+    win = max(1, int(round(hop)))
+    n_frames = max(1, int(np.ceil(len(samples) / hop)))
+    starts = (np.arange(n_frames) * hop).astype(np.int64)
+
+    padded = np.pad(samples, (0, win))
+    windows = sliding_window_view(padded, win)[starts]
+    energy = np.sqrt(np.mean(windows ** 2, axis=1))
+
+    if band is not None:
+        spectrum = np.abs(np.fft.rfft(windows * np.hanning(win), axis=1)) ** 2
+        freqs = np.fft.rfftfreq(win, 1.0 / sample_rate)
+        in_band = (freqs >= band[0]) & (freqs <= band[1])
+        ratio = spectrum[:, in_band].sum(axis=1) / (spectrum.sum(axis=1) + 1e-12)
+        energy = energy * (0.5 + 0.5 * ratio)
+
+    db = 20.0 * np.log10(energy + 1e-8)
+    floor = np.percentile(db, 10) + 6.0
+    peak = np.percentile(db, 95)
+    openness = np.clip((db - floor) / max(peak - floor, 1e-3), 0.0, 1.0)
+
+    # Light smoothing so the mouth does not jitter between frames
+    kernel = np.array([0.25, 0.5, 0.25])
+    return np.convolve(np.pad(openness, 1, mode='edge'), kernel, mode='valid')
+
+
+def detect_mouth(image):
+    """Return the mouth region (x1, y1, x2, y2) using OpenCV's Haar face detector.
+
+    Falls back to the lower-centre of the image if no face is found.
+    """
+    height, width = image.shape[:2]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    detector = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    faces = detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+
+    if len(faces):
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+    else:
+        print("No face detected, assuming a centred portrait")
+        x, y, w, h = width // 4, height // 5, width // 2, int(height * 0.6)
+
+    x1 = x + int(0.22 * w)
+    x2 = x + int(0.78 * w)
+    y1 = y + int(0.62 * h)
+    y2 = min(height, y + int(1.0 * h))
+    return x1, y1, x2, y2
+
+
+def render_levels(image, mouth_box, levels=VISEME_LEVELS):
+    """Pre-render ``levels`` full frames with the mouth increasingly open."""
+    x1, y1, x2, y2 = mouth_box
+    roi = image[y1:y2, x1:x2].astype(np.float32)
+    h, w = roi.shape[:2]
+
+    line = int(h * 0.4)
+    max_open = h * 0.35
+    ys, xs = np.mgrid[0:h, 0:w].astype(np.float32)
+    # Opening is widest at the centre of the mouth and fades towards the corners
+    across = np.clip(1.0 - ((xs - w / 2) / (w / 2)) ** 2, 0.0, 1.0)
+    below = np.clip((ys - line) / max(h - line, 1), 0.0, 1.0)
+    falloff = np.where(ys >= line, 1.0 - below, 0.0)
+
+    frames = []
+    for amount in np.linspace(0.0, 1.0, levels):
+        open_px = amount * max_open
+        map_y = ys - open_px * across * falloff
+        warped = cv2.remap(roi, xs, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+        if open_px >= 1.0:
+            mask = np.zeros((h, w), np.float32)
+            cv2.ellipse(mask, (w // 2, int(line + open_px / 2)),
+                        (int(w * 0.3), max(1, int(open_px / 2))), 0, 0, 360, 1.0, -1)
+            mask = cv2.GaussianBlur(mask, (0, 0), 1.5)[..., np.newaxis]
+            warped = warped * (1.0 - mask) + MOUTH_COLOR * mask
+
+        frame = image.copy()
+        frame[y1:y2, x1:x2] = np.clip(warped, 0, 255).astype(np.uint8)
+        frames.append(frame)
+    return frames
+
+
+def load_face(face_file, levels=VISEME_LEVELS, max_height=None):
+    """Decode the face, detect the mouth and pre-render levels, cached per file and size.
+
+    The face is scaled down to ``max_height`` once here, so the levels are
+    rendered at the output size.
+    """
+    key = (os.path.abspath(face_file), os.path.getmtime(face_file), levels, max_height)
+    cached = _face_levels.get(key)
+    if cached is None:
+        image = cv2.imread(face_file)
+        if image is None:
+            raise ValueError(f"Could not read face image: {face_file}")
+        height, width = image.shape[:2]
+        if max_height and height > max_height:
+            size = (int(round(width * max_height / height)), max_height)
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        # libx264 with yuv420p needs even dimensions
+        image = image[:image.shape[0] // 2 * 2, :image.shape[1] // 2 * 2]
+        frames = [f.tobytes() for f in render_levels(image, detect_mouth(image), levels)]
+        cached = (frames, image.shape[1], image.shape[0])
+        _face_levels.clear()
+        _face_levels[key] = cached
+    return cached
+
+
+def render(audio_input, face_file, output_path, fps=None, profile=None):
+    """Render a viseme lip-sync video to ``output_path``.
+
+    :param audio_input: WAV path or AudioBuffer
+    :param fps: Frame rate (default: the profile's, else VISEME_FPS)
+    :param profile: Encode profile name (default ENCODE_PROFILE)
+    """
+    profile = encode.get(profile)
+    fps = fps or profile.frame_rate(VISEME_FPS)
+    with metrics.stage("lipsync.viseme.face_prepare"):
+        frames, width, height = load_face(face_file, max_height=profile.max_height)
+    with metrics.stage("lipsync.viseme.features"):
+        buffer = audio.load(audio_input)
+        openness = mouth_openness(buffer.as_float32(), buffer.sample_rate, fps)
+    indices = np.rint(openness * (len(frames) - 1)).astype(np.int64)
+
+    audio_args, pass_fds, on_started, on_finished = audio.ffmpeg_side_input(audio_input)
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-nostats',
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+        '-i', '-'] + audio_args + profile.video_args() + profile.audio_args() + [
+        '-shortest', output_path
+    ]
+    with metrics.stage("lipsync.ffmpeg_mux"):
+        start = time.perf_counter()
+        _encode(cmd, pass_fds, on_started, on_finished, frames, indices)
+        encode.speeds.observe(profile.name, width * height * len(indices), time.perf_counter() - start)
+    return output_path
+
+
+def _encode(cmd, pass_fds, on_started, on_finished, frames, indices):
+    """Pipe the selected frames into ffmpeg."""
+    try:
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, pass_fds=pass_fds)
+        finally:
+            on_started()
+
+        try:
+            for index in indices:
+                proc.stdin.write(frames[index])
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = proc.stderr.read().decode(errors='replace')
+        if proc.wait() != 0:
+            raise RuntimeError(f"FFmpeg failed: {stderr}")
+    finally:
+        on_finished()
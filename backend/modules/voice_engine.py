@@ -0,0 +1,107 @@
+import io
+import os
+import threading
+import wave
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+from config import PIPER_VOICE, PIPER_VOICE_POOL_SIZE
+from backend.modules import metrics
+
+
+class VoicePool:
+    """Keep loaded Piper voices warm, keyed by model path.
+
+    Loading a voice means building an ONNX Runtime session, which is most of
+    the cost of a short utterance, so voices are kept around and reused.
+    The least recently used voice is dropped once ``max_voices`` is exceeded.
+    """
+
+    def __init__(self, max_voices: int = PIPER_VOICE_POOL_SIZE):
+        self.max_voices = max(1, max_voices)
+        self._voices = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, model_path: Optional[str] = None):
+        """Return a loaded voice for ``model_path``, loading it on first use."""
+        key = os.path.abspath(model_path or PIPER_VOICE)
+
+        with self._lock:
+            voice = self._voices.get(key)
+            if voice is not None:
+                self._voices.move_to_end(key)
+                return voice
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Load outside the pool lock so other voices stay usable meanwhile
+        with load_lock:
+            with self._lock:
+                voice = self._voices.get(key)
+                if voice is not None:
+                    self._voices.move_to_end(key)
+                    return voice
+
+            voice = _load_voice(key)
+
+            with self._lock:
+                self._voices[key] = voice
+                self._voices.move_to_end(key)
+                while len(self._voices) > self.max_voices:
+                    evicted, _ = self._voices.popitem(last=False)
+                    self._load_locks.pop(evicted, None)
+            return voice
+
+    def loaded(self):
+        """Model paths currently held in the pool, oldest first."""
+        with self._lock:
+            return list(self._voices)
+
+    def clear(self):
+        with self._lock:
+            self._voices.clear()
+            self._load_locks.clear()
+
+
+def _load_voice(model_path: str):
+    from piper import PiperVoice
+
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Piper model not found: {model_path}")
+
+    print(f"Loading Piper voice: {model_path}")
+    with metrics.stage("tts.model_load"):
+        return PiperVoice.load(model_path)
+
+
+def sample_rate(voice) -> int:
+    return int(voice.config.sample_rate)
+
+
+def synthesize_raw(voice, text: str) -> Iterator[bytes]:
+    """Yield 16-bit mono PCM chunks for ``text``.
+
+    Supports both the piper-tts 1.2 API (``synthesize_stream_raw``) and the
+    1.3+ API where ``synthesize`` yields audio chunks.
+    """
+    if hasattr(voice, "synthesize_stream_raw"):
+        yield from voice.synthesize_stream_raw(text)
+    else:
+        for chunk in voice.synthesize(text):
+            yield chunk.audio_int16_bytes
+
+
+def synthesize_wav(voice, text: str) -> bytes:
+    """Synthesize ``text`` into an in-memory WAV file and return its bytes."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate(voice))
+        for chunk in synthesize_raw(voice, text):
+            wav_file.writeframes(chunk)
+    return buffer.getvalue()
+
+
+# Shared per-process pool
+pool = VoicePool()
@@ -0,0 +1,205 @@
+"""
+ONNX Runtime inference for Wav2Lip on CPU-only hosts.
+
+The PyTorch checkpoint is exported once to ONNX (optionally with a dynamic
+int8 quantized copy) and the worker runs it through onnxruntime instead of
+PyTorch when WAV2LIP_BACKEND is "onnx":
+
+    python -m backend.modules.wav2lip_onnx export [--quantize]
+    python -m backend.modules.wav2lip_onnx check [--quantized]
+
+``check`` compares every output frame against PyTorch and measures the
+throughput of both. With ``--random-init`` it builds, exports and checks a
+randomly initialised network, so it runs without the real checkpoint.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from config import WAV2LIP_BATCH_SIZE, WAV2LIP_ONNX_QUANTIZED, WAV2LIP_ONNX_THREADS
+from backend.modules.wav2lip_worker import CHECKPOINT_PATH, IMG_SIZE, MEL_STEP_SIZE, load_model
+
+ONNX_PATH = os.path.splitext(CHECKPOINT_PATH)[0] + ".onnx"
+ONNX_INT8_PATH = os.path.splitext(CHECKPOINT_PATH)[0] + ".int8.onnx"
+OPSET = 13
+
+
+def model_path(quantized=WAV2LIP_ONNX_QUANTIZED):
+    return ONNX_INT8_PATH if quantized else ONNX_PATH
+
+
+def export(onnx_path=ONNX_PATH, checkpoint_path=CHECKPOINT_PATH, model=None):
+    """Export the PyTorch network to ONNX with a dynamic batch dimension."""
+    import torch
+
+    model = model if model is not None else load_model(checkpoint_path, 'cpu')
+    mel = torch.zeros(1, 1, 80, MEL_STEP_SIZE)
+    face = torch.zeros(1, 6, IMG_SIZE, IMG_SIZE)
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (mel, face), onnx_path, opset_version=OPSET,
+            input_names=["mel", "face"], output_names=["frames"],
+            dynamic_axes={"mel": {0: "batch"}, "face": {0: "batch"}, "frames": {0: "batch"}})
+    print(f"✅ Exported Wav2Lip to ONNX: {onnx_path}")
+    return onnx_path
+
+
+def quantize(onnx_path=ONNX_PATH, int8_path=ONNX_INT8_PATH):
+    """Write a dynamic int8 quantized copy of the ONNX model (weights in int8)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"✅ Quantized ONNX model (int8): {int8_path}")
+    return int8_path
+
+
+class OnnxWav2Lip:
+    """Wav2Lip through an onnxruntime CPU session.
+
+    :param onnx_path: Exported model (see :func:`export`)
+    :param threads: Intra-op threads, 0 lets onnxruntime pick one per core
+    """
+
+    def __init__(self, onnx_path=None, threads=WAV2LIP_ONNX_THREADS):
+        import onnxruntime as ort
+
+        onnx_path = onnx_path or model_path()
+        if not os.path.exists(onnx_path):
+            raise FileNotFoundError(f"ONNX model not found: {onnx_path} "
+                                    "(run python -m backend.modules.wav2lip_onnx export)")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def predict(self, face_batch, mel_batch):
+        """Same contract as ``Wav2LipEngine.predict``: (N, 96, 96, 3) frames in 0..255."""
+        import numpy as np
+
+        mel = np.ascontiguousarray(np.transpose(mel_batch, (0, 3, 1, 2)), dtype=np.float32)
+        if face_batch.ndim == 3:
+            single = face_batch.transpose(2, 0, 1)
+            face = np.broadcast_to(single, (len(mel),) + single.shape)
+        else:
+            face = np.transpose(face_batch, (0, 3, 1, 2))
+        face = np.ascontiguousarray(face, dtype=np.float32)
+        frames, = self.session.run(None, {"mel": mel, "face": face})
+        return frames.transpose(0, 2, 3, 1) * 255.
+
+
+def _torch_predict(model, face_batch, mel_batch):
+    import numpy as np
+    import torch
+
+    mel = torch.from_numpy(np.ascontiguousarray(np.transpose(mel_batch, (0, 3, 1, 2)), dtype=np.float32))
+    face = torch.from_numpy(np.ascontiguousarray(np.transpose(face_batch, (0, 3, 1, 2)), dtype=np.float32))
+    with torch.no_grad():
+        return model(mel, face).numpy().transpose(0, 2, 3, 1) * 255.
+
+
+def _throughput(predict, faces, mels, batch_size):
+    """Frames per second over all inputs, after one warm-up batch."""
+    predict(faces[:batch_size], mels[:batch_size])
+    start = time.perf_counter()
+    outputs = [predict(faces[i:i + batch_size], mels[i:i + batch_size])
+               for i in range(0, len(mels), batch_size)]
+    return len(mels) / (time.perf_counter() - start), outputs
+
+
+def compare(model, onnx_path, frames=64, batch_size=WAV2LIP_BATCH_SIZE, threads=WAV2LIP_ONNX_THREADS,
+            seed=0):
+    """Per-frame output difference and throughput of ONNX Runtime vs PyTorch.
+
+    Inputs are random but in the ranges the model sees (faces in [0, 1],
+    normalized mels in [-4, 4]). Differences are in 8-bit pixel levels.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    faces = rng.random((frames, IMG_SIZE, IMG_SIZE, 6), dtype=np.float32)
+    mels = rng.uniform(-4.0, 4.0, (frames, 80, MEL_STEP_SIZE, 1)).astype(np.float32)
+
+    runner = OnnxWav2Lip(onnx_path, threads)
+    torch_fps, torch_out = _throughput(lambda f, m: _torch_predict(model, f, m), faces, mels, batch_size)
+    onnx_fps, onnx_out = _throughput(runner.predict, faces, mels, batch_size)
+
+    diff = np.abs(np.concatenate(torch_out) - np.concatenate(onnx_out)).reshape(frames, -1)
+    per_frame_mean = diff.mean(axis=1)
+    return {
+        "model": onnx_path,
+        "frames": frames,
+        "batch_size": batch_size,
+        "threads": threads,
+        "mean_abs_diff": float(per_frame_mean.mean()),
+        "worst_frame_mean_abs_diff": float(per_frame_mean.max()),
+        "max_abs_diff": float(diff.max()),
+        "torch_fps": torch_fps,
+        "onnx_fps": onnx_fps,
+        "speedup": onnx_fps / torch_fps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and check the Wav2Lip ONNX model")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = sub.add_parser("export", help="Convert the checkpoint to ONNX")
+    export_cmd.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    export_cmd.add_argument('--output', default=ONNX_PATH)
+    export_cmd.add_argument('--quantize', action='store_true', help="Also write an int8 quantized model")
+
+    check_cmd = sub.add_parser("check", help="Compare ONNX Runtime against PyTorch")
+    check_cmd.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    check_cmd.add_argument('--quantized', action='store_true', help="Check the int8 model")
+    check_cmd.add_argument('--random-init', action='store_true',
+                           help="Export and check a randomly initialised network (no checkpoint needed)")
+    check_cmd.add_argument('--frames', type=int, default=64)
+    check_cmd.add_argument('--batch-size', type=int, default=WAV2LIP_BATCH_SIZE)
+    check_cmd.add_argument('--threads', type=int, default=WAV2LIP_ONNX_THREADS)
+    check_cmd.add_argument('--tolerance', type=float, default=None,
+                           help="Worst per-frame mean difference allowed, in pixel levels "
+                                "(default 1 for float, 8 for int8)")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export(args.output, args.checkpoint)
+        if args.quantize:
+            quantize(args.output, os.path.splitext(args.output)[0] + ".int8.onnx")
+        return
+
+    import torch
+
+    tolerance = args.tolerance if args.tolerance is not None else (8.0 if args.quantized else 1.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.random_init:
+            torch.manual_seed(0)
+            model = load_model(random_init=True)
+            onnx_path = export(os.path.join(tmp, "wav2lip.onnx"), model=model)
+            if args.quantized:
+                onnx_path = quantize(onnx_path, os.path.join(tmp, "wav2lip.int8.onnx"))
+        else:
+            model = load_model(args.checkpoint, 'cpu')
+            onnx_path = model_path(args.quantized)
+        result = compare(model, onnx_path, args.frames, args.batch_size, args.threads)
+
+    print(f"Model: {result['model']} ({result['frames']} frames, batch {result['batch_size']})")
+    print(f"  mean |diff|             {result['mean_abs_diff']:.4f}")
+    print(f"  worst frame mean |diff| {result['worst_frame_mean_abs_diff']:.4f}")
+    print(f"  max |diff|              {result['max_abs_diff']:.2f}")
+    print(f"  PyTorch      {result['torch_fps']:8.1f} frames/s")
+    print(f"  ONNX Runtime {result['onnx_fps']:8.1f} frames/s ({result['speedup']:.2f}x)")
+    if result["worst_frame_mean_abs_diff"] > tolerance:
+        print(f"❌ Output differs by more than {tolerance} pixel levels")
+        sys.exit(1)
+    print("✅ ONNX output matches PyTorch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,873 @@
+"""
+Long-lived Wav2Lip worker.
+
+The worker process loads the Wav2Lip checkpoint and the face detector once
+and then renders jobs received as JSON lines on stdin, answering with one
+JSON line per request on stdout:
+
+    {"id": 1, "cmd": "ping"}
+    {"id": 2, "cmd": "render", "audio": "...", "face": "...", "outfile": "..."}
+
+Instead of an ``audio`` path, a render request may carry the audio itself as
+base64 16-bit PCM in ``audio_pcm`` plus its ``sample_rate``. A ``segments``
+request takes ``output_dir`` (plus optional ``segment_seconds`` and
+``segment_type``) instead of ``outfile`` and writes an HLS playlist there.
+A render request may name an encode ``profile`` (see ``encode``).
+``{"cmd": "cancel", "target": <id>}`` aborts a queued or running job.
+``face`` is an image path or the ID of a registered avatar (see ``avatars``).
+
+Up to WAV2LIP_WORKER_JOBS requests are rendered at once. Their frames share
+the one loaded model through a ``batching.BatchScheduler``, and each reply
+reports how full the batches were and how long the frames queued.
+
+Run it with ``python -m backend.modules.wav2lip_worker`` from the project
+root; :class:`Wav2LipWorker` manages that process from the parent side.
+"""
+
+import argparse
+import atexit
+import base64
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backend.modules import metrics
+from config import (
+    WAV2LIP_BACKEND,
+    WAV2LIP_BATCH_SIZE,
+    WAV2LIP_BATCH_WAIT_MS,
+    WAV2LIP_FPS,
+    WAV2LIP_ONNX_THREADS,
+    WAV2LIP_RANDOM_INIT,
+    WAV2LIP_WORKER_JOBS,
+    WAV2LIP_WORKER_PING_TIMEOUT,
+    WAV2LIP_WORKER_START_TIMEOUT,
+    WAV2LIP_WORKER_JOB_TIMEOUT,
+)
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+WAV2LIP_PATH = os.path.join(PROJECT_ROOT, 'backend', 'extras', 'Wav2Lip')
+CHECKPOINT_PATH = os.path.join(WAV2LIP_PATH, 'checkpoints', 'wav2lip_gan.pth')
+
+IMG_SIZE = 96
+MEL_STEP_SIZE = 16
+MEL_SAMPLE_RATE = 16000
+# Extra pixels below the detected face box so the chin is included (Wav2Lip --pads)
+FACE_PADS = (0, 10, 0, 0)
+# A worker that replied this recently counts as healthy without a ping
+HEALTHY_WITHIN = 1.0
+# Scaled video avatars kept by the worker (see Wav2LipEngine.sized_avatar)
+SIZED_AVATARS = 4
+# Batches a render has submitted at once: it pastes the oldest while the rest run
+PIPELINE_DEPTH = 2
+
+
+def load_model(checkpoint_path=CHECKPOINT_PATH, device='cpu', random_init=False):
+    """Build the Wav2Lip network in eval mode, with checkpoint weights unless ``random_init``."""
+    if WAV2LIP_PATH not in sys.path:
+        sys.path.append(WAV2LIP_PATH)
+
+    import torch
+    from models import Wav2Lip
+
+    model = Wav2Lip()
+    if not random_init:
+        checkpoint = torch.load(checkpoint_path, map_location=device)
+        state = {k.replace('module.', ''): v for k, v in checkpoint["state_dict"].items()}
+        model.load_state_dict(state)
+    return model.to(device).eval()
+
+
+def face_detector(device='cpu'):
+    """Return a callable mapping a BGR image to its padded face box (y1, y2, x1, x2)."""
+    if WAV2LIP_PATH not in sys.path:
+        sys.path.append(WAV2LIP_PATH)
+
+    import numpy as np
+    import face_detection
+
+    detector = face_detection.FaceAlignment(face_detection.LandmarksType._2D, flip_input=False,
+                                            device=device)
+
+    def detect(image):
+        rect = detector.get_detections_for_batch(np.array([image]))[0]
+        if rect is None:
+            raise ValueError("Face not detected! Ensure the image contains a face.")
+
+        pady1, pady2, padx1, padx2 = FACE_PADS
+        y1 = max(0, rect[1] - pady1)
+        y2 = min(image.shape[0], rect[3] + pady2)
+        x1 = max(0, rect[0] - padx1)
+        x2 = min(image.shape[1], rect[2] + padx2)
+        return int(y1), int(y2), int(x1), int(x2)
+
+    return detect
+
+
+class Wav2LipEngine:
+    """Wav2Lip model plus face detector, loaded once and reused per job.
+
+    With ``backend="onnx"`` the network runs through onnxruntime (see
+    ``wav2lip_onnx``); face detection still uses PyTorch. With a
+    ``batch_wait`` (seconds), renders on several threads share the network
+    through a ``batching.BatchScheduler`` instead of calling it themselves.
+    """
+
+    def __init__(self, checkpoint_path=CHECKPOINT_PATH, device=None,
+                 batch_size=WAV2LIP_BATCH_SIZE, fps=WAV2LIP_FPS, random_init=False,
+                 backend="torch", onnx_path=None, threads=WAV2LIP_ONNX_THREADS, batch_wait=None):
+        import torch
+
+        self.torch = torch
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.batch_size = batch_size
+        self.fps = fps
+        self.backend = backend
+        self._detector = None
+        self._detector_lock = threading.Lock()
+        self._faces = {}
+        self._sized = {}
+        self._sized_lock = threading.Lock()
+        # Per render thread: wall time of each step and batching figures of its
+        # last render, reported to the parent
+        self._local = threading.local()
+
+        if backend == "onnx":
+            from backend.modules.wav2lip_onnx import OnnxWav2Lip
+            self.model = None
+            self.onnx = OnnxWav2Lip(onnx_path, threads)
+        else:
+            self.model = load_model(checkpoint_path, self.device, random_init)
+            self.onnx = None
+
+        self.scheduler = None
+        if batch_wait is not None:
+            from backend.modules.batching import BatchScheduler
+            self.scheduler = BatchScheduler(self.predict, batch_size, batch_wait)
+
+    @property
+    def last_timings(self):
+        return getattr(self._local, "timings", {})
+
+    @last_timings.setter
+    def last_timings(self, timings):
+        self._local.timings = timings
+
+    @property
+    def last_batching(self):
+        """``batching.BatchStats`` of this thread's last render (None without a scheduler)."""
+        return getattr(self._local, "batching", None)
+
+    def _detect(self, image):
+        """Return the padded face box (y1, y2, x1, x2) in ``image``."""
+        with self._detector_lock:
+            if self._detector is None:
+                self._detector = face_detector(self.device)
+            return self._detector(image)
+
+    def load_face(self, face_file):
+        """Decode a still face image and fetch its preprocessed face asset.
+
+        The decoded image is kept per path and mtime; detection results come
+        from the persistent face cache, keyed by the image content hash.
+        """
+        import cv2
+        from backend.modules import face_cache
+
+        key = (os.path.abspath(face_file), os.path.getmtime(face_file))
+        face = self._faces.get(key)
+        if face is None:
+            image = cv2.imread(face_file)
+            if image is None:
+                raise ValueError(f"Could not read face image: {face_file}")
+            face = (image, face_cache.cache.get(face_file, image, self._detect))
+            self._faces = {key: face}
+        return face
+
+    def load_avatar(self, face):
+        """Return the ``avatars.Avatar`` for a registered avatar ID or an image path.
+
+        Registered avatars are memory-mapped, so their frames and face
+        inputs are shared with other workers; an image path becomes a
+        single-frame avatar through :meth:`load_face`.
+        """
+        from backend.modules import avatars
+
+        if avatars.is_registered(face):
+            avatar = avatars.load(face)
+            if avatar.has_faces:
+                return avatar
+            # Registered without detection: detect on its still image instead
+            face = avatar.still
+        image, asset = self.load_face(face)
+        return avatars.Avatar.from_still(image, asset, face)
+
+    def sized_avatar(self, avatar, max_height):
+        """``avatar`` scaled to ``max_height``.
+
+        Registered avatars map the copy stored for a profile height. Other
+        scaled video avatars are kept per (avatar, height), the last
+        SIZED_AVATARS of them, so concurrent renders at different sizes do
+        not evict each other's copy.
+        """
+        if avatar.n_frames == 1:
+            return avatar.resized(max_height)
+        key = (id(avatar), max_height)
+        with self._sized_lock:
+            entry = self._sized.pop(key, None)
+            if entry is None:
+                # The source avatar is kept in the entry so its id() is not reused
+                entry = (avatar, avatar.resized(max_height))
+            self._sized[key] = entry
+            while len(self._sized) > SIZED_AVATARS:
+                self._sized.pop(next(iter(self._sized)))
+            return entry[1]
+
+    @staticmethod
+    def paste(avatar, index, pred, frame):
+        """Draw the predicted face of render frame ``index`` into ``frame``.
+
+        ``frame`` is reused between frames: for a still avatar only the face
+        region changes, a video avatar's frame is copied in first.
+        """
+        import cv2
+        import numpy as np
+
+        if avatar.n_frames > 1:
+            frame[:] = avatar.frame(index)
+        y1, y2, x1, x2 = avatar.box(index)
+        frame[y1:y2, x1:x2] = cv2.resize(pred.astype(np.uint8), (x2 - x1, y2 - y1))
+
+    @staticmethod
+    def load_wav(audio_input):
+        """Return the audio as float samples at the mel sample rate."""
+        import wave
+        from backend.modules import audio as audio_io
+
+        if not isinstance(audio_input, audio_io.AudioBuffer):
+            try:
+                audio_input = audio_io.AudioBuffer.from_file(audio_input)
+            except (ValueError, EOFError, wave.Error):
+                # Not 16-bit PCM WAV: decode it the way Wav2Lip does
+                import audio
+                return audio.load_wav(audio_input, MEL_SAMPLE_RATE)
+        return audio_input.resample(MEL_SAMPLE_RATE).as_float32()
+
+    def audio_features(self, audio_input, fps=None):
+        """Per-frame mel windows of ``audio_input`` (see ``mel.MelFeatures``), cached by content."""
+        from backend.modules import mel
+
+        return mel.features(self.load_wav(audio_input), fps or self.fps, MEL_SAMPLE_RATE)
+
+    def predict(self, face_batch, mel_batch):
+        """Run the model on (N, 96, 96, 6) faces and (N, 80, 16, 1) mels.
+
+        ``face_batch`` may also be a single (96, 96, 6) face, which is then
+        broadcast across the batch without being copied N times.
+        """
+        import numpy as np
+
+        if self.onnx is not None:
+            return self.onnx.predict(face_batch, mel_batch)
+
+        torch = self.torch
+        mel = torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(self.device)
+        if face_batch.ndim == 3:
+            img = torch.from_numpy(np.ascontiguousarray(face_batch.transpose(2, 0, 1), dtype=np.float32))
+            img = img.to(self.device).unsqueeze(0).expand(len(mel), -1, -1, -1)
+        else:
+            img = torch.FloatTensor(np.transpose(face_batch, (0, 3, 1, 2))).to(self.device)
+        with torch.no_grad():
+            pred = self.model(mel, img)
+        return pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
+
+    def _start_job(self):
+        """Reset this thread's timings and batching figures; returns the timings."""
+        from backend.modules.batching import BatchStats
+
+        self._local.batching = BatchStats() if self.scheduler is not None else None
+        self.last_timings = {"inference": 0.0}
+        return self.last_timings
+
+    def _submit(self, face_batch, mel_batch):
+        """Future with the predictions of one batch, from the scheduler if there is one."""
+        if self.scheduler is not None:
+            return self.scheduler.submit(face_batch, mel_batch, self.last_batching)
+        t0 = time.perf_counter()
+        future = Future()
+        future.set_result(self.predict(face_batch, mel_batch))
+        self.last_timings["inference"] += time.perf_counter() - t0
+        return future
+
+    def predictions(self, avatar, features, start, end, should_stop=None):
+        """Yield (frame index, predicted face) for frames ``start`` to ``end``, in order.
+
+        Up to PIPELINE_DEPTH batches are submitted at once, so pasting and
+        encoding one overlaps with inference of the next. ``should_stop`` is
+        polled before each batch (see :meth:`render`); the time spent waiting
+        for predictions is added to ``last_timings["inference"]``.
+        """
+        from backend.modules.segments import check_cancel
+
+        timings = self.last_timings
+        pending = deque()
+
+        def collect():
+            batch_start, future = pending.popleft()
+            t0 = time.perf_counter()
+            preds = future.result()
+            timings["inference"] += time.perf_counter() - t0
+            return enumerate(preds, batch_start)
+
+        try:
+            for batch_start in range(start, end, self.batch_size):
+                check_cancel(should_stop)
+                mel_batch = features.batch(batch_start, min(end, batch_start + self.batch_size))
+                face_batch = avatar.face_batch(batch_start, batch_start + len(mel_batch))
+                pending.append((batch_start, self._submit(face_batch, mel_batch)))
+                if len(pending) >= PIPELINE_DEPTH:
+                    yield from collect()
+            while pending:
+                check_cancel(should_stop)
+                yield from collect()
+        finally:
+            # Cancelled or failed: drop the batches that were not run yet
+            for _, future in pending:
+                future.cancel()
+
+    def render(self, audio_input, face_file, outfile, should_stop=None, profile=None):
+        """Render ``audio_input`` (WAV path or AudioBuffer) onto the face.
+
+        ``face_file`` is an image path or a registered avatar ID; video
+        avatars loop their frames under the audio. ``should_stop`` is polled
+        before each batch; when it returns True the render is abandoned with
+        RenderCancelled.
+
+        ``profile`` names the encode profile (see ``encode``). The avatar is
+        scaled to its size once, before any face is pasted, and a still face
+        is rendered at its frame rate, so a preview also runs fewer frames
+        through the network. Video avatars keep the worker's frame rate so
+        their motion is not slowed down.
+        """
+        import cv2
+        from backend.modules import artifacts, audio as audio_io, encode
+
+        profile = encode.get(profile)
+        timings = self._start_job()
+        step = time.perf_counter()
+        avatar = self.sized_avatar(self.load_avatar(face_file), profile.max_height)
+        fps = profile.frame_rate(self.fps) if avatar.n_frames == 1 else self.fps
+        timings["face_detection"], step = time.perf_counter() - step, time.perf_counter()
+        features = self.audio_features(audio_input, fps)
+        timings["audio_features"], step = time.perf_counter() - step, time.perf_counter()
+
+        # Intermediate video track, on tmpfs with ARTIFACT_SCRATCH=tmpfs
+        tmp_video = artifacts.scratch_file('.avi')
+        try:
+            out = cv2.VideoWriter(tmp_video, cv2.VideoWriter_fourcc(*'DIVX'), fps,
+                                  (avatar.width, avatar.height))
+            frame = avatar.frame(0).copy()
+            for index, pred in self.predictions(avatar, features, 0, len(features), should_stop):
+                self.paste(avatar, index, pred, frame)
+                out.write(frame)
+            out.release()
+            timings["frame_writing"] = time.perf_counter() - step - timings["inference"]
+            step = time.perf_counter()
+
+            audio_args, stdin = audio_io.ffmpeg_input(audio_input)
+            cmd = ['ffmpeg', '-y'] + audio_args + ['-i', tmp_video] + \
+                profile.video_args() + profile.audio_args() + ['-shortest', outfile]
+            subprocess.run(cmd, input=stdin, capture_output=True, check=True)
+            timings["ffmpeg_mux"] = time.perf_counter() - step
+            encode.speeds.observe(profile.name, avatar.width * avatar.height * len(features),
+                                  timings["ffmpeg_mux"])
+            encode.speeds.observe(f"inference.{self.backend}", len(features), timings["inference"])
+        finally:
+            if os.path.exists(tmp_video):
+                os.remove(tmp_video)
+        if self.last_batching is not None:
+            timings["queue_delay"] = self.last_batching.queue_delay
+        return outfile
+
+    def render_segments(self, audio_input, face_file, output_dir, segment_seconds=None,
+                        segment_type=None, should_stop=None, profile=None):
+        """Render ``audio_input`` as HLS segments in ``output_dir``, window by window.
+
+        The mel windows of each segment are views of the whole-utterance
+        features, so lips stay continuous across segment boundaries. Each
+        window is encoded as soon as it is predicted, so the first segment
+        is playable long before the last one is rendered. ``face_file``,
+        ``should_stop`` and ``profile`` work as in :meth:`render`.
+        """
+        from backend.modules import encode, segments
+
+        profile = encode.get(profile)
+        options = {}
+        if segment_seconds:
+            options["segment_seconds"] = segment_seconds
+        if segment_type:
+            options["segment_type"] = segment_type
+
+        timings = self._start_job()
+        step = time.perf_counter()
+        avatar = self.sized_avatar(self.load_avatar(face_file), profile.max_height)
+        fps = profile.frame_rate(self.fps) if avatar.n_frames == 1 else self.fps
+        timings["face_detection"], step = time.perf_counter() - step, time.perf_counter()
+        features = self.audio_features(audio_input, fps)
+        timings["audio_features"] = time.perf_counter() - step
+
+        frame = avatar.frame(0).copy()
+        step = time.perf_counter()
+        with segments.SegmentWriter(output_dir, audio_input, avatar.width, avatar.height, fps,
+                                    profile=profile, **options) as writer:
+            for start, end in segments.plan_windows(len(features), fps, writer.segment_seconds):
+                for index, pred in self.predictions(avatar, features, start, end, should_stop):
+                    self.paste(avatar, index, pred, frame)
+                    writer.write(frame)
+                writer.flush()
+        timings["encoding"] = time.perf_counter() - step - timings["inference"]
+        encode.speeds.observe(f"inference.{self.backend}", len(features), timings["inference"])
+        if writer.first_segment_seconds is not None:
+            timings["first_segment"] = writer.first_segment_seconds
+        if self.last_batching is not None:
+            timings["queue_delay"] = self.last_batching.queue_delay
+        return writer.playlist
+
+
+def face_reference(face_file):
+    """Avatar IDs go to the worker as they are, image paths as absolute paths."""
+    from backend.modules import avatars
+
+    return face_file if avatars.is_registered(face_file) else os.path.abspath(face_file)
+
+
+def request_audio(request):
+    """Return the audio of a render request as a path or an AudioBuffer."""
+    from backend.modules import audio as audio_io
+
+    if "audio_pcm" in request:
+        pcm = base64.b64decode(request["audio_pcm"])
+        return audio_io.AudioBuffer.from_pcm(pcm, request["sample_rate"])
+    return request["audio"]
+
+
+def serve(engine, stdin, stdout, jobs=1):
+    """Answer JSON-line requests from ``stdin`` until it is closed.
+
+    Requests are read on their own thread so that ``{"cmd": "cancel",
+    "target": <id>}`` reaches a render that is already running; the render
+    stops before its next batch and answers with ``"cancelled": true``.
+    Up to ``jobs`` renders run at once, on a thread pool; replies may
+    therefore come back in a different order than the requests.
+    ``{"cmd": "stats"}`` answers with the batch scheduler totals.
+    """
+    from backend.modules.segments import RenderCancelled
+
+    write_lock = threading.Lock()
+    requests = queue.Queue()
+    cancelled = set()
+
+    def reply(message):
+        with write_lock:
+            stdout.write(json.dumps(message) + "\n")
+            stdout.flush()
+
+    def read_requests():
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                reply({"id": None, "ok": False, "error": "invalid JSON"})
+                continue
+            if request.get("cmd") == "cancel":
+                cancelled.add(request.get("target"))
+            else:
+                requests.put(request)
+        requests.put(None)
+
+    def run_render(request):
+        req_id = request.get("id")
+        started = time.perf_counter()
+        should_stop = lambda: req_id in cancelled
+        try:
+            if request["cmd"] == "render":
+                result = {"outfile": engine.render(
+                    request_audio(request), request["face"], request["outfile"], should_stop,
+                    request.get("profile"))}
+            else:
+                result = {"playlist": engine.render_segments(
+                    request_audio(request), request["face"], request["output_dir"],
+                    request.get("segment_seconds"), request.get("segment_type"), should_stop,
+                    request.get("profile"))}
+            if engine.last_batching is not None:
+                result["batching"] = engine.last_batching.as_dict()
+            reply(dict(result, id=req_id, ok=True, seconds=round(time.perf_counter() - started, 3),
+                       timings=engine.last_timings))
+        except RenderCancelled:
+            reply({"id": req_id, "ok": False, "cancelled": True, "error": "render cancelled"})
+        except Exception as e:
+            reply({"id": req_id, "ok": False, "error": f"{type(e).__name__}: {e}"})
+        finally:
+            cancelled.discard(req_id)
+
+    reply({"id": 0, "ok": True, "ready": True, "pid": os.getpid()})
+    threading.Thread(target=read_requests, name="wav2lip-requests", daemon=True).start()
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="render") as pool:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+
+            req_id = request.get("id")
+            cmd = request.get("cmd")
+            if cmd == "ping":
+                reply({"id": req_id, "ok": True})
+            elif cmd in ("render", "segments"):
+                pool.submit(run_render, request)
+            elif cmd == "stats":
+                stats = engine.scheduler.stats() if engine.scheduler is not None else None
+                reply({"id": req_id, "ok": True, "batching": stats})
+            elif cmd == "shutdown":
+                # Let the running renders answer first
+                pool.shutdown(wait=True)
+                reply({"id": req_id, "ok": True})
+                break
+            else:
+                reply({"id": req_id, "ok": False, "error": f"unknown command: {cmd}"})
+
+
+class _Replies:
+    """Reply queues of the requests in flight to one worker process."""
+
+    def __init__(self):
+        self._queues = {}
+        self._closed = False
+        self._lock = threading.Lock()
+        # time.monotonic() of the last line from the worker
+        self.last_message = time.monotonic()
+
+    def expect(self, req_id):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Wav2Lip worker exited unexpectedly")
+            replies = self._queues[req_id] = queue.Queue()
+            return replies
+
+    def forget(self, req_id):
+        with self._lock:
+            self._queues.pop(req_id, None)
+
+    def deliver(self, message):
+        self.last_message = time.monotonic()
+        with self._lock:
+            replies = self._queues.get(message.get("id"))
+        if replies is not None:
+            replies.put(message)
+
+    def close(self):
+        """The worker exited: wake every waiting request."""
+        with self._lock:
+            self._closed = True
+            for replies in self._queues.values():
+                replies.put(None)
+
+
+class Wav2LipWorker:
+    """Parent-side handle on a Wav2Lip worker process.
+
+    The process is started on first use, health-checked before each job and
+    restarted if it has died. Several threads may render through one handle
+    at once: the worker runs their jobs together and each reply goes to the
+    thread waiting for its request ID.
+    """
+
+    def __init__(self, checkpoint_path=CHECKPOINT_PATH, extra_args=None):
+        self.checkpoint_path = checkpoint_path
+        self.extra_args = list(extra_args or [])
+        self.restarts = 0
+        self._proc = None
+        self._replies = None
+        self._ids = itertools.count(1)
+        # Held while (re)starting the process; stdin writes take _send_lock
+        self._lock = threading.RLock()
+        self._send_lock = threading.Lock()
+
+    def _spawn(self):
+        cmd = [sys.executable, '-m', 'backend.modules.wav2lip_worker',
+               '--checkpoint', self.checkpoint_path] + self.extra_args
+        proc = subprocess.Popen(
+            cmd, cwd=PROJECT_ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            text=True, bufsize=1)
+        replies = _Replies()
+        responses = replies.expect(0)
+        self._proc, self._replies = proc, replies
+        threading.Thread(target=self._read_responses, args=(proc, replies), daemon=True).start()
+
+        try:
+            ready = self._wait_for(proc, responses, 0, WAV2LIP_WORKER_START_TIMEOUT)
+        except TimeoutError:
+            # Nothing else uses a process that never became ready
+            self._stop(proc)
+            raise
+        finally:
+            replies.forget(0)
+        if not ready.get("ok"):
+            raise RuntimeError(f"Wav2Lip worker failed to start: {ready.get('error')}")
+        print(f"Wav2Lip worker ready (pid {ready.get('pid')})")
+
+    @staticmethod
+    def _read_responses(proc, replies):
+        for line in proc.stdout:
+            try:
+                replies.deliver(json.loads(line))
+            except ValueError:
+                continue
+        # EOF: the worker exited
+        replies.close()
+
+    def _wait_for(self, proc, responses, req_id, timeout, cancel=None):
+        """Wait for the reply to ``req_id``.
+
+        On timeout only this request is given up: the worker is told to
+        cancel it and keeps serving the others. A hung worker is found by
+        the health check of the next job (see :meth:`ensure_running`).
+        """
+        deadline = time.monotonic() + timeout
+        cancel_sent = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if req_id:
+                    try:
+                        self._send(proc, {"cmd": "cancel", "target": req_id})
+                    except OSError:
+                        pass
+                raise TimeoutError("Wav2Lip worker did not answer in time")
+            try:
+                # With a cancel event, wake up regularly to forward it
+                message = responses.get(timeout=min(remaining, 0.1) if cancel else remaining)
+            except queue.Empty:
+                if cancel is not None and cancel.is_set() and not cancel_sent:
+                    self._send(proc, {"cmd": "cancel", "target": req_id})
+                    cancel_sent = True
+                continue
+            if message is None:
+                raise RuntimeError("Wav2Lip worker exited unexpectedly")
+            return message
+
+    def _send(self, proc, payload):
+        with self._send_lock:
+            try:
+                proc.stdin.write(json.dumps(payload) + "\n")
+                proc.stdin.flush()
+            except ValueError:
+                # stdin was closed by stop() on another thread
+                raise BrokenPipeError("Wav2Lip worker is stopping")
+
+    def _request(self, payload, timeout, cancel=None):
+        """Send ``payload`` to the running process and wait for its reply."""
+        with self._lock:
+            proc, replies = self._proc, self._replies
+        req_id = next(self._ids)
+        responses = replies.expect(req_id)
+        try:
+            self._send(proc, dict(payload, id=req_id))
+            return self._wait_for(proc, responses, req_id, timeout, cancel)
+        finally:
+            replies.forget(req_id)
+
+    def is_alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def ensure_running(self):
+        """Start the worker, or restart it if it exited or fails the health check.
+
+        A worker that replied within HEALTHY_WITHIN seconds is trusted;
+        otherwise it must answer a ping within WAV2LIP_WORKER_PING_TIMEOUT.
+        Only a worker that does not is stopped, since the other jobs it is
+        running are lost with it anyway.
+        """
+        with self._lock:
+            if self.is_alive():
+                if time.monotonic() - self._replies.last_message < HEALTHY_WITHIN \
+                        or self.ping(WAV2LIP_WORKER_PING_TIMEOUT):
+                    return
+                if self.is_alive():
+                    print("Wav2Lip worker did not answer the health check, restarting it")
+                    self._stop(self._proc)
+            if self._proc is not None:
+                self.restarts += 1
+                print(f"Restarting Wav2Lip worker (exit code {self._proc.returncode})")
+            self._spawn()
+
+    def ping(self, timeout=5.0):
+        """Return True if the worker answers a health check in time."""
+        if not self.is_alive():
+            return False
+        try:
+            return self._request({"cmd": "ping"}, timeout).get("ok", False)
+        except (OSError, RuntimeError, TimeoutError):
+            return False
+
+    def stats(self, timeout=5.0):
+        """Batch scheduler totals of the running worker (see ``batching.BatchScheduler.stats``)."""
+        if not self.is_alive():
+            return None
+        return self._request({"cmd": "stats"}, timeout).get("batching")
+
+    def render(self, audio_file, face_file, outfile, timeout=WAV2LIP_WORKER_JOB_TIMEOUT, cancel=None,
+               profile=None):
+        """Render a video in the worker, restarting it once if it crashed.
+
+        In-memory audio is sent inline at its own rate; the worker resamples
+        it to 16 kHz for the mel features and muxes the original. Setting the
+        ``cancel`` event aborts the job in the worker (RenderCancelled).
+        ``profile`` is an encode profile name (default ENCODE_PROFILE).
+        """
+        payload = {
+            "cmd": "render",
+            "face": face_reference(face_file),
+            "outfile": os.path.abspath(outfile),
+            "profile": profile,
+        }
+        return self._run(payload, audio_file, timeout, cancel)["outfile"]
+
+    def render_segments(self, audio_file, face_file, output_dir, segment_seconds=None,
+                        segment_type=None, timeout=WAV2LIP_WORKER_JOB_TIMEOUT, cancel=None,
+                        profile=None):
+        """Render HLS segments into ``output_dir``; returns the playlist path.
+
+        The call returns once the last segment is written, but the playlist
+        is usable from the first one on. ``profile`` is an encode profile
+        name (default ENCODE_PROFILE).
+        """
+        payload = {
+            "cmd": "segments",
+            "face": face_reference(face_file),
+            "output_dir": os.path.abspath(output_dir),
+            "segment_seconds": segment_seconds,
+            "segment_type": segment_type,
+            "profile": profile,
+        }
+        return self._run(payload, audio_file, timeout, cancel)["playlist"]
+
+    def _run(self, payload, audio_file, timeout, cancel=None):
+        from backend.modules import audio as audio_io
+        from backend.modules.segments import RenderCancelled
+
+        if isinstance(audio_file, audio_io.AudioBuffer):
+            payload["audio_pcm"] = base64.b64encode(audio_file.pcm_bytes()).decode('ascii')
+            payload["sample_rate"] = audio_file.sample_rate
+        else:
+            payload["audio"] = os.path.abspath(audio_file)
+        for attempt in range(2):
+            self.ensure_running()
+            try:
+                response = self._request(payload, timeout, cancel)
+                break
+            except TimeoutError:
+                raise
+            except (OSError, RuntimeError) as e:
+                if attempt:
+                    raise
+                print(f"Wav2Lip worker crashed ({e}), retrying...")
+
+        if response.get("cancelled"):
+            raise RenderCancelled(response["error"])
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "unknown worker error"))
+        for step, seconds in response.get("timings", {}).items():
+            metrics.observe(f"lipsync.wav2lip.{step}", seconds)
+        fill = (response.get("batching") or {}).get("batch_fill")
+        if fill is not None:
+            metrics.observe_value("lipsync.wav2lip.batch_fill", fill)
+        return response
+
+    def stop(self):
+        """Stop the worker; the handle is kept so a later start counts as a restart."""
+        self._stop(self._proc)
+
+    @staticmethod
+    def _stop(proc):
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+            proc.wait()
+
+
+_workers = {}
+_worker_lock = threading.Lock()
+
+
+def get_worker(backend=None):
+    """Return the shared per-process worker handle for ``backend`` ("torch" or "onnx")."""
+    backend = backend or WAV2LIP_BACKEND
+    with _worker_lock:
+        worker = _workers.get(backend)
+        if worker is None:
+            extra_args = ['--backend', backend] + (['--random-init'] if WAV2LIP_RANDOM_INIT else [])
+            worker = Wav2LipWorker(extra_args=extra_args)
+            atexit.register(worker.stop)
+            _workers[backend] = worker
+        return worker
+
+
+def stop_workers():
+    """Stop every worker started through :func:`get_worker`."""
+    with _worker_lock:
+        workers = list(_workers.values())
+    for worker in workers:
+        worker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent Wav2Lip inference worker")
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--batch-size', type=int, default=WAV2LIP_BATCH_SIZE)
+    parser.add_argument('--fps', type=float, default=WAV2LIP_FPS)
+    parser.add_argument('--random-init', action='store_true',
+                        help="Skip loading the checkpoint (for tests and benchmarks)")
+    parser.add_argument('--backend', choices=("torch", "onnx"), default=WAV2LIP_BACKEND)
+    parser.add_argument('--onnx', default=None, help="ONNX model (default: exported checkpoint)")
+    parser.add_argument('--threads', type=int, default=WAV2LIP_ONNX_THREADS,
+                        help="onnxruntime intra-op threads (0 = automatic)")
+    parser.add_argument('--jobs', type=int, default=WAV2LIP_WORKER_JOBS,
+                        help="Renders run at once, sharing the model's batches")
+    parser.add_argument('--batch-wait-ms', type=float, default=WAV2LIP_BATCH_WAIT_MS,
+                        help="Longest wait for a batch to fill with frames of other renders")
+    args = parser.parse_args()
+
+    # stdout carries the protocol; route prints from Wav2Lip/torch to stderr
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    try:
+        engine = Wav2LipEngine(args.checkpoint, args.device, args.batch_size,
+                               args.fps, args.random_init, args.backend, args.onnx, args.threads,
+                               batch_wait=args.batch_wait_ms / 1000.0)
+    except Exception as e:
+        protocol_out.write(json.dumps({"id": 0, "ok": False, "error": f"{type(e).__name__}: {e}"}) + "\n")
+        protocol_out.flush()
+        sys.exit(1)
+
+    serve(engine, sys.stdin, protocol_out, args.jobs)
+
+
+if __name__ == "__main__":
+    main()
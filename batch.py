@@ -0,0 +1,237 @@
+"""
+Batch rendering: turn a JSONL or CSV file of utterances into videos.
+
+Each record has ``id`` and ``text`` and optionally ``voice`` ("male",
+"female" or a Piper model path), ``face`` (image path or registered avatar ID), ``engine``
+and ``profile`` (encode profile).
+TTS and lipsync run as separate stages with their own worker pools and a
+bounded queue in between; records whose video already exists are skipped,
+so an interrupted run can simply be started again. Audio and video are
+written under temporary names and moved into place only once complete, so
+an interrupted run never leaves a truncated file that would be skipped. Wav2Lip renders run on
+threads that share one Wav2Lip worker, which batches their frames together;
+the other engines render in separate processes.
+
+    python batch.py utterances.jsonl --tts-workers 2 --render-workers 4
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import (
+    AVATAR_FACE,
+    LIPSYNC_ENGINE,
+    OUTPUT_DIR,
+    PIPER_VOICE,
+    PIPER_VOICE_FEMALE,
+    PIPER_VOICE_MALE,
+)
+
+VOICES = {"male": PIPER_VOICE_MALE, "female": PIPER_VOICE_FEMALE}
+
+_DONE = object()
+
+
+def load_records(path):
+    """Read utterance records from a .jsonl or .csv file."""
+    records = []
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for number, row in enumerate(rows, 1):
+            if not row.get("id") or not row.get("text"):
+                raise ValueError(f"{path}: record {number} needs 'id' and 'text'")
+            records.append(row)
+    return records
+
+
+def safe_name(record_id):
+    """File-system safe name for a record id."""
+    return re.sub(r'[^\w.-]+', '_', str(record_id)).strip('._') or "record"
+
+
+def make_job(record, output_dir, engine, profile=None):
+    name = safe_name(record["id"])
+    voice = record.get("voice") or ""
+    return {
+        "id": str(record["id"]),
+        "text": record["text"],
+        "voice": VOICES.get(voice.lower(), voice) or PIPER_VOICE,
+        "face": record.get("face") or AVATAR_FACE,
+        "engine": record.get("engine") or engine,
+        "profile": record.get("profile") or profile,
+        "audio": os.path.abspath(os.path.join(output_dir, f"{name}.wav")),
+        "video": os.path.abspath(os.path.join(output_dir, f"{name}.mp4")),
+    }
+
+
+def synthesize(job):
+    """TTS stage; runs in a thread so the voice pool is shared."""
+    from backend.modules import tts
+
+    if not os.path.exists(job["audio"]):
+        tts.speak(job["text"], filename=job["audio"], voice_model=job["voice"])
+    return job
+
+
+def partial_path(path):
+    """Temporary name a stage writes to before moving the file to ``path``."""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.partial{ext}"
+
+
+def render(job):
+    """Lipsync stage; runs in a worker process, or a thread for Wav2Lip."""
+    from backend.modules import lipsync
+
+    started = time.perf_counter()
+    partial = partial_path(job["video"])
+    try:
+        video = lipsync.generate_lipsync(job["audio"], job["face"], partial, engine=job["engine"],
+                                         profile=job["profile"])
+        if not video or not os.path.exists(partial):
+            raise RuntimeError("lipsync produced no video")
+        os.replace(partial, job["video"])
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return job, time.perf_counter() - started
+
+
+def audio_seconds(path):
+    import wave
+
+    try:
+        with wave.open(path, 'rb') as wav_file:
+            return wav_file.getnframes() / float(wav_file.getframerate())
+    except (wave.Error, EOFError, OSError):
+        return 0.0
+
+
+def run(records, output_dir, tts_workers=2, render_workers=None, queue_size=8, engine=None,
+        profile=None):
+    """Render all records and return a summary dict."""
+    from backend.modules.lipsync import WAV2LIP_BACKENDS
+
+    os.makedirs(output_dir, exist_ok=True)
+    render_workers = render_workers or max(1, (os.cpu_count() or 2) - 1)
+
+    jobs = [make_job(record, output_dir, engine, profile) for record in records]
+    pending = [job for job in jobs if not os.path.exists(job["video"])]
+    skipped = len(jobs) - len(pending)
+    if skipped:
+        print(f"Skipping {skipped} records with existing videos")
+
+    rendered = queue.Queue(maxsize=queue_size)
+    results = {"done": 0, "failed": [], "audio_seconds": 0.0, "render_seconds": 0.0}
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def record_failure(job, stage, error):
+        print(f"❌ {job['id']}: {stage} failed: {error}")
+        with lock:
+            results["failed"].append({"id": job["id"], "stage": stage, "error": str(error)})
+
+    def tts_stage():
+        # At most queue_size syntheses in flight, so TTS never runs far ahead
+        slots = threading.BoundedSemaphore(queue_size)
+
+        def finished(future, job):
+            slots.release()
+            try:
+                rendered.put(future.result())
+            except Exception as e:
+                record_failure(job, "tts", e)
+
+        with ThreadPoolExecutor(max_workers=tts_workers) as pool:
+            for job in pending:
+                slots.acquire()
+                pool.submit(synthesize, job).add_done_callback(lambda f, job=job: finished(f, job))
+        rendered.put(_DONE)
+
+    def render_done(future, job, slots):
+        slots.release()
+        try:
+            _, seconds = future.result()
+        except Exception as e:
+            record_failure(job, "lipsync", e)
+            return
+        with lock:
+            results["done"] += 1
+            results["render_seconds"] += seconds
+            results["audio_seconds"] += audio_seconds(job["audio"])
+        print(f"✅ {job['id']} → {job['video']}")
+
+    producer = threading.Thread(target=tts_stage, daemon=True)
+    producer.start()
+
+    # Separate processes would each load their own copy of the model
+    shared_model = all((job["engine"] or LIPSYNC_ENGINE) in WAV2LIP_BACKENDS for job in pending)
+    if shared_model:
+        pool = ThreadPoolExecutor(max_workers=render_workers)
+    else:
+        # Spawned, not forked: the TTS stage threads are already running
+        pool = ProcessPoolExecutor(max_workers=render_workers,
+                                   mp_context=multiprocessing.get_context("spawn"))
+
+    slots = threading.BoundedSemaphore(render_workers * 2)
+    with pool:
+        while True:
+            job = rendered.get()
+            if job is _DONE:
+                break
+            slots.acquire()
+            pool.submit(render, job).add_done_callback(
+                lambda f, job=job: render_done(f, job, slots))
+    producer.join()
+
+    elapsed = time.perf_counter() - started
+    results.update({
+        "total": len(jobs),
+        "skipped": skipped,
+        "elapsed": elapsed,
+        "videos_per_minute": results["done"] * 60.0 / elapsed if elapsed else 0.0,
+        "audio_seconds_per_second": results["audio_seconds"] / elapsed if elapsed else 0.0,
+    })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a batch of utterances to lip-synced videos")
+    parser.add_argument('input', help="JSONL or CSV file with id, text, voice, face columns")
+    parser.add_argument('--output-dir', default=os.path.join(OUTPUT_DIR, 'batch'))
+    parser.add_argument('--tts-workers', type=int, default=2)
+    parser.add_argument('--render-workers', type=int, default=None,
+                        help="Lipsync workers: processes, or threads sharing the Wav2Lip worker "
+                             "(default: CPU count - 1)")
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help="Max synthesized utterances waiting for lipsync")
+    parser.add_argument('--engine', default=None, help="Lipsync engine (wav2lip, viseme, basic)")
+    parser.add_argument('--profile', default=None,
+                        help="Encode profile (preview, balanced, archival; default ENCODE_PROFILE)")
+    args = parser.parse_args()
+
+    records = load_records(args.input)
+    print(f"Loaded {len(records)} records from {args.input}")
+    summary = run(records, args.output_dir, args.tts_workers, args.render_workers,
+                  args.queue_size, args.engine, args.profile)
+
+    print(f"\nRendered {summary['done']}/{summary['total']} videos "
+          f"({summary['skipped']} skipped, {len(summary['failed'])} failed) "
+          f"in {summary['elapsed']:.1f}s")
+    print(f"Throughput: {summary['videos_per_minute']:.1f} videos/min, "
+          f"{summary['audio_seconds_per_second']:.2f}s of speech rendered per second")
+
+
+if __name__ == "__main__":
+    main()
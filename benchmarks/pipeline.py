@@ -0,0 +1,431 @@
+"""
+End-to-end pipeline benchmark: per-stage latency, throughput under
+concurrency, real-time factor and peak memory, with JSON baselines.
+
+Every text of the corpus (short, medium and long; see corpus.json) goes
+through ``tts.speak``, ``stt.stream_recognize`` (on the synthesized WAV, or
+on the WAVs of ``--fixtures``) and ``lipsync.generate_lipsync``. Then whole
+jobs (speech plus video) run at each ``--concurrency`` level.
+
+With ``--stub`` no downloads are needed and results are reproducible: Piper
+is replaced by benchmarks/stubs/piper, Wav2Lip runs with random weights
+(WAV2LIP_RANDOM_INIT) and the face is a synthetic image whose box is seeded
+into a private face cache. ffmpeg is the real one. STT still needs Vosk and
+its model and is skipped when they are missing.
+
+    python benchmarks/pipeline.py --stub --save-baseline benchmarks/baselines/stub.json
+    python benchmarks/pipeline.py --stub --baseline benchmarks/baselines/stub.json
+
+With ``--baseline``, a run slower than the baseline by more than
+``--tolerance`` is reported as a regression and the exit status is 1.
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STUBS_DIR = os.path.join(PROJECT_ROOT, 'benchmarks', 'stubs')
+DEFAULT_CORPUS = os.path.join(PROJECT_ROOT, 'benchmarks', 'corpus.json')
+# Differences below this many seconds are never reported as regressions
+MIN_DELTA_SECONDS = 0.02
+
+
+def percentile(values, q):
+    """Linearly interpolated ``q``-th percentile (0-100) of ``values``."""
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100.0
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(latencies, audio_seconds=None):
+    summary = {"n": len(latencies), "p50": percentile(latencies, 50), "p95": percentile(latencies, 95)}
+    if audio_seconds:
+        summary["rtf_p50"] = percentile([t / a for t, a in zip(latencies, audio_seconds) if a], 50)
+    return summary
+
+
+def wav_seconds(path):
+    with wave.open(path, 'rb') as wav_file:
+        return wav_file.getnframes() / float(wav_file.getframerate())
+
+
+def child_peak_rss_bytes():
+    """Peak RSS of the largest child process that has been waited for."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """Silence the pipeline's progress prints unless ``verbose``."""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=PROJECT_ROOT).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# --- Stand-ins ---
+
+def setup_stubs(work_dir):
+    """Point the pipeline at the stand-in engines; must run before backend modules are imported.
+
+    Returns (voice model path, face image path).
+    """
+    bin_dir = os.path.join(work_dir, 'bin')
+    os.makedirs(bin_dir)
+    # Run the stub with this interpreter so it finds NumPy
+    wrapper = os.path.join(bin_dir, 'piper')
+    with open(wrapper, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(STUBS_DIR, "piper")}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+    os.environ["WAV2LIP_RANDOM_INIT"] = "1"
+    os.environ["FACE_CACHE_DIR"] = os.path.join(work_dir, 'faces')
+
+    import cv2
+    import numpy as np
+
+    # A flat face-coloured oval on a grey background; its box is seeded below
+    image = np.full((256, 256, 3), 90, dtype=np.uint8)
+    cv2.ellipse(image, (128, 120), (60, 80), 0, 0, 360, (140, 170, 210), -1)
+    cv2.ellipse(image, (128, 165), (22, 8), 0, 0, 360, (80, 80, 150), -1)
+    face_file = os.path.join(work_dir, 'face.png')
+    cv2.imwrite(face_file, image)
+
+    from backend.modules import face_cache
+    face_cache.cache.get(face_file, image, lambda _: (40, 210, 68, 188))
+
+    # Not a real model: the resident engine fails to load it and tts uses the piper CLI
+    return os.path.join(work_dir, 'stub-voice.onnx'), face_file
+
+
+# --- Stages ---
+
+class Runner:
+    """Runs pipeline stages into a scratch directory and records their latencies."""
+
+    def __init__(self, work_dir, voice_model, face_file, engine):
+        from backend.modules import lipsync, stt, tts
+
+        self.tts = tts
+        self.stt = stt
+        self.lipsync = lipsync
+        self.work_dir = work_dir
+        self.voice_model = voice_model
+        self.face_file = face_file
+        self.engine = engine
+        self.stt_error = None
+        self._ids = iter(range(1 << 30))
+        self._lock = threading.Lock()
+
+    def _path(self, suffix):
+        with self._lock:
+            return os.path.join(self.work_dir, f"{next(self._ids):06d}{suffix}")
+
+    def speak(self, text):
+        """Synthesize ``text`` to a WAV file; returns (seconds, wav path)."""
+        start = time.perf_counter()
+        path = self.tts.speak(text, filename=self._path('.wav'), voice_model=self.voice_model,
+                              use_cache=False)
+        return time.perf_counter() - start, path
+
+    def recognize(self, wav_path):
+        """Recognize a WAV file; returns seconds, or None once STT turned out to be unavailable."""
+        if self.stt_error:
+            return None
+        start = time.perf_counter()
+        try:
+            for _ in self.stt.stream_recognize(wav_path):
+                pass
+        except Exception as e:
+            self.stt_error = f"{type(e).__name__}: {e}"
+            return None
+        return time.perf_counter() - start
+
+    def render(self, wav_path):
+        start = time.perf_counter()
+        video = self.lipsync.generate_lipsync(wav_path, self.face_file, filename=self._path('.mp4'),
+                                              engine=self.engine)
+        if not video:
+            raise RuntimeError("lipsync produced no video")
+        return time.perf_counter() - start
+
+    def job(self, text):
+        """One request as the service runs it: speech, then video. Returns (seconds, audio seconds)."""
+        start = time.perf_counter()
+        _, wav_path = self.speak(text)
+        self.render(wav_path)
+        return time.perf_counter() - start, wav_seconds(wav_path)
+
+    def warmup(self):
+        self.lipsync.warmup(self.engine, self.face_file)
+        _, wav_path = self.speak("Olá.")
+        self.recognize(wav_path)
+        self.render(wav_path)
+
+
+def run_stages(runner, corpus, repeat, fixtures):
+    """Per-stage latencies, by text length class and overall."""
+    samples = {}
+
+    def add(stage, size, seconds, audio):
+        for key in (f"{stage}.{size}", stage):
+            entry = samples.setdefault(key, ([], []))
+            entry[0].append(seconds)
+            entry[1].append(audio)
+
+    for _ in range(repeat):
+        for size, texts in corpus.items():
+            for text in texts:
+                tts_seconds, wav_path = runner.speak(text)
+                audio = wav_seconds(wav_path)
+                add("tts", size, tts_seconds, audio)
+                if not fixtures:
+                    stt_seconds = runner.recognize(wav_path)
+                    if stt_seconds is not None:
+                        add("stt", size, stt_seconds, audio)
+                add("lipsync", size, runner.render(wav_path), audio)
+
+        for wav_path in fixtures:
+            stt_seconds = runner.recognize(wav_path)
+            if stt_seconds is not None:
+                add("stt", "fixtures", stt_seconds, wav_seconds(wav_path))
+
+    return {key: summarize(*values) for key, values in sorted(samples.items())}
+
+
+def batching_totals():
+    """(sum, count) of the Wav2Lip batch fill and queue delay recorded so far."""
+    from backend.modules import metrics
+
+    exported = metrics.registry.export_json()
+    fill = exported["values"].get("lipsync.wav2lip.batch_fill", {})
+    delay = exported["stages"].get("lipsync.wav2lip.queue_delay", {}).get("wall_seconds", {})
+    return ((fill.get("sum", 0.0), fill.get("count", 0)),
+            (delay.get("sum", 0.0), delay.get("count", 0)))
+
+
+def run_concurrency(runner, texts, levels):
+    """Throughput of whole jobs with ``level`` of them in flight at once.
+
+    For Wav2Lip engines, also the mean fill of the worker's shared batches
+    and the mean time a job's frames queued for them.
+    """
+    results = {}
+    for level in levels:
+        before = batching_totals()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            done = list(pool.map(runner.job, texts))
+        elapsed = time.perf_counter() - start
+        latencies = [seconds for seconds, _ in done]
+        (fill_sum, fills), (delay_sum, delays) = [
+            (now[0] - then[0], now[1] - then[1]) for now, then in zip(batching_totals(), before)]
+        results[str(level)] = {
+            "jobs": len(done),
+            "seconds": elapsed,
+            "jobs_per_second": len(done) / elapsed,
+            "audio_seconds_per_second": sum(audio for _, audio in done) / elapsed,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "batch_fill": fill_sum / fills if fills else None,
+            "queue_delay": delay_sum / delays if delays else None,
+        }
+    return results
+
+
+# --- Baselines ---
+
+def compare(current, baseline, tolerance):
+    """Return (regressions, notes) of ``current`` against ``baseline``."""
+    regressions, notes = [], []
+    for key in ("mode", "engine", "machine", "cpu_count"):
+        if current["meta"].get(key) != baseline["meta"].get(key):
+            notes.append(f"baseline {key} is {baseline['meta'].get(key)!r}, "
+                         f"this run {current['meta'].get(key)!r}")
+
+    def slower(name, now, before):
+        if now is None or before is None:
+            return
+        if now > before * (1 + tolerance) and now - before > MIN_DELTA_SECONDS:
+            regressions.append(f"{name}: {before * 1000:.1f}ms -> {now * 1000:.1f}ms "
+                               f"(+{(now / before - 1) * 100:.0f}%)")
+
+    for stage, stats in current["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before:
+            for q in ("p50", "p95"):
+                slower(f"{stage} {q}", stats.get(q), before.get(q))
+
+    for level, stats in current["throughput"].items():
+        before = baseline["throughput"].get(level)
+        if before and stats["jobs_per_second"] < before["jobs_per_second"] * (1 - tolerance):
+            regressions.append(f"throughput x{level}: {before['jobs_per_second']:.2f} -> "
+                               f"{stats['jobs_per_second']:.2f} jobs/s")
+
+    for name, now in current["peak_rss_bytes"].items():
+        before = baseline["peak_rss_bytes"].get(name)
+        if now and before and now > before * (1 + tolerance):
+            regressions.append(f"peak RSS ({name}): {before / 2**20:.0f} -> {now / 2**20:.0f} MiB")
+    return regressions, notes
+
+
+def fmt(value):
+    return f"{value * 1000:9.1f}ms" if isinstance(value, (int, float)) else f"{'-':>11}"
+
+
+def report(results):
+    print(f"{'stage':<18}{'n':>4}{'p50':>11}{'p95':>11}{'RTF':>8}")
+    for stage, stats in results["stages"].items():
+        rtf = stats.get("rtf_p50")
+        print(f"{stage:<18}{stats['n']:>4}{fmt(stats['p50'])}{fmt(stats['p95'])}"
+              + (f"{rtf:8.3f}" if rtf is not None else ""))
+    if results["skipped"]:
+        for stage, reason in results["skipped"].items():
+            print(f"{stage:<18}skipped: {reason}")
+    print()
+    print(f"{'concurrency':<12}{'jobs/s':>8}{'audio s/s':>11}{'p50':>11}{'p95':>11}"
+          f"{'fill':>7}{'queued':>11}")
+    for level, stats in results["throughput"].items():
+        fill = stats.get("batch_fill")
+        print(f"{level:<12}{stats['jobs_per_second']:8.2f}{stats['audio_seconds_per_second']:11.2f}"
+              f"{fmt(stats['p50'])}{fmt(stats['p95'])}"
+              + (f"{fill:7.2f}{fmt(stats.get('queue_delay'))}" if fill is not None else ""))
+    print()
+    for name, value in results["peak_rss_bytes"].items():
+        if value:
+            print(f"peak RSS ({name}): {value / 2**20:.0f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark")
+    parser.add_argument('--stub', action='store_true',
+                        help="Use the stand-in engines (no models needed, reproducible)")
+    parser.add_argument('--engine', default=None, help="Lipsync engine (default LIPSYNC_ENGINE)")
+    parser.add_argument('--voice', default=None, help="Piper model (ignored with --stub)")
+    parser.add_argument('--face', default=None, help="Face image or avatar ID (ignored with --stub)")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="JSON of {size: [texts]}")
+    parser.add_argument('--fixtures', default=None, help="Directory of WAVs for the STT stage")
+    parser.add_argument('--repeat', type=int, default=3, help="Passes over the corpus")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--jobs', type=int, default=8, help="Jobs per concurrency level")
+    parser.add_argument('--no-warmup', action='store_true', help="Include the cold start")
+    parser.add_argument('--json', dest='json_path', help="Write the results to this file")
+    parser.add_argument('--baseline', help="Compare against this baseline file")
+    parser.add_argument('--save-baseline', help="Write the results as a new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="Allowed slowdown against the baseline (0.15 = 15%%)")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = json.load(f)
+    fixtures = sorted(glob.glob(os.path.join(args.fixtures, '*.wav'))) if args.fixtures else []
+
+    sys.path.insert(0, PROJECT_ROOT)
+    os.chdir(PROJECT_ROOT)
+    work_dir = tempfile.mkdtemp(prefix='pipeline-bench-')
+    # Keep the job directories of the artifact store out of output/
+    os.environ["ARTIFACT_DIR"] = os.path.join(work_dir, 'jobs')
+
+    voice_model, face_file = args.voice, args.face
+    if args.stub:
+        with quiet(args.verbose):
+            voice_model, face_file = setup_stubs(work_dir)
+
+    from config import AVATAR_FACE, LIPSYNC_ENGINE
+    from backend.modules import metrics, tts, wav2lip_worker
+
+    engine = args.engine or LIPSYNC_ENGINE
+    runner = Runner(work_dir, voice_model, face_file or AVATAR_FACE, engine)
+    texts = [text for group in corpus.values() for text in group]
+    results = {
+        "meta": {
+            "mode": "stub" if args.stub else "real",
+            "engine": engine,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "revision": git_revision(),
+            "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        "skipped": {},
+    }
+
+    try:
+        with quiet(args.verbose):
+            if not args.no_warmup:
+                runner.warmup()
+            results["stages"] = run_stages(runner, corpus, args.repeat, fixtures)
+            results["throughput"] = run_concurrency(
+                runner, [texts[i % len(texts)] for i in range(args.jobs)], args.concurrency)
+    finally:
+        # Children only count towards RUSAGE_CHILDREN once they have exited
+        with quiet(args.verbose):
+            wav2lip_worker.stop_workers()
+            tts.shutdown_pools()
+    results["peak_rss_bytes"] = {"self": metrics.peak_rss_bytes(), "children": child_peak_rss_bytes()}
+    if runner.stt_error:
+        results["skipped"]["stt"] = runner.stt_error
+
+    report(results)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json_path}")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions, notes = compare(results, baseline, args.tolerance)
+        for note in notes:
+            print(f"Note: {note}")
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
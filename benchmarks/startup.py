@@ -0,0 +1,129 @@
+"""
+Startup benchmark: import time and first-request latency per backend module.
+
+Each measurement runs in a fresh interpreter so nothing is already loaded.
+With ``--warmup`` the module's ``warmup()`` hook runs (and is timed) before
+the first request, which shows how much of the cold start it absorbs.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --warmup --repeat 3 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MODULES = ("stt", "tts", "lipsync")
+
+
+def first_request(module, name, engine):
+    """Run one small, representative request against ``module``."""
+    if name == "stt":
+        # One second of silence through the streaming recognizer
+        for _ in module.stream_recognize(bytes(16000 * 2)):
+            pass
+    elif name == "tts":
+        module.speak("Olá, tudo bem?", as_buffer=True, use_cache=False)
+    elif name == "lipsync":
+        from backend.modules.audio import AudioBuffer
+
+        silence = AudioBuffer.from_pcm(bytes(16000 * 2), 16000)
+        with tempfile.TemporaryDirectory() as tmp:
+            if not module.generate_lipsync(silence, filename=os.path.join(tmp, "startup.mp4"),
+                                           engine=engine):
+                raise RuntimeError("lipsync produced no video")
+
+
+def child(name, warmup, engine):
+    """Measure one module in this (fresh) process and print the result as JSON."""
+    import importlib
+
+    sys.path.insert(0, PROJECT_ROOT)
+    os.chdir(PROJECT_ROOT)
+    result = {"module": name, "warmup_seconds": None, "error": None}
+
+    start = time.perf_counter()
+    module = importlib.import_module(f"backend.modules.{name}")
+    result["import_seconds"] = time.perf_counter() - start
+    result["modules_loaded"] = sorted(m for m in ("numpy", "cv2", "vosk", "torch", "onnxruntime")
+                                      if m in sys.modules)
+
+    try:
+        if warmup:
+            start = time.perf_counter()
+            module.warmup(engine) if name == "lipsync" else module.warmup()
+            result["warmup_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        first_request(module, name, engine)
+        result["first_request_seconds"] = time.perf_counter() - start
+    except Exception as e:
+        result["first_request_seconds"] = None
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    sys.__stdout__.write("RESULT " + json.dumps(result) + "\n")
+
+
+def measure(name, warmup, engine):
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', name]
+    if warmup:
+        cmd.append('--warmup')
+    if engine:
+        cmd += ['--engine', engine]
+
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=PROJECT_ROOT)
+    total = time.perf_counter() - start
+
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            result = json.loads(line[len("RESULT "):])
+            result["process_seconds"] = total
+            return result
+    return {"module": name, "error": proc.stderr.strip().splitlines()[-1:] or "no result",
+            "process_seconds": total}
+
+
+def fmt(value):
+    return f"{value * 1000:8.1f}ms" if isinstance(value, (int, float)) else f"{'-':>10}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and first-request latency per module")
+    parser.add_argument('--modules', nargs='+', choices=MODULES, default=list(MODULES))
+    parser.add_argument('--warmup', action='store_true', help="Call warmup() before the first request")
+    parser.add_argument('--engine', default=None, help="Lipsync engine for the lipsync request")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help="Write all results to this file")
+    parser.add_argument('--child', choices=MODULES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.warmup, args.engine)
+        return
+
+    results = []
+    print(f"{'module':<10}{'import':>10}{'warmup':>10}{'first req':>10}{'process':>10}  loaded")
+    for name in args.modules:
+        for _ in range(args.repeat):
+            result = measure(name, args.warmup, args.engine)
+            results.append(result)
+            print(f"{name:<10}{fmt(result.get('import_seconds'))}{fmt(result.get('warmup_seconds'))}"
+                  f"{fmt(result.get('first_request_seconds'))}{fmt(result.get('process_seconds'))}"
+                  f"  {','.join(result.get('modules_loaded', []))}")
+            if result.get("error"):
+                print(f"{'':<10}error: {result['error']}")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
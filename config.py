@@ -5,6 +5,18 @@ load_dotenv()
 
 OUTPUT_DIR = "output/"
 
+# --- Artifact store ---
+# Each run writes into its own directory under ARTIFACT_DIR. Finished jobs
+# older than ARTIFACT_MAX_AGE seconds, or beyond ARTIFACT_MAX_BYTES in total
+# (oldest first), are evicted in the background (0 disables either limit).
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(OUTPUT_DIR, "jobs"))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+ARTIFACT_MAX_AGE = float(os.getenv("ARTIFACT_MAX_AGE", str(24 * 3600)))
+ARTIFACT_EVICT_INTERVAL = float(os.getenv("ARTIFACT_EVICT_INTERVAL", "60"))
+# Intermediates (audio handed to lipsync, temporary video tracks): empty keeps
+# them under ARTIFACT_DIR, "tmpfs" puts them in /dev/shm, or give a directory
+ARTIFACT_SCRATCH = os.getenv("ARTIFACT_SCRATCH", "")
+
 # --- Voice configuration ---
 # We install two Piper voices in setup.py:
 # 1) Male (Tuga):  backend/extras/voices/pt_PT-tugao-medium.onnx
@@ -16,6 +28,105 @@ PIPER_VOICE_FEMALE = "backend/extras/voices/dii_pt-PT.onnx"
 # Default voice if nothing else is specified
 PIPER_VOICE = PIPER_VOICE_FEMALE
 
-AVATAR_FACE = "backend/extras/photos/face.jpg"
+# Default face: an image path or the ID of a registered avatar
+AVATAR_FACE = os.getenv("AVATAR_FACE", "backend/extras/photos/face.jpg")
 
 VOSK_MODEL_PATH = "backend/extras/models/vosk-model-small-pt-0.3"
+
+# Number of Piper voices kept loaded in memory per process
+PIPER_VOICE_POOL_SIZE = int(os.getenv("PIPER_VOICE_POOL_SIZE", "2"))
+
+# --- Synthesis cache ---
+# Synthesized phrases are cached on disk, keyed by text + voice + parameters
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "1") != "0"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "backend/extras/cache/tts")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# --- Long-form synthesis ---
+# Opt-in: texts of at least TTS_PARALLEL_MIN_CHARS (0 = never) are split into
+# sentences that are synthesized in parallel by TTS_PARALLEL_WORKERS processes
+# (0 = one per CPU, each with its own copy of the voice) and joined with
+# TTS_SENTENCE_PAUSE_MS of silence, faded over TTS_CROSSFADE_MS
+TTS_PARALLEL_MIN_CHARS = int(os.getenv("TTS_PARALLEL_MIN_CHARS", "0"))
+TTS_PARALLEL_WORKERS = int(os.getenv("TTS_PARALLEL_WORKERS", "0"))
+TTS_SENTENCE_PAUSE_MS = int(os.getenv("TTS_SENTENCE_PAUSE_MS", "250"))
+TTS_CROSSFADE_MS = int(os.getenv("TTS_CROSSFADE_MS", "10"))
+
+# --- Wav2Lip ---
+# Render through a persistent worker process that keeps the model loaded.
+# Set to 0 to run Wav2Lip/inference.py once per video instead.
+WAV2LIP_WORKER_ENABLED = os.getenv("WAV2LIP_WORKER_ENABLED", "1") != "0"
+WAV2LIP_WORKER_START_TIMEOUT = float(os.getenv("WAV2LIP_WORKER_START_TIMEOUT", "180"))
+WAV2LIP_WORKER_JOB_TIMEOUT = float(os.getenv("WAV2LIP_WORKER_JOB_TIMEOUT", "600"))
+# Health check before each job; a worker that does not answer it is restarted
+WAV2LIP_WORKER_PING_TIMEOUT = float(os.getenv("WAV2LIP_WORKER_PING_TIMEOUT", "5"))
+WAV2LIP_BATCH_SIZE = int(os.getenv("WAV2LIP_BATCH_SIZE", "128"))
+# Renders the worker runs at once. Their frames go through one model in
+# shared batches of WAV2LIP_BATCH_SIZE; a batch that is not full waits at
+# most WAV2LIP_BATCH_WAIT_MS for frames from other renders.
+WAV2LIP_WORKER_JOBS = int(os.getenv("WAV2LIP_WORKER_JOBS", "4"))
+WAV2LIP_BATCH_WAIT_MS = float(os.getenv("WAV2LIP_BATCH_WAIT_MS", "10"))
+WAV2LIP_FPS = 25.0
+# Run the worker with an untrained network instead of the checkpoint, for
+# benchmarks and tests on machines without the download (output is noise)
+WAV2LIP_RANDOM_INIT = os.getenv("WAV2LIP_RANDOM_INIT", "0") == "1"
+# Network backend in the worker: "torch", or "onnx" for ONNX Runtime on CPU
+# (export first with: python -m backend.modules.wav2lip_onnx export --quantize)
+WAV2LIP_BACKEND = os.getenv("WAV2LIP_BACKEND", "torch")
+WAV2LIP_ONNX_QUANTIZED = os.getenv("WAV2LIP_ONNX_QUANTIZED", "0") == "1"
+# onnxruntime intra-op threads (0 = one per physical core)
+WAV2LIP_ONNX_THREADS = int(os.getenv("WAV2LIP_ONNX_THREADS", "0"))
+
+# Mel spectrograms kept in memory, keyed by audio content hash
+MEL_CACHE_SIZE = int(os.getenv("MEL_CACHE_SIZE", "32"))
+
+# Avatar registry (python -m backend.modules.avatars register ...): frames
+# are scaled to at most AVATAR_MAX_HEIGHT, videos keep AVATAR_MAX_FRAMES frames
+AVATAR_DIR = os.getenv("AVATAR_DIR", "backend/extras/avatars")
+AVATAR_MAX_HEIGHT = int(os.getenv("AVATAR_MAX_HEIGHT", "720"))
+AVATAR_MAX_FRAMES = int(os.getenv("AVATAR_MAX_FRAMES", "250"))
+
+# Face detection results for avatar images, keyed by image content hash
+FACE_CACHE_DIR = os.getenv("FACE_CACHE_DIR", "backend/extras/cache/faces")
+
+# --- Lip sync engine ---
+# "wav2lip" (neural, best quality), "viseme" (fast CPU mouth animation)
+# or "basic" (static image)
+LIPSYNC_ENGINE = os.getenv("LIPSYNC_ENGINE", "wav2lip")
+VISEME_FPS = 25
+# Number of pre-rendered mouth openness levels
+VISEME_LEVELS = 12
+
+# Pre-encoded still-image video reused by the basic fallback
+IDLE_LOOP_DIR = os.getenv("IDLE_LOOP_DIR", "backend/extras/cache/idle")
+IDLE_LOOP_SECONDS = 30
+IDLE_LOOP_FPS = 25
+
+# --- Video encoding ---
+# Profile of lipsync videos: "preview" (360p, 15 fps, ultrafast), "balanced"
+# (up to 720p, veryfast) or "archival" (source size, slow, CRF 18)
+ENCODE_PROFILE = os.getenv("ENCODE_PROFILE", "balanced")
+# Measured encode speed per profile on this host, used to pick a profile
+# from a latency budget
+ENCODE_SPEED_FILE = os.getenv("ENCODE_SPEED_FILE", "backend/extras/cache/encode_speed.json")
+
+# --- Segmented output (HLS) ---
+# Target segment length, and "fmp4" (fragmented MP4) or "mpegts" segments
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "2"))
+SEGMENT_TYPE = os.getenv("SEGMENT_TYPE", "fmp4")
+
+# --- Metrics ---
+# Directory for per-request trace dumps (empty = traces are not written)
+METRICS_TRACE_DIR = os.getenv("METRICS_TRACE_DIR", "")
+
+# --- HTTP service (server.py) ---
+SERVER_QUEUE_SIZE = int(os.getenv("SERVER_QUEUE_SIZE", "32"))
+SERVER_TTS_WORKERS = int(os.getenv("SERVER_TTS_WORKERS", "2"))
+SERVER_RENDER_WORKERS = int(os.getenv("SERVER_RENDER_WORKERS", "2"))
+SERVER_MAX_STREAMS = int(os.getenv("SERVER_MAX_STREAMS", "4"))
+SERVER_MAX_BODY = 64 * 1024
+
+# --- Speech recognition ---
+# Trailing silence that ends an utterance, and the minimum speech level (dBFS)
+STT_ENDPOINT_SILENCE_MS = int(os.getenv("STT_ENDPOINT_SILENCE_MS", "600"))
+STT_VAD_THRESHOLD_DB = float(os.getenv("STT_VAD_THRESHOLD_DB", "-45"))
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Model downloads for setup.py: the assets listed in assets.json, fetched in
+parallel, resumed after interruptions and verified before they are used.
+
+Each manifest entry has a ``name``, ``url`` and ``path`` (relative to the
+project root), optionally ``size`` and ``sha256``, a ``group`` and, for
+archives, ``extract`` ("zip" or "tar"), ``extract_to`` and ``creates`` (the
+path that exists once extracted). Downloads go to ``<path>.part`` and are
+continued with an HTTP Range request; only a complete, verified file is
+renamed into place. Archives are extracted member by member into a
+temporary directory next to the destination and moved in when complete.
+
+Entries without a ``sha256`` are checked against the hash the server
+publishes, if any (Hugging Face sends the sha256 and size of LFS files with
+its redirect), or else trusted on first use: the hash of the first complete
+download is recorded in assets.lock.json and every later download and check
+must match it. Commit the lock file to pin the hashes for other machines, or
+write the published hashes into the manifest with ``--pin``.
+
+Standard library only, since it runs before the requirements are installed.
+
+    python fetch_assets.py                  # everything that is missing or invalid
+    python fetch_assets.py --group voices
+    python fetch_assets.py --verify
+    python fetch_assets.py --pin            # store published sizes and hashes in assets.json
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+MANIFEST = os.path.join(PROJECT_ROOT, "assets.json")
+LOCK_FILE = os.path.join(PROJECT_ROOT, "assets.lock.json")
+PARTIAL = ".part"
+# Network reads per call, and the write buffer of the partial file
+CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER = 8 * 1024 * 1024
+USER_AGENT = "tts-playground-setup"
+TIMEOUT = 60
+ATTEMPTS = 3
+REDIRECTS = 5
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class AssetError(Exception):
+    pass
+
+
+class Asset:
+    """One manifest entry, with its paths made absolute."""
+
+    def __init__(self, name, url, path, size=None, sha256=None, group=None,
+                 extract=None, extract_to=None, creates=None, root=PROJECT_ROOT):
+        if extract not in (None, "zip", "tar"):
+            raise ValueError(f"{name}: unknown extract rule {extract!r}")
+        self.name = name
+        self.url = url
+        self.path = os.path.join(root, path)
+        self.size = size
+        self.sha256 = sha256.lower() if sha256 else None
+        self.group = group
+        self.extract = extract
+        self.extract_to = os.path.join(root, extract_to or os.path.dirname(path))
+        self.creates = os.path.join(root, creates) if creates else None
+
+    @classmethod
+    def from_dict(cls, data, root=PROJECT_ROOT):
+        return cls(root=root, **data)
+
+
+def load_manifest(path=MANIFEST, root=PROJECT_ROOT):
+    with open(path, encoding="utf-8") as f:
+        return [Asset.from_dict(entry, root) for entry in json.load(f)["assets"]]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _inside(root, name):
+    """Absolute path of archive member ``name`` under ``root``; rejects paths that escape it."""
+    target = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([os.path.realpath(root), target]) != os.path.realpath(root):
+        raise AssetError(f"archive member escapes the destination: {name}")
+    return target
+
+
+class Fetcher:
+    """Downloads, verifies and extracts assets; hashes are kept in ``lock_path``."""
+
+    def __init__(self, lock_path=LOCK_FILE, workers=4):
+        self.lock_path = lock_path
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._changed = False
+        try:
+            with open(lock_path, encoding="utf-8") as f:
+                self._entries = json.load(f).get("assets", {})
+        except (OSError, ValueError):
+            self._entries = {}
+
+    # --- Lock file ---
+
+    def _entry(self, asset):
+        """Recorded hash and size of ``asset``, if recorded for its current URL."""
+        with self._lock:
+            entry = self._entries.get(asset.name)
+        return entry if entry and entry.get("url") == asset.url else {}
+
+    def _record(self, asset, **fields):
+        with self._lock:
+            entry = self._entries.get(asset.name)
+            if not entry or entry.get("url") != asset.url:
+                entry = self._entries[asset.name] = {"url": asset.url}
+            entry.update(fields)
+            self._changed = True
+
+    def save(self):
+        with self._lock:
+            if not self._changed:
+                return
+            data = {"assets": dict(sorted(self._entries.items()))}
+            self._changed = False
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.lock_path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, self.lock_path)
+
+    def expected(self, asset):
+        """(sha256, size) a download of ``asset`` must have; the manifest wins over the lock."""
+        entry = self._entry(asset)
+        return asset.sha256 or entry.get("sha256"), asset.size or entry.get("size")
+
+    # --- Verification ---
+
+    def verify(self, asset):
+        """Return (ok, reason) for the installed copy of ``asset``."""
+        if asset.extract:
+            if asset.creates and os.path.exists(asset.creates):
+                return True, "extracted"
+            return False, "not extracted"
+        if not os.path.exists(asset.path):
+            return False, "missing"
+
+        sha256, size = self.expected(asset)
+        entry = self._entry(asset)
+        if sha256 and entry.get("verified") == _stamp(asset.path) and entry.get("sha256") == sha256:
+            return True, "verified"
+        if size and os.path.getsize(asset.path) != size:
+            return False, f"size {os.path.getsize(asset.path)} instead of {size}"
+        if not sha256:
+            # Installed before the lock file existed: compare with the server, then pin it
+            remote, published = remote_info(asset.url)
+            if remote is not None and os.path.getsize(asset.path) != remote:
+                return False, f"size {os.path.getsize(asset.path)} instead of {remote}"
+            actual = file_sha256(asset.path)
+            if published and actual != published:
+                return False, "checksum mismatch"
+            self._record(asset, sha256=actual, size=os.path.getsize(asset.path),
+                         verified=_stamp(asset.path))
+            return True, "verified" if published else "recorded"
+        if file_sha256(asset.path) != sha256:
+            return False, "checksum mismatch"
+        self._record(asset, verified=_stamp(asset.path))
+        return True, "verified"
+
+    # --- Download ---
+
+    def _download(self, asset):
+        """Download ``asset.url`` to ``asset.path``, resuming a partial file; returns bytes fetched."""
+        sha256, size = self.expected(asset)
+        if not sha256:
+            remote, sha256 = remote_info(asset.url)
+            size = size or remote
+        part = asset.path + PARTIAL
+        resumed = os.path.exists(part)
+        os.makedirs(os.path.dirname(asset.path), exist_ok=True)
+
+        fetched = 0
+        for attempt in range(1, ATTEMPTS + 1):
+            try:
+                fetched += self._fetch_range(asset.url, part, size)
+                break
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                if isinstance(e, urllib.error.HTTPError) and e.code < 500 and e.code != 408:
+                    raise AssetError(f"HTTP {e.code} for {asset.url}")
+                if attempt == ATTEMPTS:
+                    raise AssetError(f"download failed after {ATTEMPTS} attempts: {e}")
+                print(f"{asset.name}: {e}, resuming ({attempt}/{ATTEMPTS - 1})...")
+                time.sleep(attempt)
+
+        actual = file_sha256(part)
+        if sha256 and actual != sha256:
+            os.remove(part)
+            if resumed:
+                # The partial file left by an earlier run was bad; start over once
+                print(f"{asset.name}: resumed download failed the checksum, starting over")
+                return fetched + self._download(asset)
+            raise AssetError(f"checksum mismatch (expected {sha256}, got {actual})")
+        if not sha256:
+            print(f"{asset.name}: recorded sha256 {actual} (trust on first use)")
+        os.replace(part, asset.path)
+        self._record(asset, sha256=actual, size=os.path.getsize(asset.path), verified=_stamp(asset.path))
+        return fetched
+
+    @staticmethod
+    def _fetch_range(url, part, size):
+        """Append the rest of ``url`` to ``part``; returns the number of bytes received."""
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if size and offset == size:
+            return 0
+        headers = {"User-Agent": USER_AGENT}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code != 416 or not offset:
+                raise
+            # Range not satisfiable: the partial file is complete only if it
+            # has the full length; otherwise it is stale, so start over
+            total = _range_total(e.headers.get("Content-Range", ""))
+            e.close()
+            if total is None:
+                total = size or remote_size(url)
+            if total is not None and offset == total:
+                return 0
+            os.remove(part)
+            return Fetcher._fetch_range(url, part, size)
+
+        with response:
+            if offset and response.status != 206:
+                # The server ignored the range; start over
+                offset = 0
+            length = response.headers.get("Content-Length")
+            total = offset + int(length) if length is not None else None
+            total = _range_total(response.headers.get("Content-Range", "")) or total
+            if size and total and total != size:
+                raise AssetError(f"server reports {total} bytes, expected {size}")
+
+            received = 0
+            with open(part, "ab" if offset else "wb", buffering=WRITE_BUFFER) as f:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+
+        if total is not None and offset + received < total:
+            raise http.client.IncompleteRead(b"", total - offset - received)
+        return received
+
+    # --- Extraction ---
+
+    @staticmethod
+    def _extract(asset):
+        """Extract the archive next to its destination, then move the contents in."""
+        os.makedirs(asset.extract_to, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=asset.extract_to, prefix=".extract-")
+        try:
+            if asset.extract == "zip":
+                with zipfile.ZipFile(asset.path) as archive:
+                    for member in archive.infolist():
+                        target = _inside(staging, member.filename)
+                        if member.is_dir():
+                            os.makedirs(target, exist_ok=True)
+                            continue
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        with archive.open(member) as src, open(target, "wb") as dst:
+                            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            else:
+                # Stream mode: members are read in order, without seeking
+                with tarfile.open(asset.path, "r|*") as archive:
+                    for member in archive:
+                        target = _inside(staging, member.name)
+                        if member.isdir():
+                            os.makedirs(target, exist_ok=True)
+                        elif member.isfile():
+                            os.makedirs(os.path.dirname(target), exist_ok=True)
+                            with archive.extractfile(member) as src, open(target, "wb") as dst:
+                                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+            for name in os.listdir(staging):
+                destination = os.path.join(asset.extract_to, name)
+                if os.path.isdir(destination) and not os.path.islink(destination):
+                    shutil.rmtree(destination)
+                elif os.path.exists(destination):
+                    os.remove(destination)
+                os.replace(os.path.join(staging, name), destination)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    # --- Entry points ---
+
+    def fetch(self, asset, force=False):
+        """Make ``asset`` present and valid; returns a result dict (never raises AssetError)."""
+        started = time.perf_counter()
+        result = {"name": asset.name, "ok": True, "fetched": 0, "action": "skipped", "error": None}
+        try:
+            ok, reason = (False, "forced") if force else self.verify(asset)
+            if ok:
+                result["reason"] = reason
+                return result
+            if os.path.exists(asset.path) and not asset.extract:
+                print(f"{asset.name}: {reason}, downloading again")
+                os.remove(asset.path)
+            result["action"] = "downloaded"
+            result["fetched"] = self._download(asset)
+            if asset.extract:
+                self._extract(asset)
+                os.remove(asset.path)
+                result["action"] = "extracted"
+        except (AssetError, OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+            result.update(ok=False, error=f"{type(e).__name__}: {e}" if not isinstance(e, AssetError) else str(e))
+        finally:
+            result["seconds"] = time.perf_counter() - started
+        return result
+
+    def fetch_all(self, assets, force=False):
+        """Fetch ``assets`` concurrently, print one line per asset and save the lock file."""
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            results = list(pool.map(lambda asset: self._report(self.fetch(asset, force)), assets))
+        try:
+            self.save()
+        except OSError as e:
+            print(f"Warning: could not write {self.lock_path}: {e}")
+        return results
+
+    @staticmethod
+    def _report(result):
+        if not result["ok"]:
+            print(f"❌ {result['name']}: {result['error']}")
+        elif result["action"] == "skipped":
+            print(f"✅ {result['name']} ({result.get('reason', 'present')})")
+        else:
+            rate = result["fetched"] / max(result["seconds"], 1e-6) / (1024 * 1024)
+            print(f"✅ {result['name']} {result['action']}: {result['fetched'] / (1024 * 1024):.1f}MB "
+                  f"in {result['seconds']:.1f}s ({rate:.1f}MB/s)")
+        return result
+
+
+def _range_total(content_range):
+    """Full length from a ``Content-Range`` header (``bytes 0-9/1234`` or ``bytes */1234``)."""
+    total = content_range.rsplit("/", 1)[1] if "/" in content_range else ""
+    return int(total) if total.isdigit() else None
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def remote_info(url):
+    """(size, sha256) of ``url`` from HEAD requests; either is None if the server does not say.
+
+    Redirects are followed by hand because Hugging Face puts the size and
+    sha256 of LFS files (``X-Linked-Size``, ``X-Linked-Etag``) on the redirect
+    to its CDN rather than on the final response.
+    """
+    opener = urllib.request.build_opener(_NoRedirect)
+    for _ in range(REDIRECTS + 1):
+        request = urllib.request.Request(url, method="HEAD", headers={"User-Agent": USER_AGENT})
+        try:
+            with opener.open(request, timeout=TIMEOUT) as response:
+                headers = response.headers
+                location = None
+        except urllib.error.HTTPError as e:
+            e.close()
+            if not 300 <= e.code < 400:
+                return None, None
+            headers, location = e.headers, e.headers.get("Location")
+        except (urllib.error.URLError, http.client.HTTPException, OSError):
+            return None, None
+
+        sha256 = headers.get("X-Linked-Etag", "").strip('"').lower()
+        if SHA256_RE.match(sha256):
+            size = headers.get("X-Linked-Size", "")
+            return (int(size) if size.isdigit() else None), sha256
+        if not location:
+            length = headers.get("Content-Length", "")
+            return (int(length) if length.isdigit() else None), None
+        url = urllib.parse.urljoin(url, location)
+    return None, None
+
+
+def remote_size(url):
+    """Content-Length of ``url`` from a HEAD request, or None if unavailable."""
+    return remote_info(url)[0]
+
+
+def pin(manifest, assets):
+    """Write the sizes and hashes the servers publish for ``assets`` into ``manifest``.
+
+    Returns the names that could not be pinned, because their server
+    publishes no sha256.
+    """
+    with open(manifest, encoding="utf-8") as f:
+        data = json.load(f)
+    names = {asset.name for asset in assets}
+    missing = []
+    for entry in data["assets"]:
+        if entry["name"] not in names:
+            continue
+        size, sha256 = remote_info(entry["url"])
+        if not sha256:
+            missing.append(entry["name"])
+            continue
+        entry.update(size=size, sha256=sha256)
+        print(f"✅ {entry['name']}: {size} bytes, sha256 {sha256}")
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(manifest), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    os.replace(tmp_path, manifest)
+    return missing
+
+
+def select(assets, names=None, groups=None):
+    return [asset for asset in assets
+            if (not names or asset.name in names) and (not groups or asset.group in groups)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and verify the model files")
+    parser.add_argument("names", nargs="*", help="Assets to fetch (default: all)")
+    parser.add_argument("--group", action="append", help="Only assets of this group (repeatable)")
+    parser.add_argument("--manifest", default=MANIFEST, help="Paths in it are relative to its directory")
+    parser.add_argument("--lock", default=LOCK_FILE)
+    parser.add_argument("--workers", type=int, default=4, help="Parallel downloads")
+    parser.add_argument("--force", action="store_true", help="Download even if already valid")
+    parser.add_argument("--verify", action="store_true", help="Only check the installed files")
+    parser.add_argument("--pin", action="store_true",
+                        help="Write the sizes and hashes published by the servers into the manifest")
+    args = parser.parse_args()
+
+    manifest = os.path.abspath(args.manifest)
+    assets = select(load_manifest(manifest, os.path.dirname(manifest)), args.names, args.group)
+    if args.pin:
+        missing = pin(manifest, assets)
+        for name in missing:
+            print(f"❌ {name}: the server publishes no sha256 (it will be trusted on first use)")
+        sys.exit(1 if missing else 0)
+
+    fetcher = Fetcher(args.lock, args.workers)
+    if args.verify:
+        failed = 0
+        for asset in assets:
+            ok, reason = fetcher.verify(asset)
+            print(f"{'✅' if ok else '❌'} {asset.name} ({reason})")
+            failed += not ok
+        fetcher.save()
+        sys.exit(1 if failed else 0)
+
+    results = fetcher.fetch_all(assets, args.force)
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
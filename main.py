@@ -1,22 +1,22 @@
-import os
-import shutil
-from backend.modules import stt, tts, lipsync
-from config import PIPER_VOICE_MALE, PIPER_VOICE_FEMALE, OUTPUT_DIR
+import argparse
+from backend.modules import stt, tts, lipsync, metrics
+from config import PIPER_VOICE_MALE, PIPER_VOICE_FEMALE
 
 
 def main():
-    """Run the CLI version by default."""
-    print("Running CLI mode...")
-
-    # Clear previous outputs on each run
-    if os.path.isdir(OUTPUT_DIR):
-        for name in os.listdir(OUTPUT_DIR):
-            path = os.path.join(OUTPUT_DIR, name)
-            if os.path.isfile(path) or os.path.islink(path):
-                os.remove(path)
-            elif os.path.isdir(path):
-                shutil.rmtree(path)
-    
+    """Run the CLI version by default, or the conversation loop with --loop."""
+    parser = argparse.ArgumentParser(description="Speech to lip-synced avatar video")
+    parser.add_argument('--loop', action='store_true',
+                        help="Keep listening and answer every utterance (kiosk mode)")
+    parser.add_argument('--engine', default=None, help="Lipsync engine (default: LIPSYNC_ENGINE)")
+    parser.add_argument('--profile', default=None,
+                        help="Encode profile: preview, balanced or archival (default: ENCODE_PROFILE)")
+    parser.add_argument('--no-barge-in', action='store_true',
+                        help="In loop mode, do not cancel a reply when the user speaks over it")
+    args = parser.parse_args()
+
+    print("Running conversation loop..." if args.loop else "Running CLI mode...")
+
     # Choose voice: 1 = male (Tuga), 2 = female (Dii, default)
     print("Select voice:")
     print("  1) Male (Tuga)")
@@ -29,23 +29,30 @@ def main():
     else:
         voice_model = PIPER_VOICE_FEMALE
         print("Using female voice (Dii)")
-    user_text = stt.transcribe()
-    print("You said:", user_text)
 
-    audio_file = tts.speak(user_text, voice_model=voice_model)
-    video_path = lipsync.generate_lipsync(audio_file)
+    if args.loop:
+        from backend.modules.conversation import Conversation
+        Conversation(voice_model, engine=args.engine, barge_in=not args.no_barge_in,
+                     profile=args.profile).run()
+        return
+
+    with metrics.trace() as request_trace:
+        user_text = stt.transcribe()
+        print("You said:", user_text)
+
+        # Audio stays in memory between TTS and lipsync (no intermediate WAV)
+        audio = tts.speak(user_text, voice_model=voice_model, as_buffer=True)
+        video_path = lipsync.generate_lipsync(audio, engine=args.engine, profile=args.profile)
 
     if video_path:
         print(f"Video created: {video_path}")
-        # Remove intermediate audio file
-        #try:
-            #if os.path.exists(audio_file):
-                #os.remove(audio_file)
-        #except OSError:
-            #pass
     else:
         print("Failed to create video")
 
+    print("Stage timings:")
+    for span in request_trace.spans:
+        print(f"  {span['stage']:<32} {span['wall']:.3f}s")
+
 
 if __name__ == "__main__":
     main()
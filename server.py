@@ -0,0 +1,493 @@
+"""
+Local HTTP rendering service.
+
+    python server.py --port 8000
+
+Endpoints:
+  POST /speak          {"text", "voice", "priority", "wait", "stream"} -> WAV
+  POST /render         {"text", "voice", "avatar" or "face", "engine", "profile" or
+                        "latency_budget", "priority", "wait", "segments"} -> MP4
+  GET  /jobs/{id}         job status as JSON
+  GET  /jobs/{id}/result  the finished WAV/MP4, streamed in chunks
+  GET  /jobs/{id}/hls/index.m3u8  HLS playlist of a "segments" render, and its segments
+  GET  /avatars        registered avatars
+  GET  /metrics        Prometheus text metrics
+  GET  /health
+
+Jobs go through a bounded priority queue; when it is full new requests get
+429. TTS runs in a thread pool (the voice pool is shared per process).
+Wav2Lip renders run in a thread pool too, so they all go to this process's
+one Wav2Lip worker, which batches their frames together; the basic and
+viseme engines render in a process pool. Without ``"wait": true`` a job request answers
+202 with the job id right away. ``"stream": true`` on /speak returns the
+audio as a chunked WAV, sentence by sentence, as it is synthesized.
+``"segments": true`` on /render writes HLS segments instead of one MP4; the
+playlist can be played while the job is still running.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import struct
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+
+from config import (
+    AVATAR_FACE,
+    LIPSYNC_ENGINE,
+    PIPER_VOICE,
+    PIPER_VOICE_FEMALE,
+    PIPER_VOICE_MALE,
+    SERVER_MAX_BODY,
+    SERVER_MAX_STREAMS,
+    SERVER_QUEUE_SIZE,
+    SERVER_RENDER_WORKERS,
+    SERVER_TTS_WORKERS,
+)
+
+VOICES = {"male": PIPER_VOICE_MALE, "female": PIPER_VOICE_FEMALE}
+PRIORITIES = {"high": 0, "normal": 5, "low": 9}
+CHUNK_SIZE = 64 * 1024
+CONTENT_TYPES = {
+    ".mp4": "video/mp4",
+    ".wav": "audio/wav",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s": "video/iso.segment",
+    ".ts": "video/mp2t",
+}
+# Finished jobs kept for GET /jobs/{id}
+MAX_FINISHED_JOBS = 1000
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class Job:
+    def __init__(self, kind, params, priority):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.params = params
+        self.priority = priority
+        self.status = "queued"
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.done = asyncio.Event()
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "created": self.created,
+            "queued_seconds": (self.started or time.time()) - self.created,
+            "run_seconds": (self.finished - self.started) if self.finished and self.started else None,
+            "result": f"/jobs/{self.id}/result" if self.status == "done" else None,
+            "playlist": f"/jobs/{self.id}/hls/index.m3u8" if self.params.get("segments") else None,
+            "error": self.error,
+        }
+
+
+# --- Work run in the executors ---
+
+def synthesize(text, voice_model, audio_path):
+    from backend.modules import tts
+    return tts.speak(text, filename=audio_path, voice_model=voice_model)
+
+
+def render_video(audio_path, face_file, video_path, engine, profile=None, latency_budget=None):
+    from backend.modules import lipsync
+    video = lipsync.generate_lipsync(audio_path, face_file, video_path, engine=engine,
+                                     profile=profile, latency_budget=latency_budget)
+    if not video:
+        raise RuntimeError("lipsync produced no video")
+    return video
+
+
+def render_segments(audio_path, face_file, output_dir, engine, profile=None):
+    from backend.modules import lipsync
+    playlist = lipsync.generate_segments(audio_path, face_file, output_dir, engine=engine,
+                                         profile=profile)
+    if not playlist:
+        raise RuntimeError("lipsync produced no segments")
+    return playlist
+
+
+def stream_wav_header(sample_rate):
+    """WAV header with unknown (maximum) sizes, as used for streamed audio."""
+    return (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+            + b"data" + struct.pack("<I", 0xFFFFFFFF))
+
+
+class RenderService:
+    def __init__(self, queue_size=SERVER_QUEUE_SIZE, tts_workers=SERVER_TTS_WORKERS,
+                 render_workers=SERVER_RENDER_WORKERS, max_streams=SERVER_MAX_STREAMS):
+        self.queue = asyncio.PriorityQueue(maxsize=queue_size)
+        self.jobs = {}
+        self.tts_pool = ThreadPoolExecutor(max_workers=tts_workers, thread_name_prefix="tts")
+        # Spawned, not forked: this process already runs the event loop and thread pools
+        self.render_pool = ProcessPoolExecutor(max_workers=render_workers,
+                                               mp_context=multiprocessing.get_context("spawn"))
+        self.wav2lip_pool = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix="wav2lip")
+        self.worker_count = tts_workers + render_workers
+        self.max_streams = max_streams
+        self.active_streams = 0
+        self._seq = itertools.count()
+        self._workers = []
+
+    async def start(self):
+        from backend.modules import encode
+        from backend.modules.artifacts import store
+        store.start()
+        # Latency budgets fall back to ENCODE_PROFILE until the speeds are measured
+        asyncio.get_running_loop().run_in_executor(None, encode.speeds.calibrate_missing)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        self.tts_pool.shutdown(wait=False, cancel_futures=True)
+        self.render_pool.shutdown(wait=False, cancel_futures=True)
+        self.wav2lip_pool.shutdown(wait=False, cancel_futures=True)
+
+    def pool_for(self, engine):
+        """Executor for a render with ``engine``: Wav2Lip shares one worker, so threads."""
+        from backend.modules.lipsync import WAV2LIP_BACKENDS
+
+        return self.wav2lip_pool if (engine or LIPSYNC_ENGINE) in WAV2LIP_BACKENDS else self.render_pool
+
+    # --- Queue ---
+
+    def submit(self, kind, params, priority):
+        job = Job(kind, params, priority)
+        try:
+            self.queue.put_nowait((priority, next(self._seq), job))
+        except asyncio.QueueFull:
+            raise HTTPError(HTTPStatus.TOO_MANY_REQUESTS, "job queue is full, retry later",
+                            {"Retry-After": "1"})
+        self.jobs[job.id] = job
+        self._forget_old_jobs()
+        return job
+
+    def _forget_old_jobs(self):
+        finished = sorted((job for job in self.jobs.values() if job.done.is_set()),
+                          key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    async def _worker(self):
+        from backend.modules.artifacts import store
+
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+            params = job.params
+            # Each job gets its own directory, published on success; segment
+            # jobs write in place so the playlist can be played meanwhile
+            artifact = None
+            try:
+                artifact = store.create(job.kind, job.id, live=bool(params.get("segments")))
+                # For renders the audio is only an intermediate
+                audio_path = artifact.scratch("speech.wav") if job.kind == "render" \
+                    else artifact.path("speech.wav")
+                await loop.run_in_executor(self.tts_pool, synthesize,
+                                           params["text"], params["voice"], audio_path)
+                result = audio_path
+                if job.kind == "render" and params["segments"]:
+                    result = await loop.run_in_executor(
+                        self.pool_for(params["engine"]), render_segments,
+                        audio_path, params["face"], artifact.directory, params["engine"],
+                        params["profile"])
+                elif job.kind == "render":
+                    result = await loop.run_in_executor(
+                        self.pool_for(params["engine"]), render_video,
+                        audio_path, params["face"], artifact.path("output.mp4"), params["engine"],
+                        params["profile"], params["latency_budget"])
+                artifact.commit()
+                job.result = artifact.path(os.path.basename(result))
+                job.status = "done"
+            except Exception as e:
+                if artifact is not None:
+                    artifact.discard()
+                job.status = "failed"
+                job.error = f"{type(e).__name__}: {e}"
+            finally:
+                job.finished = time.time()
+                job.done.set()
+                self.queue.task_done()
+
+    @staticmethod
+    def segments_dir(job):
+        from backend.modules.artifacts import store
+        return store.directory(job.id)
+
+    # --- Request parsing ---
+
+    @staticmethod
+    def parse_job(body, kind):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "body must be JSON")
+        text = (data.get("text") or "").strip()
+        if not text:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "'text' is required")
+
+        voice = data.get("voice") or ""
+        priority = data.get("priority", "normal")
+        if isinstance(priority, str):
+            if priority not in PRIORITIES:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"priority must be one of {list(PRIORITIES)}")
+            priority = PRIORITIES[priority]
+
+        params = {"text": text, "voice": VOICES.get(voice.lower(), voice) or PIPER_VOICE}
+        if kind == "render":
+            avatar = data.get("avatar")
+            if avatar:
+                from backend.modules import avatars
+                if not avatars.is_registered(avatar):
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, f"unknown avatar: {avatar}")
+            params["face"] = avatar or data.get("face") or AVATAR_FACE
+            params["engine"] = data.get("engine")
+            params["profile"] = data.get("profile")
+            if params["profile"]:
+                from backend.modules import encode
+                if params["profile"] not in encode.PROFILES:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST,
+                                    f"profile must be one of {list(encode.PROFILES)}")
+            params["latency_budget"] = data.get("latency_budget")
+            if params["latency_budget"] is not None:
+                try:
+                    params["latency_budget"] = float(params["latency_budget"])
+                except (TypeError, ValueError):
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "latency_budget must be a number of seconds")
+            params["segments"] = bool(data.get("segments"))
+        return params, int(priority), bool(data.get("wait")), bool(data.get("stream"))
+
+    # --- Handlers ---
+
+    async def handle(self, method, path, body, writer):
+        if method == "GET" and path == "/health":
+            return await send_json(writer, HTTPStatus.OK, {
+                "status": "ok", "queued": self.queue.qsize(), "queue_size": self.queue.maxsize,
+                "streams": self.active_streams})
+
+        if method == "GET" and path == "/avatars":
+            from backend.modules import avatars
+            return await send_json(writer, HTTPStatus.OK, {"avatars": avatars.list_avatars()})
+
+        if method == "GET" and path == "/metrics":
+            from backend.modules import metrics
+            data = metrics.registry.export_prometheus().encode()
+            return await send(writer, HTTPStatus.OK, data, "text/plain; version=0.0.4")
+
+        if method == "POST" and path in ("/speak", "/render"):
+            kind = path[1:]
+            params, priority, wait, stream = self.parse_job(body, kind)
+            if kind == "speak" and stream:
+                return await self.stream_speech(params, writer)
+            job = self.submit(kind, params, priority)
+            # Segments are fetched through the playlist while the job runs
+            if not wait or params.get("segments"):
+                return await send_json(writer, HTTPStatus.ACCEPTED, job.as_dict(),
+                                       {"Location": f"/jobs/{job.id}"})
+            await job.done.wait()
+            if job.status != "done":
+                return await send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, job.as_dict())
+            return await send_file(writer, job.result)
+
+        if method == "GET" and path.startswith("/jobs/"):
+            parts = path.split("/")
+            job = self.jobs.get(parts[2]) if len(parts) > 2 else None
+            if job is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, "unknown job")
+            if len(parts) == 3:
+                return await send_json(writer, HTTPStatus.OK, job.as_dict())
+            if len(parts) == 4 and parts[3] == "result":
+                if job.status != "done":
+                    raise HTTPError(HTTPStatus.CONFLICT, f"job is {job.status}")
+                return await send_file(writer, job.result)
+            if len(parts) == 5 and parts[3] == "hls" and job.params.get("segments"):
+                name = parts[4]
+                path = os.path.join(self.segments_dir(job), name)
+                if name.startswith(".") or os.path.splitext(name)[1] not in CONTENT_TYPES \
+                        or not os.path.isfile(path):
+                    raise HTTPError(HTTPStatus.NOT_FOUND, "segment not available (yet)")
+                return await send_file(writer, path, {"Cache-Control": "no-cache"})
+
+        raise HTTPError(HTTPStatus.NOT_FOUND, "not found")
+
+    async def stream_speech(self, params, writer):
+        """Stream a chunked WAV while the text is synthesized sentence by sentence."""
+        if self.active_streams >= self.max_streams:
+            raise HTTPError(HTTPStatus.TOO_MANY_REQUESTS, "too many streams, retry later",
+                            {"Retry-After": "1"})
+        self.active_streams += 1
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        end = object()
+
+        def produce():
+            from backend.modules import tts
+            stats = tts.StreamStats()
+            try:
+                for pcm in tts.speak_stream(params["text"], params["voice"], stats):
+                    loop.call_soon_threadsafe(chunks.put_nowait, (stats.sample_rate, pcm))
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, end)
+
+        try:
+            producer = loop.run_in_executor(self.tts_pool, produce)
+            item = await chunks.get()
+            if isinstance(item, Exception):
+                raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, str(item))
+            if item is end:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "nothing to synthesize")
+
+            await send_headers(writer, HTTPStatus.OK, "audio/wav", chunked=True)
+            sample_rate, pcm = item
+            await send_chunk(writer, stream_wav_header(sample_rate) + pcm)
+            while True:
+                item = await chunks.get()
+                if item is end or isinstance(item, Exception):
+                    break
+                await send_chunk(writer, item[1])
+            await send_chunk(writer, b"")
+            await producer
+        finally:
+            self.active_streams -= 1
+
+
+# --- Minimal HTTP/1.1 plumbing (one request per connection) ---
+
+async def send_headers(writer, status, content_type, length=None, headers=None, chunked=False):
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}",
+             "Connection: close"]
+    if chunked:
+        lines.append("Transfer-Encoding: chunked")
+    elif length is not None:
+        lines.append(f"Content-Length: {length}")
+    for name, value in (headers or {}).items():
+        lines.append(f"{name}: {value}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+
+async def send_chunk(writer, data):
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+
+async def send(writer, status, data, content_type, headers=None):
+    await send_headers(writer, status, content_type, len(data), headers)
+    writer.write(data)
+    await writer.drain()
+
+
+async def send_json(writer, status, payload, headers=None):
+    await send(writer, status, json.dumps(payload).encode(), "application/json", headers)
+
+
+async def send_file(writer, path, headers=None):
+    content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+    await send_headers(writer, HTTPStatus.OK, content_type, headers=headers, chunked=True)
+    with open(path, "rb") as f:
+        while True:
+            data = await asyncio.to_thread(f.read, CHUNK_SIZE)
+            if not data:
+                break
+            await send_chunk(writer, data)
+    await send_chunk(writer, b"")
+
+
+async def read_request(reader):
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "malformed request line")
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length") or 0)
+    if length > SERVER_MAX_BODY:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], body
+
+
+def make_handler(service):
+    async def handle_connection(reader, writer):
+        try:
+            request = await read_request(reader)
+            if request is not None:
+                await service.handle(*request, writer)
+        except HTTPError as e:
+            await send_json(writer, e.status, {"error": e.message}, e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            await send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+        finally:
+            writer.close()
+    return handle_connection
+
+
+async def serve(host, port, service):
+    await service.start()
+    server = await asyncio.start_server(make_handler(service), host, port)
+    print(f"Serving on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local TTS + lipsync HTTP service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--queue-size', type=int, default=SERVER_QUEUE_SIZE)
+    parser.add_argument('--tts-workers', type=int, default=SERVER_TTS_WORKERS)
+    parser.add_argument('--render-workers', type=int, default=SERVER_RENDER_WORKERS)
+    args = parser.parse_args()
+
+    async def run():
+        service = RenderService(args.queue_size, args.tts_workers, args.render_workers)
+        await serve(args.host, args.port, service)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
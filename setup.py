@@ -9,11 +9,15 @@ import subprocess
 import sys
 from pathlib import Path
 
+from fetch_assets import Fetcher, load_manifest, select
+
 class TTSSetup:
     def __init__(self):
         self.project_root = Path(__file__).parent
         self.wav2lip_dir = self.project_root / "backend" / "extras" / "Wav2Lip"
         self.checkpoint_path = self.wav2lip_dir / "checkpoints" / "wav2lip_gan.pth"
+        self.assets = load_manifest()
+        self.fetcher = Fetcher()
         
     def print_header(self, title):
         """Print formatted section header"""
@@ -128,152 +132,90 @@ class TTSSetup:
             print(f"Error applying fix: {e}")
             return False
 
+    def download_assets(self, groups=None):
+        """Download the assets.json entries of ``groups`` (default: all) in parallel.
+
+        Files that are already present and match their recorded checksum are
+        skipped; interrupted downloads resume where they stopped.
+        Returns {asset name: ok}.
+        """
+        assets = select(self.assets, groups=groups)
+        print(f"Fetching {len(assets)} asset(s) with {self.fetcher.workers} parallel downloads...")
+        results = self.fetcher.fetch_all(assets)
+
+        failed = [asset for asset, result in zip(assets, results) if not result["ok"]]
+        if failed:
+            print("\nManual download fallback:")
+            for asset in failed:
+                print(f"{asset.url}")
+                print(f"  Save as: {asset.path}")
+                if asset.extract:
+                    print(f"  Extract to: {asset.extract_to}")
+        return {result["name"]: result["ok"] for result in results}
+
     def download_wav2lip_checkpoint(self):
         """Download Wav2Lip checkpoint from Hugging Face"""
-        checkpoint_dir = self.wav2lip_dir / "checkpoints"
-        checkpoint_dir.mkdir(parents=True, exist_ok=True)
-        
-        if self.checkpoint_path.exists():
-            size_mb = self.checkpoint_path.stat().st_size // (1024 * 1024)
-            print(f"Checkpoint already exists ({size_mb}MB)")
-            return True
-        
-        print("Downloading Wav2Lip checkpoint from Hugging Face...")
-        checkpoint_url = "https://huggingface.co/Nekochu/Wav2Lip/resolve/fb925b05f0d353850ee0c56810e4545e274e2b5a/wav2lip_gan.pth"
-        
-        try:
-            import requests
-            response = requests.get(checkpoint_url, stream=True)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            print(f"Downloading {total_size // (1024*1024)}MB...")
-            
-            with open(self.checkpoint_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            percent = (downloaded / total_size) * 100
-                            print(f"\rProgress: {percent:.1f}%", end='', flush=True)
-            
-            print(f"\nCheckpoint downloaded successfully!")
-            size_mb = self.checkpoint_path.stat().st_size // (1024 * 1024)
-            print(f"File size: {size_mb}MB")
-            return True
-            
-        except Exception as e:
-            print(f"\nFailed to download checkpoint: {e}")
-            print("\nManual download fallback:")
-            print(f"Please download manually from:")
-            print(f"{checkpoint_url}")
-            print(f"Save as: {self.checkpoint_path}")
+        return all(self.download_assets(["wav2lip"]).values())
+
+    def export_wav2lip_onnx(self, quantize=True):
+        """Export the Wav2Lip checkpoint to ONNX (plus an int8 copy) for CPU inference"""
+        onnx_path = self.checkpoint_path.with_suffix(".onnx")
+        int8_path = self.checkpoint_path.with_suffix(".int8.onnx")
+
+        if not self.checkpoint_path.exists():
+            print("Wav2Lip checkpoint missing, skipping ONNX export")
             return False
 
+        if onnx_path.exists() and (int8_path.exists() or not quantize):
+            print("Wav2Lip ONNX model already exported")
+            return True
+
+        cmd = f'"{sys.executable}" -m backend.modules.wav2lip_onnx export'
+        if quantize:
+            cmd += " --quantize"
+        success = self.run_command(cmd, "Exporting Wav2Lip to ONNX")
+
+        if success:
+            print("Wav2Lip ONNX export complete (use LIPSYNC_ENGINE=wav2lip_onnx or WAV2LIP_BACKEND=onnx)")
+        else:
+            print("ONNX export failed - the PyTorch Wav2Lip path still works")
+        return success
+
+    def calibrate_encoding(self):
+        """Measure the encode speed of each profile, used to pick one from a latency budget"""
+        success = self.run_command(f'"{sys.executable}" -m backend.modules.encode calibrate',
+                                   "Measuring encode speed")
+        if not success:
+            print("Encode calibration failed - latency budgets will use ENCODE_PROFILE")
+        return success
+
 
 
     def download_vosk_model(self):
         """Download Vosk model"""
-        models_dir = self.project_root / "backend" / "extras" / "models"
-        model_dir = models_dir / "vosk-model-small-pt-0.3"
-        
-        if model_dir.exists():
-            print("Vosk model already downloaded")
-            return True
-        
-        print("Downloading Vosk model...")
-        models_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Try to download
-        download_url = "https://alphacephei.com/vosk/models/vosk-model-small-pt-0.3.zip"
-        zip_file = models_dir / "vosk-model-small-pt-0.3.zip"
-        
-        success = self.run_command(f"curl -L -o {zip_file} {download_url}", "Downloading Vosk model")
-        
-        if success and zip_file.exists():
-            # Extract
-            extract_success = self.run_command(f"cd {models_dir} && unzip -q {zip_file}", "Extracting model")
-            if extract_success:
-                zip_file.unlink()  # Remove zip file
-                print("Vosk model downloaded and extracted")
-                return True
-        
-        print("Failed to download Vosk model")
-        print("Please download manually:")
-        print(f"1. Download: {download_url}")
-        print(f"2. Extract to: {models_dir}")
-        return False
+        return all(self.download_assets(["models"]).values())
 
     def download_piper_voices(self):
         """Download Piper voice models"""
+        return all(self.download_assets(["voices"]).values()) and self.copy_dii_config()
+
+    def copy_dii_config(self):
+        """Duplicate the Tuga JSON config for the Dii voice, which ships without one"""
         voices_dir = self.project_root / "backend" / "extras" / "voices"
-        voices_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Tuga voice (official Rhasspy model)
-        tuga_onnx = voices_dir / "pt_PT-tugao-medium.onnx"
         tuga_json = voices_dir / "pt_PT-tugao-medium.onnx.json"
-
-        # Dii voice (OpenVoiceOS model)
-        dii_onnx = voices_dir / "dii_pt-PT.onnx"
         dii_json = voices_dir / "dii_pt-PT.onnx.json"
 
-        # If all four files exist, nothing to do
-        if all(p.exists() for p in [tuga_onnx, tuga_json, dii_onnx, dii_json]):
-            print("Piper voice models already downloaded (Tuga + Dii)")
+        if dii_json.exists():
             return True
-
-        print("Downloading Piper voice models (Tuga + Dii)...")
-
-        # Download URLs
-        tuga_onnx_url = "https://huggingface.co/rhasspy/piper-voices/resolve/main/pt/pt_PT/tug%C3%A3o/medium/pt_PT-tug%C3%A3o-medium.onnx"
-        tuga_json_url = "https://huggingface.co/rhasspy/piper-voices/resolve/main/pt/pt_PT/tug%C3%A3o/medium/pt_PT-tug%C3%A3o-medium.onnx.json"
-        dii_onnx_url = "https://huggingface.co/OpenVoiceOS/phoonnx_pt-PT_dii_tugaphone/resolve/main/dii_pt-PT.onnx?download=true"
-
-        success = True
-
-        # Download Tuga ONNX
-        if not tuga_onnx.exists():
-            print("Downloading Tuga ONNX model...")
-            tuga_onnx_success = self.run_command(f"curl -L -o {tuga_onnx} '{tuga_onnx_url}'", "Downloading Tuga ONNX model")
-            if not tuga_onnx_success:
-                success = False
-
-        # Download Tuga JSON config
         if not tuga_json.exists():
-            print("Downloading Tuga JSON config...")
-            tuga_json_success = self.run_command(f"curl -L -o {tuga_json} '{tuga_json_url}'", "Downloading Tuga JSON config")
-            if not tuga_json_success:
-                success = False
-
-        # Download Dii ONNX
-        if not dii_onnx.exists():
-            print("Downloading Dii ONNX model...")
-            dii_onnx_success = self.run_command(f"curl -L -o {dii_onnx} '{dii_onnx_url}'", "Downloading Dii ONNX model")
-            if not dii_onnx_success:
-                success = False
-
-        # Duplicate Tuga JSON for Dii voice config, as requested
-        if tuga_json.exists() and not dii_json.exists():
-            try:
-                dii_json.write_bytes(tuga_json.read_bytes())
-                print(f"Copied {tuga_json.name} to {dii_json.name}")
-            except Exception as e:
-                print(f"Warning: could not copy {tuga_json.name} to {dii_json.name}: {e}")
-                success = False
-
-        if success and all(p.exists() for p in [tuga_onnx, tuga_json, dii_onnx, dii_json]):
-            print("Piper voice models downloaded successfully (Tuga + Dii)")
+            print(f"Missing {tuga_json.name}, cannot create {dii_json.name}")
+            return False
+        try:
+            dii_json.write_bytes(tuga_json.read_bytes())
+            print(f"Copied {tuga_json.name} to {dii_json.name}")
             return True
-        else:
-            print("Failed to download Piper voice models")
-            print("Please download manually:")
-            print(f"1. Tuga ONNX: {tuga_onnx_url}")
-            print(f"2. Tuga JSON: {tuga_json_url}")
-            print(f"3. Dii ONNX: {dii_onnx_url}")
-            print(f"4. Save to: {voices_dir}")
+        except Exception as e:
+            print(f"Warning: could not copy {tuga_json.name} to {dii_json.name}: {e}")
             return False
 
     def verify_setup(self):
@@ -283,8 +225,7 @@ class TTSSetup:
         checks = [
             ("Python dependencies", self.project_root / "requirements.txt"),
             ("Wav2Lip repository", self.wav2lip_dir),
-            ("Vosk model", self.project_root / "backend" / "extras" / "models" / "vosk-model-small-pt-0.3"),
-            ("TTS voice models", self.project_root / "backend" / "extras" / "voices"),
+            ("Dii voice config", self.project_root / "backend" / "extras" / "voices" / "dii_pt-PT.onnx.json"),
             ("Avatar image", self.project_root / "backend" / "extras" / "photos" / "face.jpg"),
         ]
         
@@ -296,13 +237,32 @@ class TTSSetup:
                 print(f"❌ {name} - Missing: {path}")
                 all_good = False
         
+        # Downloaded files are checked against their recorded checksums
+        for asset in select(self.assets, groups=["models", "voices"]):
+            ok, reason = self.fetcher.verify(asset)
+            if ok:
+                print(f"✅ {asset.name}")
+            else:
+                print(f"❌ {asset.name} - {reason}")
+                all_good = False
+
         # Check checkpoint separately
-        if self.checkpoint_path.exists():
+        checkpoint = select(self.assets, names=["wav2lip_gan"])[0]
+        ok, reason = self.fetcher.verify(checkpoint)
+        if ok:
             size_mb = self.checkpoint_path.stat().st_size // (1024 * 1024)
             print(f"✅ Wav2Lip checkpoint ({size_mb}MB)")
         else:
-            print(f"❌ Wav2Lip checkpoint - Optional: {self.checkpoint_path}")
+            print(f"❌ Wav2Lip checkpoint ({reason}) - Optional: {self.checkpoint_path}")
             print("   (Basic video generation will work without this)")
+        self.fetcher.save()
+
+        onnx_path = self.checkpoint_path.with_suffix(".onnx")
+        if onnx_path.exists():
+            print("✅ Wav2Lip ONNX model")
+        else:
+            print(f"❌ Wav2Lip ONNX model - Optional: {onnx_path}")
+            print("   (Run: python setup.py --onnx-only)")
         
         return all_good
 
@@ -331,13 +291,15 @@ class TTSSetup:
             print("Failed to apply compatibility fixes")
             return False
         
-        # Download checkpoint
-        checkpoint_ready = self.download_wav2lip_checkpoint()
-        
-        # Download models
-        self.print_header("Step 3: Language Models")
-        self.download_vosk_model()
-        self.download_piper_voices()
+        # Download checkpoint, STT model and voices together
+        self.print_header("Step 3: Models")
+        downloaded = self.download_assets()
+        self.copy_dii_config()
+
+        checkpoint_ready = downloaded.get("wav2lip_gan", False)
+        if checkpoint_ready:
+            self.export_wav2lip_onnx()
+        self.calibrate_encoding()
         
         # Verify setup
         setup_complete = self.verify_setup()
@@ -370,10 +332,18 @@ def main():
             setup.clone_wav2lip()
             setup.fix_wav2lip_compatibility()
             setup.download_wav2lip_checkpoint()
+            setup.export_wav2lip_onnx()
+        elif sys.argv[1] == "--onnx-only":
+            setup.print_header("Wav2Lip ONNX Export Only")
+            setup.export_wav2lip_onnx()
+        elif sys.argv[1] == "--models-only":
+            setup.print_header("Model Downloads Only")
+            setup.download_assets()
+            setup.copy_dii_config()
         elif sys.argv[1] == "--verify":
             setup.verify_setup()
         else:
-            print("Usage: python setup.py [--requirements-only|--wav2lip-only|--verify]")
+            print("Usage: python setup.py [--requirements-only|--wav2lip-only|--onnx-only|--models-only|--verify]")
     else:
         setup.run_complete_setup()
 
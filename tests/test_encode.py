@@ -0,0 +1,28 @@
+import json
+
+from backend.modules.encode import EncodeSpeed
+
+
+def test_observe_keeps_entries_written_by_other_processes(tmp_path):
+    path = str(tmp_path / "speeds.json")
+    server, worker = EncodeSpeed(path), EncodeSpeed(path)
+
+    server.observe("balanced", 1000, 1.0)
+    worker.observe("inference.torch", 50, 1.0)
+    server.observe("preview", 4000, 1.0)
+
+    with open(path, encoding="utf-8") as f:
+        rates = json.load(f)["rates"]
+    assert rates == {"balanced": 1000, "inference.torch": 50, "preview": 4000}
+
+
+def test_observe_smooths_from_the_latest_file_value(tmp_path):
+    path = str(tmp_path / "speeds.json")
+    first, second = EncodeSpeed(path), EncodeSpeed(path)
+
+    first.observe("balanced", 1000, 1.0)
+    second.observe("balanced", 2000, 1.0)
+    first.observe("balanced", 2000, 1.0)
+
+    # 1000 -> 1300 (second) -> 1510 (first, starting from 1300 not 1000)
+    assert abs(EncodeSpeed(path).rate("balanced") - 1510) < 1e-6
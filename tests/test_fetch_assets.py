@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fetch_assets
+from fetch_assets import Asset, Fetcher
+
+CONTENT = os.urandom(300_000)
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves CONTENT at /file with Range support, and at /lfs behind a
+    Hugging Face style redirect that publishes its size and sha256."""
+
+    ranges = []
+    published = SHA256
+
+    def log_message(self, *args):
+        pass
+
+    def _redirect(self):
+        self.send_response(302)
+        self.send_header("Location", "/file")
+        self.send_header("X-Linked-Etag", f'"{self.published}"')
+        self.send_header("X-Linked-Size", str(len(CONTENT)))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        if self.path == "/lfs":
+            return self._redirect()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENT)))
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/lfs":
+            return self._redirect()
+        header = self.headers.get("Range")
+        Handler.ranges.append(header)
+        if not header:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(CONTENT)))
+            self.end_headers()
+            self.wfile.write(CONTENT)
+            return
+        start = int(header.split("=")[1].rstrip("-"))
+        if start >= len(CONTENT):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(CONTENT)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        self.send_header("Content-Length", str(len(CONTENT) - start))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:])
+
+
+@pytest.fixture
+def server():
+    Handler.ranges = []
+    Handler.published = SHA256
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make(tmp_path, url, **fields):
+    asset = Asset("model", url, "model.bin", root=str(tmp_path), **fields)
+    return asset, Fetcher(str(tmp_path / "assets.lock.json"), workers=1)
+
+
+def test_resumes_partial_download(tmp_path, server):
+    asset, fetcher = make(tmp_path, server + "/file", sha256=SHA256)
+    with open(asset.path + fetch_assets.PARTIAL, "wb") as f:
+        f.write(CONTENT[:100_000])
+
+    result = fetcher.fetch(asset)
+
+    assert result["ok"], result["error"]
+    assert result["fetched"] == len(CONTENT) - 100_000
+    assert Handler.ranges == ["bytes=100000-"]
+    with open(asset.path, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_corrupt_partial_download_starts_over(tmp_path, server):
+    asset, fetcher = make(tmp_path, server + "/file", sha256=SHA256)
+    with open(asset.path + fetch_assets.PARTIAL, "wb") as f:
+        f.write(b"\0" * 100_000)
+
+    result = fetcher.fetch(asset)
+
+    assert result["ok"], result["error"]
+    assert Handler.ranges == ["bytes=100000-", None]
+    assert fetch_assets.file_sha256(asset.path) == SHA256
+
+
+def test_corrupt_installed_file_is_replaced(tmp_path, server):
+    asset, fetcher = make(tmp_path, server + "/file", sha256=SHA256)
+    with open(asset.path, "wb") as f:
+        f.write(CONTENT[:-1] + b"\0")
+
+    assert fetcher.verify(asset) == (False, "checksum mismatch")
+    assert fetcher.fetch(asset)["ok"]
+    assert fetcher.verify(asset)[0]
+    assert fetch_assets.file_sha256(asset.path) == SHA256
+
+
+def test_oversized_partial_is_not_taken_as_complete(tmp_path, server):
+    # No size or sha256 known: the 416 answer must not be trusted blindly
+    asset, fetcher = make(tmp_path, server + "/file")
+    with open(asset.path + fetch_assets.PARTIAL, "wb") as f:
+        f.write(CONTENT + b"trailing garbage")
+
+    result = fetcher.fetch(asset)
+
+    assert result["ok"], result["error"]
+    assert Handler.ranges[-1] is None
+    assert fetch_assets.file_sha256(asset.path) == SHA256
+
+
+def test_published_hash_is_checked(tmp_path, server):
+    assert fetch_assets.remote_info(server + "/lfs") == (len(CONTENT), SHA256)
+
+    Handler.published = "0" * 64
+    asset, fetcher = make(tmp_path, server + "/lfs")
+    result = fetcher.fetch(asset)
+
+    assert not result["ok"]
+    assert "checksum mismatch" in result["error"]
+    assert not os.path.exists(asset.path)
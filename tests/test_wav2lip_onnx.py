@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+
+from backend.modules import wav2lip_onnx
+from backend.modules.wav2lip_worker import load_model
+
+
+@pytest.fixture(scope="module")
+def model():
+    try:
+        return load_model(random_init=True)
+    except ImportError as e:
+        pytest.skip(f"Wav2Lip sources not installed ({e})")
+
+
+def test_onnx_matches_torch_per_frame(model, tmp_path):
+    onnx_path = wav2lip_onnx.export(str(tmp_path / "wav2lip.onnx"), model=model)
+
+    result = wav2lip_onnx.compare(model, onnx_path, frames=16, batch_size=8, threads=1)
+
+    # In 8-bit pixel levels: every frame within one level on average
+    assert result["worst_frame_mean_abs_diff"] < 1.0
+    assert result["max_abs_diff"] < 8.0
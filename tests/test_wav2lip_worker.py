@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+import threading
+import time
+import wave
+
+import pytest
+
+from backend.modules.wav2lip_worker import WAV2LIP_PATH, Wav2LipWorker, _Replies, serve
+
+
+def test_replies_are_routed_by_id():
+    replies = _Replies()
+    first, second = replies.expect(1), replies.expect(2)
+
+    replies.deliver({"id": 2, "ok": True, "outfile": "b.mp4"})
+    replies.deliver({"id": 1, "ok": True, "outfile": "a.mp4"})
+
+    assert first.get_nowait()["outfile"] == "a.mp4"
+    assert second.get_nowait()["outfile"] == "b.mp4"
+    assert first.empty() and second.empty()
+
+
+def test_replies_for_unknown_or_forgotten_ids_are_dropped():
+    replies = _Replies()
+    waiting = replies.expect(1)
+    replies.expect(2)
+    replies.forget(2)
+
+    replies.deliver({"id": 2, "ok": True})
+    replies.deliver({"id": 3, "ok": True})
+    replies.deliver({"ok": False, "error": "no id"})
+
+    assert waiting.empty()
+
+
+def test_concurrent_waiters_each_get_their_reply():
+    replies = _Replies()
+    queues = {req_id: replies.expect(req_id) for req_id in range(8)}
+    received = {}
+
+    def wait(req_id):
+        received[req_id] = queues[req_id].get(timeout=5)["value"]
+
+    threads = [threading.Thread(target=wait, args=(req_id,)) for req_id in queues]
+    for thread in threads:
+        thread.start()
+    for req_id in reversed(range(8)):
+        replies.deliver({"id": req_id, "value": req_id * 10})
+    for thread in threads:
+        thread.join()
+
+    assert received == {req_id: req_id * 10 for req_id in range(8)}
+
+
+def test_close_wakes_every_waiter_and_refuses_new_requests():
+    replies = _Replies()
+    waiting = [replies.expect(req_id) for req_id in range(3)]
+
+    replies.close()
+
+    assert [q.get_nowait() for q in waiting] == [None, None, None]
+    with pytest.raises(RuntimeError):
+        replies.expect(4)
+
+
+class FakeEngine:
+    """Stands in for Wav2LipEngine: a render of face "<seconds>" takes that long."""
+
+    scheduler = None
+    last_batching = None
+    last_timings = {}
+
+    def render(self, audio, face, outfile, should_stop=None, profile=None):
+        from backend.modules.segments import RenderCancelled
+
+        deadline = time.monotonic() + float(face)
+        while time.monotonic() < deadline:
+            if should_stop():
+                raise RenderCancelled("render cancelled")
+            time.sleep(0.01)
+        return outfile
+
+
+@pytest.fixture
+def worker():
+    """serve() on a thread, talking JSON lines over two pipes."""
+    to_worker, from_worker = os.pipe(), os.pipe()
+    stdin = os.fdopen(to_worker[0], "r")
+    stdout = os.fdopen(from_worker[1], "w")
+    requests = os.fdopen(to_worker[1], "w")
+    replies = os.fdopen(from_worker[0], "r")
+    thread = threading.Thread(target=serve, args=(FakeEngine(), stdin, stdout, 4), daemon=True)
+    thread.start()
+    assert json.loads(replies.readline())["ready"]
+
+    def send(message):
+        requests.write(json.dumps(message) + "\n")
+        requests.flush()
+
+    yield send, lambda: json.loads(replies.readline())
+    send({"id": -1, "cmd": "shutdown"})
+    thread.join(timeout=5)
+    # EOF ends the request reader, which holds stdin until then
+    requests.close()
+    for reader in [t for t in threading.enumerate() if t.name == "wav2lip-requests"]:
+        reader.join(timeout=5)
+    for f in (stdin, stdout, replies):
+        f.close()
+
+
+def test_serve_answers_concurrent_renders_by_id(worker):
+    send, receive = worker
+    for req_id, seconds in ((1, 0.6), (2, 0.1), (3, 0.3)):
+        send({"id": req_id, "cmd": "render", "audio": "a.wav", "face": str(seconds),
+              "outfile": f"{req_id}.mp4"})
+
+    answers = [receive() for _ in range(3)]
+
+    assert [answer["id"] for answer in answers] == [2, 3, 1]
+    assert all(answer["ok"] and answer["outfile"] == f"{answer['id']}.mp4" for answer in answers)
+
+
+def test_serve_cancels_only_the_target(worker):
+    send, receive = worker
+    send({"id": 1, "cmd": "render", "audio": "a.wav", "face": "0.3", "outfile": "1.mp4"})
+    send({"id": 2, "cmd": "render", "audio": "a.wav", "face": "5", "outfile": "2.mp4"})
+    send({"id": 3, "cmd": "cancel", "target": 2})
+    send({"id": 4, "cmd": "ping"})
+
+    answers = {answer["id"]: answer for answer in (receive() for _ in range(3))}
+
+    assert answers[4]["ok"]
+    assert answers[2]["cancelled"]
+    assert answers[1]["ok"] and answers[1]["outfile"] == "1.mp4"
+
+
+# --- A real worker process running an untrained network (--random-init) ---
+
+@pytest.fixture(scope="module")
+def live_worker(tmp_path_factory):
+    pytest.importorskip("torch")
+    np = pytest.importorskip("numpy")
+    cv2 = pytest.importorskip("cv2")
+    if not os.path.isdir(os.path.join(WAV2LIP_PATH, "models")):
+        pytest.skip("Wav2Lip sources not installed (python setup.py --wav2lip-only)")
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg not installed")
+    from backend.modules import face_cache
+
+    root = tmp_path_factory.mktemp("worker")
+    face = str(root / "face.png")
+    cv2.imwrite(face, np.random.default_rng(0).integers(0, 255, (256, 256, 3), dtype=np.uint8))
+    audio = str(root / "speech.wav")
+    with wave.open(audio, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(np.zeros(16000, dtype="<i2").tobytes())
+
+    # The worker reads its caches from the environment; a cached face box
+    # spares it the face detector, which finds nothing in noise
+    env = {"FACE_CACHE_DIR": str(root / "faces"), "ARTIFACT_DIR": str(root / "jobs"),
+           "ENCODE_SPEED_FILE": str(root / "encode_speed.json")}
+    key = face_cache.file_hash(face)
+    face_cache.FaceCache(env["FACE_CACHE_DIR"])._write(
+        key, face_cache.build(cv2.imread(face), lambda image: (64, 192, 64, 192), key))
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+
+    worker = Wav2LipWorker(extra_args=["--random-init", "--backend", "torch", "--device", "cpu"])
+    yield worker, audio, face, root
+    worker.stop()
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+def test_live_worker_renders(live_worker):
+    worker, audio, face, root = live_worker
+    outfile = str(root / "render.mp4")
+
+    assert worker.render(audio, face, outfile, timeout=120) == outfile
+    assert os.path.getsize(outfile) > 0
+
+
+def test_live_worker_answers_health_checks(live_worker):
+    worker, _, _, _ = live_worker
+    worker.ensure_running()
+
+    assert worker.ping(timeout=10)
+    assert worker.stats(timeout=10) is not None
+
+
+def test_live_worker_restarts_and_retries_after_a_crash(live_worker):
+    worker, audio, face, root = live_worker
+    worker.ensure_running()
+    restarts = worker.restarts
+    send = worker._send
+    crashed = []
+
+    def send_then_crash(proc, payload):
+        send(proc, payload)
+        if payload.get("cmd") == "render" and not crashed:
+            crashed.append(proc.pid)
+            proc.kill()
+
+    worker._send = send_then_crash
+    try:
+        outfile = str(root / "retried.mp4")
+        assert worker.render(audio, face, outfile, timeout=120) == outfile
+    finally:
+        del worker._send
+
+    assert crashed
+    assert worker.restarts == restarts + 1
+    assert worker._proc.pid != crashed[0]
+    assert os.path.getsize(outfile) > 0